@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+artifact_cache.py - A content-addressed cache for the outputs of the
+one-time harness steps (dataset generation, key generation, DB encryption).
+
+Entries are keyed by a hash of the instance size, the seed, and the
+contents of the code that produces them. Files are hard-linked into and out
+of the cache when possible (falling back to copying), so storing and
+restoring even multi-GB artifacts takes seconds.
+
+NOTE: since files are hard-linked, anything that rewrites a cached file
+in place would also modify the cache. The harness steps always create
+fresh files (the io directory is removed at the start of each run, and
+generate_dataset unlinks its outputs before writing them).
+"""
+# Copyright (c) 2025 HomomorphicEncryption.org
+# All rights reserved.
+#
+# This software is licensed under the terms of the Apache v2 License.
+# See the LICENSE.md file for details.
+import os
+import json
+import shutil
+import hashlib
+from pathlib import Path
+
+def file_digest(path: Path, h=None):
+    """Hash the contents of a file into h (a new sha256 if None)."""
+    h = h or hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h
+
+def link_or_copy(src: Path, dst: Path):
+    """Hard-link src to dst, or copy it if linking is not possible."""
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+def link_tree(src: Path, dst: Path):
+    """Hard-link (or copy) all the files under src into dst."""
+    for root, _, files in os.walk(src):
+        for name in files:
+            s = Path(root) / name
+            link_or_copy(s, dst / s.relative_to(src))
+
+class ArtifactCache:
+    """A directory of cached artifacts, one sub-directory per key."""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+
+    @staticmethod
+    def make_key(config: dict, code_files: list[Path]) -> str:
+        """
+        Compute the cache key from a JSON-serializable configuration and
+        the contents of the given code files (missing files are skipped).
+        """
+        h = hashlib.sha256(json.dumps(config, sort_keys=True).encode())
+        for f in sorted(set(code_files)):
+            if f.is_file():
+                h.update(str(f.name).encode())
+                file_digest(f, h)
+        return h.hexdigest()[:32]
+
+    def lookup(self, key: str) -> Path | None:
+        """Return the directory of the entry for key, if it exists."""
+        entry = self.root / key
+        return entry if (entry / "manifest.json").exists() else None
+
+    def store(self, key: str, items: dict[str, Path], files: dict[str, list[str]] = None):
+        """
+        Store a new entry. items maps names to source directories. If
+        files[name] is given, only these files are taken from that directory,
+        otherwise the entire directory tree is stored.
+        """
+        files = files or {}
+        tmp = self.root / f"{key}.tmp"
+        if tmp.exists():
+            shutil.rmtree(tmp)
+        for name, src in items.items():
+            if name in files:
+                for fname in files[name]:
+                    if (src / fname).exists():
+                        link_or_copy(src / fname, tmp / name / fname)
+            elif src.exists():
+                link_tree(src, tmp / name)
+        (tmp / "manifest.json").write_text(json.dumps(sorted(items), indent=2))
+        entry = self.root / key
+        if entry.exists():
+            shutil.rmtree(entry)
+        tmp.rename(entry)  # make the entry visible atomically
+        return entry
+
+    @staticmethod
+    def restore(entry: Path, items: dict[str, Path]):
+        """Restore the named items of an entry into their destinations."""
+        for name, dst in items.items():
+            src = entry / name
+            if not src.exists():
+                continue
+            for root, _, fnames in os.walk(src):
+                for fname in fnames:
+                    s = Path(root) / fname
+                    d = dst / s.relative_to(src)
+                    d.unlink(missing_ok=True)
+                    link_or_copy(s, d)
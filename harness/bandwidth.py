@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+bandwidth.py - Account for the sizes of the artifacts that the client and
+server exchange (keys, encrypted database, encrypted query and results),
+broken down by the class of each file, and estimate how long it takes to
+ship them over links of different speeds.
+
+The artifacts are walked with os.scandir in the harness process. Files
+that are hard links to each other (e.g. restored from the artifact cache)
+are only counted once, as du does.
+
+An encrypted database that is stored packed (see --packed_db) is a few
+segment files and an index, the index is read to attribute the bytes of
+the segments to the row and payload ciphertexts that they hold, and the
+rest of the segments (the alignment padding) to the packing overhead.
+"""
+# Copyright (c) 2025 HomomorphicEncryption.org
+# All rights reserved.
+#
+# This software is licensed under the terms of the Apache v2 License.
+# See the LICENSE.md file for details.
+import os
+import re
+from pathlib import Path
+
+# The classes of files, matched in order against the file names. The
+# first group is written by the reference submission, the second by the
+# remote backend example.
+FILE_CLASSES = [
+    ("Crypto context", re.compile(r"^(cc\.bin|context\.pkl)$")),
+    ("Public key", re.compile(r"^pk\.bin$")),
+    ("Secret key", re.compile(r"^sk\.(bin|pkl)$")),
+    ("Relinearization key", re.compile(r"^mk\.bin$")),
+    ("Rotation keys", re.compile(r"^rk\.bin$")),
+    ("Row ciphertexts", re.compile(r"^row_\d+\.bin$")),
+    ("Payload ciphertexts", re.compile(r"^payload_\d+\.bin$")),
+    ("Query", re.compile(r"^query\.bin$")),
+    ("Results", re.compile(r"^results\.bin$")),
+    ("Evaluation keys", re.compile(r"^ek\.pkl$")),
+    ("Database archive", re.compile(r"^db_and_payloads_zip\.bin$")),
+    ("Packed index", re.compile(r"^db\.idx$")),
+    ("Packing overhead", re.compile(r"^db_seg_\d+\.bin$")),
+    ("Database manifest", re.compile(r"^manifest\.txt$")),
+]
+OTHER = "Other"
+
+# Files that are in the artifact directories but never leave the client,
+# they are not included in the transfer-time estimates
+CLIENT_ONLY = {"Secret key"}
+
+# The default link speeds for the transfer-time estimates, in Mbit/s
+DEFAULT_LINK_SPEEDS = [100, 1000, 10000]
+
+def classify(name: str) -> str:
+    """The class of a file, by its name."""
+    for cls, pattern in FILE_CLASSES:
+        if pattern.match(name):
+            return cls
+    return OTHER
+
+def packed_records(index_path: Path) -> dict[str, int]:
+    """
+    The number of bytes in each class of the records of a packed store, by
+    their names in its index (e.g. batch0003/row_0017.bin).
+    """
+    found = {}
+    with open(index_path) as f:
+        if f.readline().split()[:2] != ["packed-db", "1"]:
+            raise ValueError(f"bad packed index {index_path}")
+        for line in f:
+            name, _, _, length = line.split()
+            cls = classify(Path(name).name)
+            found[cls] = found.get(cls, 0) + int(length)
+    return found
+
+def scan(path: Path) -> dict[str, int]:
+    """
+    Walk a file or directory, and return the number of bytes in each class
+    of files (only the classes that were found, in the order of FILE_CLASSES).
+    """
+    path = Path(path)
+    found = {}
+    seen = set()
+
+    def add(name, st):
+        if st.st_nlink > 1:
+            if (st.st_dev, st.st_ino) in seen:
+                return
+            seen.add((st.st_dev, st.st_ino))
+        cls = classify(name)
+        found[cls] = found.get(cls, 0) + st.st_size
+
+    def walk(d):
+        index = Path(d) / "db.idx"
+        if index.is_file():  # the segments of a packed store, split by class
+            for cls, n in packed_records(index).items():
+                found[cls] = found.get(cls, 0) + n
+                found["Packing overhead"] = found.get("Packing overhead", 0) - n
+        with os.scandir(d) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    walk(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    add(entry.name, entry.stat(follow_symlinks=False))
+
+    if path.is_dir():
+        walk(path)
+    elif path.is_file():
+        add(path.name, path.stat())
+    order = [cls for cls, _ in FILE_CLASSES] + [OTHER]
+    return {cls: found[cls] for cls in order if cls in found}
+
+def transfer_time(n_bytes: int, mbps: float) -> float:
+    """Seconds to send n_bytes over a link of mbps Mbit/s."""
+    return n_bytes * 8 / (mbps * 1e6)
+
+def link_name(mbps: float) -> str:
+    """A readable name for a link speed, e.g. '1 Gbit/s'."""
+    if mbps >= 1000 and mbps % 1000 == 0:
+        return f"{int(mbps // 1000)} Gbit/s"
+    return f"{mbps:g} Mbit/s"
+
+def artifact_report(classes: dict[str, int], link_speeds) -> dict:
+    """
+    The results-file entry of one artifact: the exact byte count of the
+    total and of every class, and the estimated transfer time of the bytes
+    that are shipped (the total and the largest class) at each link speed.
+    """
+    shipped = {cls: n for cls, n in classes.items() if cls not in CLIENT_ONLY}
+    total = sum(shipped.values())
+    report = {"Bytes": sum(classes.values()),
+              "Shipped bytes": total,
+              "Classes": dict(classes)}
+    if shipped:
+        largest = max(shipped, key=shipped.get)
+        report["Largest class"] = largest
+        report["Transfer time"] = {
+            link_name(s): {"Total": f"{round(transfer_time(total, s), 4)}s",
+                           largest: f"{round(transfer_time(shipped[largest], s), 4)}s"}
+            for s in link_speeds}
+    return report
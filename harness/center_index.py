@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+center_index.py - An exact, center-based pruning index for the cleartext
+oracle of fetch-by-similarity.
+
+Every record that lies close to one of the centers in centers.bin is
+assigned to that center, all other records go to a residual list. For each
+center c we store the radius r_c = max ||x - c|| over its members, and for
+each member its own distance ||x - c||. For a query v and a member x of
+the cluster of c we have (by Cauchy-Schwarz)
+
+    <x,v> = <c,v> + <x-c,v> <= <c,v> + ||x-c|| * ||v||,
+
+so a cluster with <c,v> + r_c*||v|| <= threshold cannot contain a match
+and is skipped, and inside a scanned cluster only the members with
+<c,v> + ||x-c||*||v|| > threshold are read.
+
+No center bound can prune the residual records: in the generated datasets
+they are half of the records, random points on the sphere, at distance >1
+from every center. The index keeps a contiguous int8 copy of them, with a
+per-row scale s and error bound e (see index_common.py), and a residual
+record x is read from db.bin only if s*<q,v> + e*||v|| > threshold.
+Random points are almost never that close to a query, so the oracle reads
+the int8 copy (1/8 of db.bin) and a few float32 rows. Every record that the
+index cannot rule out is checked against db.bin, hence the results are
+exactly those of a full scan.
+
+The index is built once per dataset and stored under datasets/<size>/index,
+it is rebuilt automatically when db.bin changes.
+"""
+# Copyright (c) 2025, Amazon Web Services
+# All rights reserved.
+#
+# This software is licensed under the terms of the Apache v2 License.
+# See the LICENSE.md file for details.
+import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import numpy as np
+from params import InstanceParams, TOY, LARGE
+from similarity import is_match
+from index_common import (BOUND_EPS, BUILD_BLOCK_ROWS, index_dir, db_signature, is_fresh,
+                          write_quantized, load_quantized, screen_quantized)
+
+# Records farther than this from their nearest center go to the residual
+# list. Clustered points are at distance ~0.29 from their center, random
+# points are at distance >1 from all the centers.
+ASSIGN_RADIUS = 0.5
+
+class CenterIndex:
+    """The center-based index of one dataset."""
+
+    RESID_FILES = ["ivf_resid_q8.bin", "ivf_resid_scale.bin", "ivf_resid_err.bin"]
+    FILES = ["ivf_order.bin", "ivf_dist.bin", "ivf_offsets.bin", "ivf_radius.bin",
+             *RESID_FILES, "ivf_meta.json"]
+
+    def __init__(self, index_dir: Path):
+        """Load an existing index from index_dir."""
+        self.meta = json.loads((index_dir / "ivf_meta.json").read_text())
+        # order holds the record indices grouped by cluster, the residual
+        # records last. The members of each cluster are sorted by decreasing
+        # distance to their center, and dist holds these distances.
+        self.order = np.fromfile(index_dir / "ivf_order.bin", dtype=np.int32)
+        self.dist = np.fromfile(index_dir / "ivf_dist.bin", dtype=np.float32)
+        self.offsets = np.fromfile(index_dir / "ivf_offsets.bin", dtype=np.int64)
+        self.radius = np.fromfile(index_dir / "ivf_radius.bin", dtype=np.float32)
+        # The int8 copy of the residual records, in the order of self.order
+        self.resid_q8, self.resid_scale, self.resid_err = load_quantized(
+            [index_dir / f for f in self.RESID_FILES])
+
+    @property
+    def n_clusters(self) -> int:
+        """Number of clusters (not counting the residual list)."""
+        return len(self.radius)
+
+    @property
+    def n_residual(self) -> int:
+        """Number of records in the residual list."""
+        return int(self.offsets[-1] - self.offsets[-2])
+
+    def residual_candidates(self, qs: np.ndarray, threshold: float,
+                            block_rows: int, n_threads=None) -> np.ndarray:
+        """
+        Return the residual records that the int8 copy cannot rule out for
+        some query (the rows of qs), i.e. with s*<q,v> + e*||v|| > threshold.
+        """
+        residual = self.order[self.offsets[-2]:self.offsets[-1]]
+        q_norms = np.linalg.norm(qs.astype(np.float64), axis=1).astype(np.float32)
+
+        def screen(start):
+            end = start + block_rows
+            sure, unsure = screen_quantized(self.resid_q8[start:end], self.resid_scale[start:end],
+                                            self.resid_err[start:end], qs, q_norms, threshold)
+            return start + np.flatnonzero((sure | unsure).any(axis=1))
+
+        with ThreadPoolExecutor(max_workers=n_threads) as pool:
+            parts = list(pool.map(screen, range(0, len(residual), block_rows)))
+        return residual[np.concatenate(parts or [np.empty(0, dtype=np.intp)])]
+
+    def candidates(self, centers: np.ndarray, qs: np.ndarray, threshold: float,
+                   block_rows: int, n_threads=None):
+        """
+        Return the (sorted) indices of all the records that may be within
+        the threshold from any of the queries (the rows of qs), the total
+        number of clusters scanned over all the queries, and the number of
+        residual records among the candidates.
+        """
+        q_norms = np.linalg.norm(qs.astype(np.float64), axis=1)
+        cv = centers.astype(np.float64) @ qs.T.astype(np.float64)  # C x Q
+        # The maximal distance from the center that a match can have
+        limit = (threshold - BOUND_EPS - cv) / q_norms        # C x Q
+        scanned = self.radius[:, None] > limit               # C x Q
+        n_scanned = int(scanned.sum())
+
+        # Scan each cluster up to the loosest limit over all the queries
+        # that scan it. The members are sorted by decreasing distance, so
+        # the rows to read are a prefix of each cluster.
+        limit = np.where(scanned, limit, np.inf).min(axis=1)
+        parts = [self.residual_candidates(qs, threshold, block_rows, n_threads)]
+        for c in np.flatnonzero(scanned.any(axis=1)):
+            lo, hi = self.offsets[c], self.offsets[c+1]
+            n = np.searchsorted(-self.dist[lo:hi], -limit[c], side='left')
+            parts.append(self.order[lo:lo+n])
+        return np.sort(np.concatenate(parts)), n_scanned, len(parts[0])
+
+def build_index(dataset_dir: Path, dim: int, n_threads=None):
+    """
+    Assign the records to centers and write the index files. If the
+    dataset generator left a labels.bin file, its labels are used as the
+    assignment (the distances and radii are still computed from the data).
+    Otherwise every record is assigned to its nearest center, if that is
+    within ASSIGN_RADIUS.
+    """
+    db = np.memmap(dataset_dir / "db.bin", dtype=np.float32, mode="r").reshape(-1, dim)
+    centers = np.fromfile(dataset_dir / "centers.bin", dtype=np.float32).reshape(-1, dim)
+    labels_file = dataset_dir / "labels.bin"
+    hints = None
+    if labels_file.exists():
+        hints = np.memmap(labels_file, dtype=np.int32, mode="r")
+        if len(hints) != len(db):
+            hints = None
+
+    n_clusters = len(centers)
+    labels = np.empty(len(db), dtype=np.int32)
+    dist = np.empty(len(db), dtype=np.float32)
+
+    def assign(start):
+        block = np.asarray(db[start:start+BUILD_BLOCK_ROWS])
+        if hints is not None:
+            lab = np.array(hints[start:start+len(block)])
+        else:
+            lab = np.argmax(block @ centers.T, axis=1).astype(np.int32)
+        d = np.linalg.norm(block.astype(np.float64) - centers[lab], axis=1)
+        residual = (lab < 0) | (d > ASSIGN_RADIUS)
+        lab[residual] = n_clusters
+        d[residual] = np.inf
+        labels[start:start+len(block)] = lab
+        dist[start:start+len(block)] = d
+
+    with ThreadPoolExecutor(max_workers=n_threads) as pool:
+        list(pool.map(assign, range(0, len(db), BUILD_BLOCK_ROWS)))
+
+    # Group by cluster, and by decreasing distance within each cluster
+    order = np.lexsort((-dist, labels)).astype(np.int32)
+    counts = np.bincount(labels, minlength=n_clusters + 1)
+    offsets = np.zeros(n_clusters + 2, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    radius = np.zeros(n_clusters, dtype=np.float32)
+    nonempty = counts[:n_clusters] > 0
+    radius[nonempty] = dist[order[offsets[:-2][nonempty]]]  # first = farthest
+    # Round the radii up, so the float32 values are still upper bounds
+    radius = np.nextafter(radius, np.float32(np.inf))
+
+    idir = index_dir(dataset_dir)
+    idir.mkdir(exist_ok=True)
+    write_quantized(db, order[offsets[-2]:], [idir / f for f in CenterIndex.RESID_FILES],
+                    n_threads)
+    order.tofile(idir / "ivf_order.bin")
+    np.nextafter(dist[order], np.float32(np.inf)).tofile(idir / "ivf_dist.bin")
+    offsets.tofile(idir / "ivf_offsets.bin")
+    radius.tofile(idir / "ivf_radius.bin")
+    meta = {"n_clusters": n_clusters, "n_residual": int(counts[-1]),
+            "assign_radius": ASSIGN_RADIUS, **db_signature(dataset_dir)}
+    (idir / "ivf_meta.json").write_text(json.dumps(meta, indent=2))
+
+def load_or_build_index(dataset_dir: Path, dim: int, n_threads=None) -> CenterIndex:
+    """Return the index of the dataset, (re)building it if needed."""
+    if not is_fresh(dataset_dir, CenterIndex.FILES, "ivf_meta.json"):
+        print("         [oracle] Building center index")
+        build_index(dataset_dir, dim, n_threads)
+    return CenterIndex(index_dir(dataset_dir))
+
+def find_matches_ivf(dataset_dir: Path, dim: int, qs: np.ndarray,
+                     threshold: float, block_rows: int, n_threads=None) -> list[np.ndarray]:
+    """
+    Find the matches of all the queries (the rows of qs), reading from db.bin
+    only the records that the index cannot rule out.
+    Returns a list with the (sorted) indices of the matching records for
+    every query.
+    """
+    index = load_or_build_index(dataset_dir, dim, n_threads)
+    centers = np.fromfile(dataset_dir / "centers.bin", dtype=np.float32).reshape(-1, dim)
+    rows, n_scanned, n_resid = index.candidates(centers, qs, threshold, block_rows, n_threads)
+
+    db = np.memmap(dataset_dir / "db.bin", dtype=np.float32, mode="r").reshape(-1, dim)
+
+    def scan(start):
+        idx = rows[start:start+block_rows]
+        match = is_match(db[idx], qs, threshold)
+        return [idx[match[:, k]] for k in range(len(qs))]
+
+    with ThreadPoolExecutor(max_workers=n_threads) as pool:
+        parts = list(pool.map(scan, range(0, len(rows), block_rows)))
+
+    n_total = len(qs) * index.n_clusters
+    print(f"         [oracle] Center index scanned {n_scanned}/{n_total} clusters,",
+          f"{len(rows)}/{len(db)} rows ({100 * len(rows) / max(1, len(db)):.1f}%),",
+          f"{n_resid}/{index.n_residual} residual")
+    return [np.concatenate([p[k] for p in parts] or [np.empty(0, dtype=np.int32)])
+            for k in range(len(qs))]
+
+def main():
+    """
+    Usage: python3 center_index.py <size> - (re)build the center index
+    """
+    parser = argparse.ArgumentParser(description='Build the center index of the cleartext oracle.')
+    parser.add_argument('size', type=int, choices=range(TOY, LARGE+1),
+                        help='Instance size (0-toy/1-small/2-medium/3-large)')
+    args, _ = parser.parse_known_args()
+    params = InstanceParams(args.size)
+    build_index(params.datadir(), params.get_record_dim())
+
+
+if __name__ == "__main__":
+    main()
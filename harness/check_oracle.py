@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+check_oracle.py - Check that the indexed engines of the cleartext oracle
+give exactly the same expected results as the plain float32 scan.
+
+For every seed, a small synthetic dataset is generated with records whose
+similarity to the queries is at offsets from the threshold that are inside
+similarity.TIE_EPS, inside the error bound of the quantized scan, and
+outside both, so the re-check of the quantized scan and the float64
+tie-breaking of similarity.is_match are both exercised. The expected.bin
+files (with counts and with payloads) written from the matches of each
+engine must be byte-identical to those of the float32 scan.
+
+Usage:
+    python3 harness/check_oracle.py [--seeds N] [--dim D]
+Exits with code 1 if any engine gave different results.
+"""
+# Copyright (c) 2025, Amazon Web Services
+# All rights reserved.
+#
+# This software is licensed under the terms of the Apache v2 License.
+# See the LICENSE.md file for details.
+import io
+import sys
+import argparse
+import tempfile
+import contextlib
+from pathlib import Path
+import numpy as np
+from similarity import THRESHOLD, TIE_EPS
+from cleartext_impl import PAYLOAD_DIM, find_matches_in_memory, write_expected
+from center_index import find_matches_ivf
+from quantized_index import find_matches_int8
+from utils import TextFormat
+
+# Offsets from the threshold of the constructed records, in units of TIE_EPS
+OFFSETS = [0, 0.001, 0.01, 0.1, 0.5, 0.9, 1, 2, 10, 100, 1000, 10000]
+
+def near_threshold_dataset(rng: np.random.Generator, qs: np.ndarray, n_random: int) -> np.ndarray:
+    """
+    Unit records with similarities to the queries (the rows of qs) at
+    +-OFFSETS from the threshold, some all-zero records, and n_random
+    random unit records, in random order.
+    """
+    offsets = np.array(OFFSETS) * TIE_EPS
+    offsets = np.concatenate([offsets, -offsets[1:]])
+    records = []
+    for v in qs.astype(np.float64):
+        u = rng.standard_normal((len(offsets), len(v)))
+        u -= np.outer(u @ v, v)  # orthogonal to v
+        u /= np.linalg.norm(u, axis=1, keepdims=True)
+        a = THRESHOLD + offsets
+        records.append(a[:, None] * v + np.sqrt(1 - a * a)[:, None] * u)
+    records.append(np.zeros((8, qs.shape[1])))
+    x = rng.standard_normal((n_random, qs.shape[1]))
+    records.append(x / np.linalg.norm(x, axis=1, keepdims=True))
+    records = np.concatenate(records).astype(np.float32)
+    return records[rng.permutation(len(records))]
+
+def make_dataset(dataset_dir: Path, rng: np.random.Generator, dim: int, n_queries: int):
+    """
+    Write a synthetic db.bin, payloads.bin and centers.bin (the queries and
+    some random centers), return the queries.
+    """
+    qs = rng.standard_normal((n_queries, dim))
+    qs = (qs / np.linalg.norm(qs, axis=1, keepdims=True)).astype(np.float32)
+    db = near_threshold_dataset(rng, qs, 2000)
+    db.tofile(dataset_dir / "db.bin")
+    rng.integers(0, 4095, size=(len(db), PAYLOAD_DIM), dtype=np.int16).tofile(
+        dataset_dir / "payloads.bin")
+    centers = np.concatenate([qs, rng.standard_normal((20, dim)).astype(np.float32)])
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    centers.tofile(dataset_dir / "centers.bin")
+    return qs
+
+def same_expected(dataset_dir: Path, expected: list, found: list) -> bool:
+    """Do the two lists of matches give byte-identical expected.bin files?"""
+    for m_exp, m_found in zip(expected, found):
+        for count_only in (True, False):
+            write_expected(dataset_dir, m_exp, count_only, dataset_dir / "float32.bin")
+            write_expected(dataset_dir, m_found, count_only, dataset_dir / "engine.bin")
+            if ((dataset_dir / "float32.bin").read_bytes()
+                    != (dataset_dir / "engine.bin").read_bytes()):
+                return False
+    return True
+
+def check_engines(seed: int, dim: int) -> list[str]:
+    """Run the check on the dataset of one seed, return the failed engines."""
+    engines = {"int8": lambda d, qs: find_matches_int8(d, dim, qs, THRESHOLD, 256),
+               "ivf": lambda d, qs: find_matches_ivf(d, dim, qs, THRESHOLD, 256)}
+    failed = []
+    with tempfile.TemporaryDirectory() as tmp:
+        dataset_dir = Path(tmp)
+        qs = make_dataset(dataset_dir, np.random.default_rng(seed), dim, 4)
+        expected = find_matches_in_memory(dataset_dir, dim, qs)
+        for name, find_matches in engines.items():
+            with contextlib.redirect_stdout(io.StringIO()):  # the engine statistics
+                found = find_matches(dataset_dir, qs)
+            if not same_expected(dataset_dir, expected, found):
+                failed.append(name)
+    return failed
+
+def main():
+    """
+    Check the engines on synthetic datasets from several seeds.
+    """
+    parser = argparse.ArgumentParser(description='Check the oracle engines against the float32 scan.')
+    parser.add_argument('--seeds', type=int, default=5,
+                        help='Number of synthetic datasets (default: 5)')
+    parser.add_argument('--dim', type=int, default=128,
+                        help='Dimension of the records (default: 128)')
+    args, _ = parser.parse_known_args()
+
+    failures = 0
+    for seed in range(args.seeds):
+        for name in check_engines(seed, args.dim):
+            failures += 1
+            print(f"{TextFormat.RED}         [oracle] FAIL ({name} engine differs from the",
+                  f"float32 scan on dataset {seed}){TextFormat.RESET}")
+    if failures > 0:
+        sys.exit(1)
+    print(f"{TextFormat.GREEN}         [oracle] PASS (all engines match the float32 scan",
+          f"on {args.seeds} datasets){TextFormat.RESET}")
+
+
+if __name__ == "__main__":
+    main()
@@ -10,13 +10,86 @@ benchmark that operates on cleartext data.
 #
 # This software is licensed under the terms of the Apache v2 License.
 # See the LICENSE.md file for details.
+import os
+import sys
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-from params import InstanceParams, TOY, LARGE
+from params import InstanceParams, TOY, MEDIUM, LARGE
+from similarity import THRESHOLD, is_match
+from center_index import find_matches_ivf
+from quantized_index import find_matches_int8
+from utils import TextFormat
 
 # The payloads are vectors of 7 int16 numbers in the range [0,4095)
 PAYLOAD_DIM = 7
 
+# Default number of records per block in the out-of-core engine
+BLOCK_ROWS = 1 << 16
+
+def find_matches_in_memory(dataset_dir, dim, qs) -> list[np.ndarray]:
+    """
+    Load the entire dataset matrix and compute sim = M*Q^t in one shot,
+    where the rows of qs are the queries.
+    Returns a list with the (sorted) indices of the matching records for
+    every query.
+    """
+    db = np.fromfile(dataset_dir / "db.bin", dtype=np.float32).reshape(-1, dim)
+    return split_matches(is_match(db, qs), 0, len(qs))
+
+def find_matches_blocked(dataset_dir, dim, qs, block_rows=BLOCK_ROWS,
+                         n_threads=None) -> list[np.ndarray]:
+    """
+    Memory-map the dataset matrix and compute sim = M*Q^t in blocks of
+    block_rows records, on a pool of n_threads threads (NumPy releases the
+    GIL during the multiplication). Only n_threads blocks are in flight at
+    any time, so peak memory does not depend on the dataset size, and the
+    dataset is read once for all the queries (the rows of qs).
+    Returns a list with the (sorted) indices of the matching records for
+    every query.
+    """
+    db = np.memmap(dataset_dir / "db.bin", dtype=np.float32, mode="r").reshape(-1, dim)
+
+    def scan(start):
+        block = np.asarray(db[start:start+block_rows])
+        return split_matches(is_match(block, qs), start, len(qs))
+
+    with ThreadPoolExecutor(max_workers=n_threads) as pool:
+        parts = list(pool.map(scan, range(0, len(db), block_rows)))
+    return [np.concatenate([p[k] for p in parts]) for k in range(len(qs))]
+
+def split_matches(is_match: np.ndarray, offset: int, n_queries: int) -> list[np.ndarray]:
+    """
+    Given a (records x queries) boolean matrix, return for every query the
+    indices of its matching records, shifted by offset.
+    """
+    q_idx, rec_idx = np.nonzero(is_match.T)  # sorted by query, then by record
+    bounds = np.searchsorted(q_idx, np.arange(n_queries + 1))
+    return [offset + rec_idx[bounds[k]:bounds[k+1]] for k in range(n_queries)]
+
+def write_expected(dataset_dir, matches: np.ndarray, count_only: bool, out_file):
+    """
+    Write the expected result for the given matching indices: either the
+    number of matches or the sorted matching payload vectors.
+    """
+    if count_only:
+        # Write to file the number of matches, as an int16
+        n_matches = np.int_(len(matches))
+        n_matches.tofile(out_file)
+        # NOTE: to_file write complete machine words, even if the value is short
+
+    else:
+        # Read the payloads, vectors of dimension PAYLOAD_DIM=7. They are
+        # memory-mapped, so only the matching rows are read from disk.
+        payload_file = dataset_dir / "payloads.bin"
+        payloads = np.memmap(payload_file, dtype=np.int16, mode="r").reshape(-1, PAYLOAD_DIM)
+        # Extract the payload vectors for the matches
+        extracted_payloads = np.asarray(payloads[matches])
+
+        # Sort the payload vectors lexicographically and write to disk
+        sorted_ps = extracted_payloads[np.lexsort(extracted_payloads.T[::-1])]
+        sorted_ps.tofile(out_file)
+
 def main():
     """
     Usage: python3 cleartext_impl.py <size> (0-toy/1-small/2-medium/3-large)
@@ -24,6 +97,11 @@ def main():
     * Compute the vector of similarities sim = M*v
     * Extract that payload vectors for rows i for which sim[i]>0.8
     * Sort the extracted vectors and write to disk
+
+    With --queries <file>, the file holds Q query vectors. The dataset is
+    then read once for all of them, and the expected result for the k'th
+    query is written to expected-<k>.bin (k=1,...,Q), in the query directory
+    if one is given.
     """
     # Parse arguments using argparse
     parser = argparse.ArgumentParser(description='Cleartext implementation of fetch-by-similarity workload.')
@@ -31,41 +109,71 @@ def main():
                         help='Instance size (0-toy/1-small/2-medium/3-large)')
     parser.add_argument('--count_only', action='store_true',
                         help='Only count # of matches, do not return payloads')
+    parser.add_argument('--engine', choices=['memory', 'blocked', 'ivf', 'int8'],
+                        help='Load the whole dataset (memory), scan a memory-mapped '
+                             'dataset in blocks (blocked), scan only the records '
+                             'that the center index cannot rule out (ivf), or scan '
+                             'a quantized copy and re-check uncertain records (int8). '
+                             'Default: blocked for medium/large, memory otherwise')
+    parser.add_argument('--block_rows', type=int, default=BLOCK_ROWS,
+                        help=f'Records per block for the out-of-core engines (default: {BLOCK_ROWS})')
+    parser.add_argument('--threads', type=int, default=os.cpu_count(),
+                        help='Threads for the out-of-core engines (default: # of CPUs)')
+    parser.add_argument('--check', action='store_true',
+                        help='Also run the blocked float32 engine, and fail if the '
+                             'selected engine found different matches')
+    parser.add_argument('--queries', type=str,
+                        help='File with many queries, write expected-<k>.bin for each')
+    parser.add_argument('--query_dir', type=str,
+                        help='Directory for the per-query files (default: the dataset directory)')
 
     args, _ = parser.parse_known_args()
     size = args.size
+    engine = args.engine or ('blocked' if size >= MEDIUM else 'memory')
 
     # Use params.py to get instance parameters
-    params = InstanceParams(size)
+    params = InstanceParams(size, querydir=args.query_dir)
     dim = params.get_record_dim()
 
     # Get dataset directory from params
     dataset_dir = params.datadir()
-    db = np.fromfile(dataset_dir / "db.bin", dtype=np.float32).reshape(-1, dim)
 
-    # read the query from file, a single record of dimension dim
-    v = np.fromfile(dataset_dir / "query.bin", dtype=np.float32)
+    # read the queries from file, each a record of dimension dim
+    query_file = args.queries or params.qrydatadir() / "query.bin"
+    qs = np.fromfile(query_file, dtype=np.float32).reshape(-1, dim)
 
-    # Compute the similarities between the query and all the vectors in db
-    sim = db @ v # matrix multiplication
-    matches = sim > 0.8
+    # Compute the similarities between the queries and all the vectors in db
+    if engine == 'blocked':
+        matches = find_matches_blocked(dataset_dir, dim, qs,
+                                       args.block_rows, args.threads)
+    elif engine == 'ivf':
+        matches = find_matches_ivf(dataset_dir, dim, qs, THRESHOLD,
+                                   args.block_rows, args.threads)
+    elif engine == 'int8':
+        matches = find_matches_int8(dataset_dir, dim, qs, THRESHOLD,
+                                    args.block_rows, args.threads)
+    else:
+        matches = find_matches_in_memory(dataset_dir, dim, qs)
 
-    if args.count_only:
-        # Write to file the number of matches, as an int16
-        n_matches: np.int_ = matches.sum()
-        n_matches.tofile(dataset_dir/"expected.bin")
-        # NOTE: to_file write complete machine words, even if the value is short
+    # Optionally check the engine against the plain float32 computation
+    if args.check:
+        reference = find_matches_blocked(dataset_dir, dim, qs,
+                                         args.block_rows, args.threads)
+        for k, (m, r) in enumerate(zip(matches, reference), start=1):
+            if not np.array_equal(np.asarray(m, dtype=np.intp), r):
+                print(f"{TextFormat.RED}         [oracle] FAIL ({engine} engine found",
+                      f"{len(m)} matches for query {k}, expected {len(r)}){TextFormat.RESET}")
+                sys.exit(1)
+        print(f"{TextFormat.GREEN}         [oracle] PASS ({engine} engine matches the",
+              f"float32 scan on {len(qs)} queries){TextFormat.RESET}")
 
+    if args.queries is None:
+        write_expected(dataset_dir, matches[0], args.count_only,
+                       params.qrydatadir()/"expected.bin")
     else:
-        # Read the payloads, vectors of dimension PAYLOAD_DIM=7
-        payload_file = dataset_dir / "payloads.bin"
-        payloads = np.fromfile(payload_file, dtype=np.int16).reshape(-1, PAYLOAD_DIM)
-        # Extract the payload vectors for the matches
-        extracted_payloads = payloads[matches]
-
-        # Sort the payload vectors lexicographically and write to disk
-        sorted_ps = extracted_payloads[np.lexsort(extracted_payloads.T[::-1])]
-        sorted_ps.tofile(dataset_dir/"expected.bin")
+        for k, m in enumerate(matches, start=1):
+            write_expected(dataset_dir, m, args.count_only,
+                           params.qrydatadir()/f"expected-{k}.bin")
 
 
 if __name__ == "__main__":
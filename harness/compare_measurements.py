@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+compare_measurements.py - Statistics over the measurement files written by
+run_submission.py, and comparison of two sets of measurements.
+
+The results-<k>.json files store times as strings such as "76.1026s" and
+sizes such as "5.6G". This tool parses them into numbers, and for every
+measured quantity computes the mean, the standard deviation and a 95%
+confidence interval (using Student's t distribution) over the runs.
+
+Usage:
+    python3 harness/compare_measurements.py <dir>
+        Summarize the measurements under <dir>, either a single variant
+        directory (e.g. measurements/small) or a tree of them.
+    python3 harness/compare_measurements.py <baseline_dir> <candidate_dir>
+        Compare the candidate measurements against the baseline ones,
+        flagging the quantities that got significantly worse (by Welch's
+        t-test at the 5% level, or for quantities that did not vary between
+        runs, by a relative change of at least --min_change). Exits with
+        code 1 if any were found.
+"""
+# Copyright (c) 2025, Amazon Web Services
+# All rights reserved.
+#
+# This software is licensed under the terms of the Apache v2 License.
+# See the LICENSE.md file for details.
+import re
+import sys
+import json
+import math
+import argparse
+from pathlib import Path
+from utils import TextFormat
+
+# The sections of the results files that hold numeric values
+SECTIONS = ["Timing", "Server Reported", "Bandwidth", "Artifacts", "Resources"]
+
+# The unit of the plain numbers in each section (the byte counts of the
+# artifacts are stored as exact integers)
+SECTION_UNITS = {"Artifacts": "B"}
+
+# The quantity used by default to decide when enough runs were made
+MAIN_STEP = "Encrypted computation"
+
+# Two-sided 95% quantiles of Student's t distribution, t_{0.975}(df) for
+# df = 1..30, and the normal quantile beyond that
+T_975 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+         2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+         2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+Z_975 = 1.960
+
+SIZE_UNITS = {"B": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40, "P": 1 << 50}
+VALUE_RE = re.compile(r"^\s*([-+]?[0-9]*\.?[0-9]+(?:[eE][-+]?[0-9]+)?)\s*([a-zA-Z]*)\s*$")
+
+def parse_value(value):
+    """
+    Parse a measured value: a number, a time like "76.1026s", or a size
+    like "5.6G". Returns a float (seconds or bytes), or None.
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if not isinstance(value, str):
+        return None
+    m = VALUE_RE.match(value)
+    if m is None:
+        return None
+    number, unit = float(m.group(1)), m.group(2)
+    if unit in ("", "s"):
+        return number
+    if unit in SIZE_UNITS:
+        return number * SIZE_UNITS[unit]
+    return None
+
+def unit_of(value) -> str:
+    """Return 's' for times, 'B' for sizes and '' for other numbers."""
+    m = VALUE_RE.match(value) if isinstance(value, str) else None
+    if m is None or m.group(2) == "":
+        return ""
+    return "s" if m.group(2) == "s" else "B"
+
+def flatten(results: dict) -> dict:
+    """
+    Map each numeric quantity in a results file to its value, with keys
+    like "Timing/Encrypted computation" or "Resources/Key Generation/Peak RSS".
+    Also returns the unit of each key.
+    """
+    values, units = {}, {}
+
+    def visit(prefix, obj, default_unit):
+        if isinstance(obj, dict):
+            for k, v in obj.items():
+                visit(f"{prefix}/{k}", v, default_unit)
+            return
+        x = parse_value(obj)
+        if x is not None:
+            values[prefix] = x
+            units[prefix] = unit_of(obj) or default_unit
+
+    for section in SECTIONS:
+        visit(section, results.get(section, {}), SECTION_UNITS.get(section, ""))
+    return values, units
+
+def load_runs(variant_dir: Path) -> tuple[list[dict], dict]:
+    """Load all the results-<k>.json files of one variant."""
+    runs, units = [], {}
+    files = sorted(variant_dir.glob("results-*.json"),
+                   key=lambda f: int(re.sub(r"\D", "", f.stem) or 0))
+    for f in files:
+        values, u = flatten(json.loads(f.read_text()))
+        runs.append(values)
+        units.update(u)
+    return runs, units
+
+def find_variants(root: Path) -> dict[str, Path]:
+    """Map variant names (e.g. 'count_small') to their directories."""
+    root = Path(root)
+    if any(root.glob("results-*.json")):
+        return {root.name: root}
+    return {d.name: d for d in sorted(root.iterdir())
+            if d.is_dir() and any(d.glob("results-*.json"))}
+
+def t_quantile(df: int) -> float:
+    """The two-sided 95% quantile of the t distribution with df degrees."""
+    return T_975[df - 1] if df <= len(T_975) else Z_975
+
+def stats(xs: list[float]) -> dict:
+    """Mean, sample standard deviation and 95% CI half-width of xs."""
+    n = len(xs)
+    if n == 0:
+        return {"n": 0, "mean": None, "std": None, "ci": None}
+    mean = sum(xs) / n
+    if n < 2:
+        return {"n": n, "mean": mean, "std": None, "ci": None}
+    std = math.sqrt(sum((x - mean) ** 2 for x in xs) / (n - 1))
+    return {"n": n, "mean": mean, "std": std, "ci": t_quantile(n - 1) * std / math.sqrt(n)}
+
+def summarize(runs: list[dict]) -> dict:
+    """
+    Compute the statistics of every quantity over the runs. A value that is
+    the same in every run counts as a single sample: the one-time steps 1-5
+    are copied unchanged into every results file, and sizes are deterministic.
+    """
+    keys = dict.fromkeys(k for r in runs for k in r)  # ordered union
+    summary = {}
+    for k in keys:
+        xs = [r[k] for r in runs if k in r]
+        constant = len(xs) > 1 and len(set(xs)) == 1
+        summary[k] = {**stats(xs[:1] if constant else xs), "constant": constant}
+    return summary
+
+def welch_significant(a: dict, b: dict) -> bool | None:
+    """
+    Welch's t-test: is the difference in means of a and b significant at
+    the 5% level? Returns None if there are not enough samples to tell,
+    including for values that did not vary (see deterministic below).
+    """
+    if a["std"] is None or b["std"] is None:
+        return None
+    va, vb = a["std"] ** 2 / a["n"], b["std"] ** 2 / b["n"]
+    if va + vb == 0:  # not testable
+        return None
+    t = (b["mean"] - a["mean"]) / math.sqrt(va + vb)
+    # The Welch-Satterthwaite degrees of freedom (rounded down)
+    df = (va + vb) ** 2 / (va ** 2 / (a["n"] - 1) + vb ** 2 / (b["n"] - 1))
+    return abs(t) > t_quantile(max(1, int(df)))
+
+def deterministic(a: dict, b: dict) -> bool:
+    """Did the quantity have the same value in several runs, on both sides?"""
+    return a.get("constant", False) and b.get("constant", False)
+
+def fmt(x, unit: str) -> str:
+    """Format a value with its unit."""
+    if x is None:
+        return "n/a"
+    if unit == "B":
+        for u in ["B", "K", "M", "G", "T"]:
+            if abs(x) < 1024:
+                return f"{x:.1f}{u}"
+            x /= 1024
+        return f"{x:.1f}P"
+    return f"{x:.4f}{unit}"
+
+def print_summary(name: str, summary: dict, units: dict):
+    """Print the statistics of one variant."""
+    n = max((s["n"] for s in summary.values()), default=0)
+    print(f"{TextFormat.BOLD}[{name}] {n} runs{TextFormat.RESET}")
+    for key, s in summary.items():
+        u = units.get(key, "")
+        ci = f" ± {fmt(s['ci'], u)}" if s["ci"] is not None else ""
+        std = f" (std {fmt(s['std'], u)})" if s["std"] is not None else ""
+        print(f"  {key:60s} {fmt(s['mean'], u)}{ci}{std}")
+
+def compare(base: dict, cand: dict, units: dict, min_change: float) -> list[str]:
+    """
+    Print the comparison of two summaries of one variant, return the keys
+    that regressed: the candidate mean is larger (all the quantities are
+    costs) by at least min_change (relative), and the change is significant.
+    A quantity that did not vary within either set of runs (e.g. a size)
+    is compared by its relative change alone.
+    """
+    regressions = []
+    for key in [k for k in base if k in cand]:
+        a, b = base[key], cand[key]
+        u = units.get(key, "")
+        if a["mean"] == 0:
+            change = 0.0 if b["mean"] == 0 else math.inf
+        else:
+            change = (b["mean"] - a["mean"]) / a["mean"]
+        significant = welch_significant(a, b)
+        if significant is None and deterministic(a, b):
+            significant = abs(change) >= min_change
+        if significant and change >= min_change:
+            verdict, color = "REGRESSION", TextFormat.RED
+            regressions.append(key)
+        elif significant and change <= -min_change:
+            verdict, color = "improvement", TextFormat.GREEN
+        elif significant is None and abs(change) >= min_change:
+            verdict, color = "too few runs", TextFormat.YELLOW
+        else:
+            verdict, color = "", ""
+        print(f"  {key:60s} {fmt(a['mean'], u):>10s} -> {fmt(b['mean'], u):>10s}",
+              f"({100 * change:+.1f}%) {color}{verdict}{TextFormat.RESET if color else ''}")
+    return regressions
+
+def ci_is_tight(values: list[float], target: float) -> bool:
+    """Is the 95% CI half-width of the mean of values within target*mean?"""
+    s = stats(values)
+    return s["ci"] is not None and s["ci"] <= target * abs(s["mean"])
+
+def main():
+    """
+    Summarize one set of measurements, or compare two sets.
+    """
+    parser = argparse.ArgumentParser(description='Statistics and comparison of measurements.')
+    parser.add_argument('baseline', type=str,
+                        help='Measurements directory (a variant, or a tree of variants)')
+    parser.add_argument('candidate', type=str, nargs='?',
+                        help='Measurements directory to compare against the baseline')
+    parser.add_argument('--min_change', type=float, default=0.02,
+                        help='Smallest relative increase reported as a regression (default: 0.02)')
+    parser.add_argument('--json', type=str,
+                        help='Also write the computed statistics to this file')
+    args, _ = parser.parse_known_args()
+
+    base_variants = find_variants(Path(args.baseline))
+    if not base_variants:
+        print(f"Error: no results-*.json files under {args.baseline}")
+        sys.exit(1)
+    report = {}
+
+    if args.candidate is None:
+        for name, d in base_variants.items():
+            runs, units = load_runs(d)
+            summary = summarize(runs)
+            print_summary(name, summary, units)
+            report[name] = summary
+    else:
+        cand_variants = find_variants(Path(args.candidate))
+        # Comparing two single variant directories of different names
+        if len(base_variants) == len(cand_variants) == 1:
+            cand_variants = {next(iter(base_variants)): next(iter(cand_variants.values()))}
+        regressions = []
+        for name in [v for v in base_variants if v in cand_variants]:
+            base_runs, units = load_runs(base_variants[name])
+            cand_runs, cand_units = load_runs(cand_variants[name])
+            units.update(cand_units)
+            base, cand = summarize(base_runs), summarize(cand_runs)
+            print(f"{TextFormat.BOLD}[{name}] {len(base_runs)} baseline runs,",
+                  f"{len(cand_runs)} candidate runs{TextFormat.RESET}")
+            regressions += [f"{name}: {k}" for k in compare(base, cand, units, args.min_change)]
+            report[name] = {"baseline": base, "candidate": cand}
+        if regressions:
+            print(f"{TextFormat.RED}Found {len(regressions)} significant regressions:{TextFormat.RESET}")
+            for r in regressions:
+                print(f"  {r}")
+        else:
+            print(f"{TextFormat.GREEN}No significant regressions{TextFormat.RESET}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.candidate is not None and regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,65 +2,120 @@
 """
 generate_dataset.py - Generate random centers, database points, and payloads
 for the fetch-by-similarity benchmark.
+
+The records are generated in fixed-size chunks, each chunk written directly
+into memory-mapped output files, so the full dataset never needs to fit in
+memory. Chunks can be generated by several worker processes. Every chunk has
+its own seed derived from the global seed, so for a given --seed the output
+is byte-identical regardless of the number of workers.
 """
 # Copyright (c) 2025, Amazon Web Services
 # All rights reserved.
 #
 # This software is licensed under the terms of the Apache v2 License.
 # See the LICENSE.md file for details.
-import random
+import os
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
 import numpy as np
-from params import InstanceParams, TOY, LARGE, PAYLOAD_DIM, instance_name
+from params import InstanceParams, TOY, LARGE, PAYLOAD_DIM
+
+# Number of records that are generated together from one derived seed. This
+# must not depend on the number of workers, otherwise the output would.
+CHUNK_SIZE = 1 << 15
 
-def generate_db_points(n_records: int, n_centers: int, dim: int) -> tuple:
+# The files written by the generator
+DATASET_FILES = ["db.bin", "centers.bin", "labels.bin", "payloads.bin"]
+
+def chunk_seed(entropy: int, chunk_idx: int) -> np.random.SeedSequence:
+    """
+    Derive the seed of a chunk from the global entropy. The centers use
+    the spawn key (0,), the i'th chunk of records uses (1, i).
+    """
+    return np.random.SeedSequence(entropy, spawn_key=(1, chunk_idx))
+
+def generate_centers(rng: np.random.Generator, n_centers: int, dim: int) -> np.ndarray:
+    """
+    Generate random centers on the unit sphere.
+
+    Returns:
+        Array of shape (n_centers, dim) containing the centers
+    """
+    centers = rng.standard_normal(size=(n_centers, dim), dtype=np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    return centers
+
+def generate_db_points(rng: np.random.Generator, centers: np.ndarray,
+                       n_records: int, dim: int) -> tuple:
     """
     Generate database points, half as random points and the other half by
     selecting random centers and adding noise.
-    
+
     Args:
+        rng: The random generator to use
+        centers: Array of shape (n_centers, dim) with the centers
         n_records: Number of database records to generate
-        n_centers: Number of centers to use
         dim: Dimension of the space
-        
+
     Returns:
         Tuple containing:
         - Array of shape (n_records, dim) containing the database points
-        - Array of shape (n_centers, dim) containing the centers
+        - Array of shape (n_records,) with the index of the center used
+          for each point, or -1 for the random points
     """
-    rng = np.random.default_rng()
-
-    # Generate centers on the unit sphere
-    centers = rng.standard_normal(size=(n_centers, dim), dtype=np.float32)
-    for i in range(n_centers):
-        centers[i] /= np.linalg.norm(centers[i])
-
-    # Generate database points. Each one is either a random point on the unit
-    # sphere (with probability 50%), or obtained by selecting a random center
-    # and adding noise.
+    # Each point is either a random point on the unit sphere (with
+    # probability 50%), or obtained by selecting a random center and
+    # adding noise.
     db = rng.standard_normal((n_records, dim), dtype=np.float32)
-    for i in range(n_records):
-        if random.randint(0, 1) == 0:
-            center = centers[random.randint(0, len(centers)-1)]
-            db[i] = center + (0.3 * db[i] / np.linalg.norm(db[i]))
-        db[i] /= np.linalg.norm(db[i])  # normalize to unit length
+    clustered = rng.integers(0, 2, size=n_records) == 0
+    labels = rng.integers(0, len(centers), size=n_records, dtype=np.int32)
+    labels[~clustered] = -1
 
-    return db, centers
+    noise = db[clustered]
+    noise *= 0.3 / np.linalg.norm(noise, axis=1, keepdims=True)
+    db[clustered] = centers[labels[clustered]] + noise
+    db /= np.linalg.norm(db, axis=1, keepdims=True)  # normalize to unit length
+    return db, labels
 
-def generate_payloads(n_records: int) -> np.ndarray:
+def generate_payloads(rng: np.random.Generator, n_records: int) -> np.ndarray:
     """
     Generate random payload vectors with int16 values in range [0, 512).
-    
+
     Args:
+        rng: The random generator to use
         n_records: Number of payload records to generate
-        
+
     Returns:
         Array of shape (n_records, PAYLOAD_DIM=7) with the payload vectors
     """
-    rng = np.random.default_rng()
     return rng.integers(low=0, high=512,
                         size=(n_records, PAYLOAD_DIM), dtype=np.int16)
 
+def generate_chunk(dataset_dir: Path, entropy: int, chunk_idx: int,
+                   n_records: int, dim: int):
+    """
+    Generate one chunk of records and payloads, writing them in place into
+    the (already allocated) db.bin, labels.bin and payloads.bin files.
+    """
+    start = chunk_idx * CHUNK_SIZE
+    n_chunk = min(CHUNK_SIZE, n_records - start)
+    rng = np.random.default_rng(chunk_seed(entropy, chunk_idx))
+
+    centers = np.memmap(dataset_dir / "centers.bin", dtype=np.float32,
+                        mode="r").reshape(-1, dim)
+    db = np.memmap(dataset_dir / "db.bin", dtype=np.float32, mode="r+",
+                   offset=start * dim * 4, shape=(n_chunk, dim))
+    labels = np.memmap(dataset_dir / "labels.bin", dtype=np.int32, mode="r+",
+                       offset=start * 4, shape=(n_chunk,))
+    payloads = np.memmap(dataset_dir / "payloads.bin", dtype=np.int16,
+                         mode="r+", offset=start * PAYLOAD_DIM * 2,
+                         shape=(n_chunk, PAYLOAD_DIM))
+
+    db[:], labels[:] = generate_db_points(rng, centers, n_chunk, dim)
+    payloads[:] = generate_payloads(rng, n_chunk)
+    for mm in (db, labels, payloads):
+        mm.flush()
 
 def main():
     """
@@ -71,18 +126,19 @@ def main():
     parser.add_argument('size', type=int, choices=range(TOY, LARGE+1),
                         help='Dataset size (0-toy/1-small/2-medium/3-large)')
     parser.add_argument('--seed', type=int, help='Random seed for reproducibility')
-    
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='Number of worker processes (default: # of CPUs)')
+
     args, _ = parser.parse_known_args()
     size = args.size
-    
-    # Set random seed if provided
-    if args.seed is not None:
-        random.seed(args.seed)
-        np.random.seed(args.seed)
+
+    # The root of all the derived seeds, fresh entropy if no seed is given
+    entropy = np.random.SeedSequence(args.seed).entropy
 
     # Use params.py to get instance parameters
     params = InstanceParams(size)
     n_records = params.get_db_size()
+    dim = params.get_record_dim()
 
     # Calculate number of centers
     n_centers = max(1, int(n_records / 32))
@@ -90,16 +146,36 @@ def main():
     # Get dataset directory from params and ensure it exists
     dataset_dir = params.datadir()
     dataset_dir.mkdir(parents=True, exist_ok=True)
+    # Unlink the old files rather than overwriting them, they may be
+    # hard-linked into the harness artifact cache
+    for fname in DATASET_FILES:
+        (dataset_dir / fname).unlink(missing_ok=True)
+
+    # Generate the centers and write them to file, the workers read them
+    # back from there
+    centers_rng = np.random.default_rng(
+        np.random.SeedSequence(entropy, spawn_key=(0,)))
+    generate_centers(centers_rng, n_centers, dim).tofile(dataset_dir / "centers.bin")
 
-    # Generate database points and centers, and then payloads
-    db, centers = generate_db_points(
-        n_records, n_centers, params.get_record_dim())
-    payloads = generate_payloads(n_records)
+    # Allocate the output files, then fill them in one chunk at a time
+    # (labels.bin records which center each point came from, it is only
+    # used as a hint when building the cleartext oracle's index)
+    for fname, dtype, shape in [("db.bin", np.float32, (n_records, dim)),
+                                ("labels.bin", np.int32, (n_records,)),
+                                ("payloads.bin", np.int16, (n_records, PAYLOAD_DIM))]:
+        np.memmap(dataset_dir / fname, dtype=dtype, mode="w+", shape=shape).flush()
 
-    # Write data to files
-    db.tofile(dataset_dir / "db.bin")
-    centers.tofile(dataset_dir / "centers.bin")
-    payloads.tofile(dataset_dir / "payloads.bin")
+    n_chunks = (n_records + CHUNK_SIZE - 1) // CHUNK_SIZE
+    n_workers = max(1, min(args.workers or 1, n_chunks))
+    if n_workers == 1:
+        for i in range(n_chunks):
+            generate_chunk(dataset_dir, entropy, i, n_records, dim)
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            futures = [pool.submit(generate_chunk, dataset_dir, entropy, i,
+                                   n_records, dim) for i in range(n_chunks)]
+            for f in futures:
+                f.result()  # propagate exceptions from the workers
 
 
 if __name__ == "__main__":
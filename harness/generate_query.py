@@ -21,6 +21,10 @@ def main():
     parser.add_argument('size', type=int, choices=range(TOY, LARGE+1),
                         help='Dataset size (0-toy/1-small/2-medium/3-large)')
     parser.add_argument('--seed', type=int, help='Random seed for reproducibility')
+    parser.add_argument('--out', type=str,
+                        help='Output file (default: query.bin in the query directory)')
+    parser.add_argument('--query_dir', type=str,
+                        help='Directory for the per-query files (default: the dataset directory)')
     
     args, _ = parser.parse_known_args()
     size = args.size
@@ -31,7 +35,7 @@ def main():
         np.random.seed(args.seed)
 
     # Use params.py to get instance parameters
-    params = InstanceParams(size)
+    params = InstanceParams(size, querydir=args.query_dir)
     dim = params.get_record_dim()
 
     # Get dataset directory from params
@@ -54,7 +58,7 @@ def main():
     qry /= np.linalg.norm(qry) # normalize to unit length
 
     # store the query to file
-    query_file = dataset_dir / "query.bin"
+    query_file = args.out or params.qrydatadir() / "query.bin"
     qry.tofile(query_file)
 
 
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+index_common.py - Code shared by the indexes of the cleartext oracle
+(center_index.py and quantized_index.py): the location and freshness of the
+index files, and the quantized int8 copies of records with their bounds.
+
+A record x is stored as an int8 vector q with a per-row scale s, where
+s = max|x_i| / 127 and q = round(x / s), and an upper bound e on the
+quantization error ||x - s*q||. For every query v we then have
+
+    |<x,v> - s*<q,v>| <= e * ||v||.
+"""
+# Copyright (c) 2025, Amazon Web Services
+# All rights reserved.
+#
+# This software is licensed under the terms of the Apache v2 License.
+# See the LICENSE.md file for details.
+import json
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import numpy as np
+
+# Safety margin for the bounds, covers the float32 rounding errors in the
+# similarities computed by the oracle (and is larger than similarity.TIE_EPS)
+BOUND_EPS = 1e-4
+
+# Number of records per block when building an index
+BUILD_BLOCK_ROWS = 1 << 14
+
+def index_dir(dataset_dir: Path) -> Path:
+    """The directory holding the index files of a dataset."""
+    return dataset_dir / "index"
+
+def db_signature(dataset_dir: Path) -> dict:
+    """Identify the version of db.bin that an index was built for."""
+    st = (dataset_dir / "db.bin").stat()
+    return {"db_bytes": st.st_size, "db_mtime_ns": st.st_mtime_ns}
+
+def is_fresh(dataset_dir: Path, files: list[str], meta_file: str) -> bool:
+    """Check that all the files of an index exist and match db.bin."""
+    idir = index_dir(dataset_dir)
+    if not all((idir / f).exists() for f in files):
+        return False
+    meta = json.loads((idir / meta_file).read_text())
+    return all(meta.get(k) == v for k, v in db_signature(dataset_dir).items())
+
+def quantize(block: np.ndarray) -> tuple:
+    """
+    Quantize a block of records to int8.
+
+    Returns:
+        Tuple containing the int8 block, the per-row scales, and the
+        per-row upper bounds on the quantization error
+    """
+    scale = np.abs(block).max(axis=1) / 127
+    scale[scale == 0] = 1.0
+    q = np.rint(block / scale[:, None]).astype(np.int8)
+    err = np.linalg.norm(block.astype(np.float64)
+                         - q * scale[:, None].astype(np.float64), axis=1)
+    # Round up, so the float32 value is still an upper bound
+    err = np.nextafter(err.astype(np.float32), np.float32(np.inf))
+    return q, scale.astype(np.float32), err
+
+def write_quantized(db: np.ndarray, rows, files: tuple, n_threads=None) -> np.ndarray:
+    """
+    Write the int8 copy of the given rows of db (all of them if rows is
+    None), and their scales and error bounds, to the three files in files.
+    Returns the error bounds.
+    """
+    n_rows = len(db) if rows is None else len(rows)
+    q_file, scale_file, err_file = files
+    if n_rows == 0:  # np.memmap cannot create an empty file
+        q_db = np.empty((0, db.shape[1]), dtype=np.int8)
+        q_db.tofile(q_file)
+    else:
+        q_db = np.memmap(q_file, dtype=np.int8, mode="w+", shape=(n_rows, db.shape[1]))
+    scale = np.empty(n_rows, dtype=np.float32)
+    err = np.empty(n_rows, dtype=np.float32)
+
+    def build(start):
+        end = start + BUILD_BLOCK_ROWS
+        block = db[start:end] if rows is None else db[rows[start:end]]
+        q_db[start:end], scale[start:end], err[start:end] = quantize(np.asarray(block))
+
+    with ThreadPoolExecutor(max_workers=n_threads) as pool:
+        list(pool.map(build, range(0, n_rows, BUILD_BLOCK_ROWS)))
+    if n_rows > 0:
+        q_db.flush()
+    scale.tofile(scale_file)
+    err.tofile(err_file)
+    return err
+
+def load_quantized(files: tuple) -> tuple:
+    """Map an int8 copy written by write_quantized, with its scales and bounds."""
+    q_file, scale_file, err_file = files
+    scale = np.fromfile(scale_file, dtype=np.float32)
+    err = np.fromfile(err_file, dtype=np.float32)
+    q_db = np.empty((0, 1), dtype=np.int8)
+    if len(scale) > 0:
+        q_db = np.memmap(q_file, dtype=np.int8, mode="r").reshape(len(scale), -1)
+    return q_db, scale, err
+
+def screen_quantized(q_block: np.ndarray, scale: np.ndarray, err: np.ndarray,
+                     qs: np.ndarray, q_norms: np.ndarray, threshold: float) -> tuple:
+    """
+    Compare a block of quantized records with the queries (the rows of qs,
+    with norms q_norms). Returns two (records x queries) boolean matrices:
+    the pairs that surely match, and those that are too close to the
+    threshold to tell and must be re-checked against the float32 records.
+    """
+    approx = np.asarray(q_block, dtype=np.float32) @ qs.T
+    approx *= scale[:, None]
+    bound = err[:, None] * q_norms + BOUND_EPS
+    sure = approx - bound > threshold
+    unsure = (np.abs(approx - threshold) <= bound) & ~sure
+    return sure, unsure
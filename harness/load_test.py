@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+load_test.py - Drive the server step of a submission with many concurrent
+queries against the same encrypted database, and report throughput and
+latency percentiles for each concurrency level.
+
+All the queries are generated and encrypted ahead of time, each in its own
+query directory io/<size>/load/q<k>, and their expected results are
+computed with one call to cleartext_impl. Then for every concurrency level
+c, c client threads keep sending requests (cycling through the queries)
+for the duration of the time window. Every request runs
+server_encrypted_compute in its own directory io/<size>/load/r<seq>, with
+a hard link to the encrypted query. After each window all the answers are
+decrypted and checked against the expected results.
+
+This is used by run_submission.py --load, after steps 1-5.
+"""
+# Copyright (c) 2025, Amazon Web Services
+# All rights reserved.
+#
+# This software is licensed under the terms of the Apache v2 License.
+# See the LICENSE.md file for details.
+import os
+import json
+import time
+import shutil
+import threading
+import subprocess
+from pathlib import Path
+import numpy as np
+import utils
+
+def prepare_queries(params, harness_dir, exec_dir, cmd_args, seeds) -> Path:
+    """
+    Generate, preprocess and encrypt all the queries, and compute their
+    expected results. Returns the load-test directory.
+    """
+    load_dir = params.iodir() / "load"
+    if load_dir.exists():
+        shutil.rmtree(load_dir)
+    for k, seed in enumerate(seeds, start=1):
+        seed_args = ["--seed", str(seed)] if seed is not None else []
+        qry_args = [*cmd_args, *seed_args, "--query_dir", str(load_dir / f"q{k}")]
+        (load_dir / f"q{k}").mkdir(parents=True)
+        utils.run_exe_or_python(harness_dir, "generate_query", *qry_args)
+        utils.run_exe_or_python(exec_dir, "client_preprocess_query", *qry_args)
+        utils.run_exe_or_python(exec_dir, "client_encode_encrypt_query", *qry_args)
+    with open(load_dir / "queries.bin", "wb") as f:
+        for k in range(1, len(seeds) + 1):
+            f.write((load_dir / f"q{k}" / "query.bin").read_bytes())
+    utils.run_exe_or_python(harness_dir, "cleartext_impl", *cmd_args,
+                            "--queries", str(load_dir / "queries.bin"),
+                            "--query_dir", str(load_dir))
+    return load_dir
+
+def run_window(load_dir, exec_dir, cmd_args, n_queries, concurrency, duration, first_seq):
+    """
+    Keep concurrency requests in flight for duration seconds (requests
+    that started before the deadline are run to completion).
+    Returns the list of (seq, query index, latency) of all the requests,
+    and the elapsed time from the first request to the last response.
+    """
+    lock = threading.Lock()
+    requests = []
+    next_seq = [first_seq]
+    errors = []
+    start = time.perf_counter()
+    deadline = start + duration
+
+    def client():
+        while time.perf_counter() < deadline and not errors:
+            with lock:
+                seq = next_seq[0]
+                next_seq[0] += 1
+            k = (seq - 1) % n_queries + 1
+            req_dir = load_dir / f"r{seq}"
+            (req_dir / "ciphertexts_upload").mkdir(parents=True)
+            os.link(load_dir / f"q{k}" / "ciphertexts_upload" / "query.bin",
+                    req_dir / "ciphertexts_upload" / "query.bin")
+            req_start = time.perf_counter()
+            try:
+                utils.run_exe_or_python(exec_dir, "server_encrypted_compute", *cmd_args,
+                                        "--query_dir", str(req_dir), in_process=False)
+            except subprocess.CalledProcessError as e:
+                errors.append(e)
+                return
+            latency = time.perf_counter() - req_start
+            with lock:
+                requests.append((seq, k, latency))
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if errors:
+        raise errors[0]
+    return sorted(requests), time.perf_counter() - start
+
+def check_answers(load_dir, harness_dir, exec_dir, cmd_args, requests, verify_args=()) -> int:
+    """Decrypt and verify the answers of all the requests, return # of failures."""
+    failures = 0
+    for seq, k, _ in requests:
+        req_dir = load_dir / f"r{seq}"
+        req_args = [*cmd_args, "--query_dir", str(req_dir)]
+        utils.run_exe_or_python(exec_dir, "client_decrypt_decode", *req_args)
+        utils.run_exe_or_python(exec_dir, "client_postprocess", *req_args)
+        try:
+            utils.run_exe_or_python(harness_dir, "verify_result",
+                                    str(load_dir / f"expected-{k}.bin"),
+                                    str(req_dir / "results.bin"), *cmd_args[1:], *verify_args)
+        except subprocess.CalledProcessError:
+            failures += 1
+        shutil.rmtree(req_dir)  # the results of a request can be large
+    return failures
+
+def latency_stats(latencies) -> dict:
+    """
+    Percentiles and mean of a list of latencies, in seconds, or all None
+    if no query completed in the window.
+    """
+    if len(latencies) == 0:
+        return {"p50": None, "p95": None, "p99": None, "mean": None}
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {"p50": p50, "p95": p95, "p99": p99, "mean": float(np.mean(latencies))}
+
+def fmt_seconds(x) -> str:
+    """Format a latency (or None) for the report."""
+    return "n/a" if x is None else f"{round(x, 4)}s"
+
+def run_load_test(params, harness_dir, exec_dir, cmd_args, seeds, levels, duration,
+                  verify_args=()):
+    """
+    Run the load test for all the concurrency levels, print a report and
+    save it to load.json in the measurements directory.
+    Returns the total number of answers that failed verification.
+    """
+    print(f"         [harness] Load test: preparing {len(seeds)} encrypted queries")
+    load_dir = prepare_queries(params, harness_dir, exec_dir, cmd_args, seeds)
+    report = {"Queries": len(seeds), "Window": f"{duration}s", "Levels": {}}
+    base_p50 = None
+    seq = 1
+    total_failures = 0
+    for c in levels:
+        print(f"         [harness] Load test: concurrency {c} for {duration}s")
+        requests, elapsed = run_window(load_dir, exec_dir, cmd_args, len(seeds),
+                                       c, duration, seq)
+        seq += len(requests)
+        failures = check_answers(load_dir, harness_dir, exec_dir, cmd_args, requests,
+                                 verify_args)
+        total_failures += failures
+        lat = latency_stats([r[2] for r in requests])
+        qps = len(requests) / elapsed if elapsed > 0 else 0.0
+        # The slowdown is relative to the first level with a positive p50
+        base_p50 = base_p50 or lat["p50"]
+        slowdown = lat["p50"] / base_p50 if lat["p50"] is not None and base_p50 else None
+        report["Levels"][str(c)] = {
+            "Requests": len(requests),
+            "Failed verification": failures,
+            "Throughput": f"{round(qps, 4)} queries/s",
+            **{k: fmt_seconds(v) for k, v in lat.items()},
+            "p50 slowdown": "n/a" if slowdown is None else f"{round(slowdown, 2)}x",
+        }
+        color = utils.TextFormat.GREEN if failures == 0 else utils.TextFormat.RED
+        print(f"{color}         [harness] concurrency {c}: {len(requests)} requests,",
+              f"{round(qps, 4)} queries/s, p50 {fmt_seconds(lat['p50'])},",
+              f"p95 {fmt_seconds(lat['p95'])}, p99 {fmt_seconds(lat['p99'])},",
+              f"{failures} failed verification{utils.TextFormat.RESET}")
+
+    params.measuredir().mkdir(parents=True, exist_ok=True)
+    with open(params.measuredir() / "load.json", "w") as f:
+        json.dump(report, f, indent=2)
+    return total_failures
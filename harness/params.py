@@ -31,11 +31,14 @@ PAYLOAD_DIM = 7
 class InstanceParams:
     """Parameters that differ for different instance sizes."""
 
-    def __init__(self, size, count_only=False, rootdir=None):
+    def __init__(self, size, count_only=False, rootdir=None, querydir=None):
         """Constructor."""
         self.size = size
         self.count_only = count_only
         self.rootdir = Path(rootdir) if rootdir else Path.cwd()
+        # Optional directory holding all the per-query files, so several
+        # queries can be in flight at once (see the qry*dir methods below)
+        self.querydir = self.rootdir / querydir if querydir else None
 
         if size > LARGE:
             raise ValueError("Invalid instance size")
@@ -77,3 +80,22 @@ class InstanceParams:
     def measuredir(self):
         """Return the measurements directory path."""
         return self.rootdir / "measurements" / instance_name(self.size, self.count_only)
+
+    # Per-query files (the query, the encrypted query and results, and the
+    # expected results). By default they are in the dataset and I/O
+    # directories, if a query directory is set then they are all under it.
+    def qrydatadir(self):
+        """Return the directory of the cleartext query and expected results."""
+        return self.querydir if self.querydir else self.datadir()
+
+    def qryiodir(self):
+        """Return the I/O directory of the query results."""
+        return self.querydir if self.querydir else self.iodir()
+
+    def qryupdir(self):
+        """Return the directory of the encrypted query."""
+        return self.qryiodir() / "ciphertexts_upload"
+
+    def qrydowndir(self):
+        """Return the directory of the encrypted results."""
+        return self.qryiodir() / "ciphertexts_download"
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+quantized_index.py - A quantized int8 copy of the dataset, used by the
+cleartext oracle of fetch-by-similarity to scan 4x fewer bytes.
+
+Every record x is stored as an int8 vector q with a per-row scale s, and
+an upper bound e on the quantization error (see index_common.py), so for
+every query v we have
+
+    |<x,v> - s*<q,v>| <= e * ||v||.
+
+The approximate similarities s*<q,v> are computed for all the records, and
+only the records whose approximate similarity is within this error bound
+from the threshold are re-checked against the float32 rows in db.bin.
+Hence the results are exactly those of a full float32 scan.
+
+The copy is built once per dataset and stored under datasets/<size>/index,
+it is rebuilt automatically when db.bin changes.
+"""
+# Copyright (c) 2025, Amazon Web Services
+# All rights reserved.
+#
+# This software is licensed under the terms of the Apache v2 License.
+# See the LICENSE.md file for details.
+import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import numpy as np
+from params import InstanceParams, TOY, LARGE
+from similarity import is_match
+from index_common import (index_dir, db_signature, is_fresh, write_quantized,
+                          load_quantized, screen_quantized)
+
+Q8_FILES = ["q8_db.bin", "q8_scale.bin", "q8_err.bin"]
+FILES = [*Q8_FILES, "q8_meta.json"]
+
+def build_index(dataset_dir: Path, dim: int, n_threads=None):
+    """Write the quantized copy of db.bin."""
+    db = np.memmap(dataset_dir / "db.bin", dtype=np.float32, mode="r").reshape(-1, dim)
+    idir = index_dir(dataset_dir)
+    idir.mkdir(exist_ok=True)
+    err = write_quantized(db, None, [idir / f for f in Q8_FILES], n_threads)
+    meta = {"max_err": float(err.max(initial=0)), **db_signature(dataset_dir)}
+    (idir / "q8_meta.json").write_text(json.dumps(meta, indent=2))
+
+def find_matches_int8(dataset_dir: Path, dim: int, qs: np.ndarray,
+                      threshold: float, block_rows: int, n_threads=None) -> list[np.ndarray]:
+    """
+    Find the matches of all the queries (the rows of qs) by scanning the
+    quantized copy, re-checking the uncertain records against db.bin.
+    Returns a list with the (sorted) indices of the matching records for
+    every query.
+    """
+    if not is_fresh(dataset_dir, FILES, "q8_meta.json"):
+        print("         [oracle] Building quantized copy of the dataset")
+        build_index(dataset_dir, dim, n_threads)
+    q_db, scale, err = load_quantized([index_dir(dataset_dir) / f for f in Q8_FILES])
+    db = np.memmap(dataset_dir / "db.bin", dtype=np.float32, mode="r").reshape(-1, dim)
+    q_norms = np.linalg.norm(qs.astype(np.float64), axis=1).astype(np.float32)
+
+    def scan(start):
+        end = start + block_rows
+        sure, unsure = screen_quantized(q_db[start:end], scale[start:end], err[start:end],
+                                        qs, q_norms, threshold)
+        # Re-check the uncertain rows against the float32 records
+        rows = np.flatnonzero(unsure.any(axis=1))
+        if len(rows) > 0:
+            sure[rows] = is_match(db[start + rows], qs, threshold)
+        return [start + np.flatnonzero(sure[:, k]) for k in range(len(qs))], len(rows)
+
+    with ThreadPoolExecutor(max_workers=n_threads) as pool:
+        parts = list(pool.map(scan, range(0, len(q_db), block_rows)))
+
+    n_rechecked = sum(n for _, n in parts)
+    print(f"         [oracle] Quantized scan re-checked {n_rechecked}/{len(q_db)} rows",
+          f"(max quantization error {float(err.max(initial=0)):.2e})")
+    return [np.concatenate([p[k] for p, _ in parts] or [np.empty(0, dtype=np.intp)])
+            for k in range(len(qs))]
+
+def main():
+    """
+    Usage: python3 quantized_index.py <size> - (re)build the quantized copy
+    """
+    parser = argparse.ArgumentParser(description='Build the quantized copy of the dataset.')
+    parser.add_argument('size', type=int, choices=range(TOY, LARGE+1),
+                        help='Instance size (0-toy/1-small/2-medium/3-large)')
+    args, _ = parser.parse_known_args()
+    params = InstanceParams(args.size)
+    build_index(params.datadir(), params.get_record_dim())
+
+
+if __name__ == "__main__":
+    main()
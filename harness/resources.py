@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+resources.py - Measure the resources used by the steps of the harness:
+wall-clock and CPU time, peak resident memory, and I/O volume.
+
+Subprocesses are waited for with wait4, which returns the CPU time and
+peak RSS of that child (and its reaped descendants). On Linux we first wait
+without reaping the child, so its /proc/<pid>/io counters can still be
+read. Steps that run inside the harness' own processes (the persistent
+step runner) are measured by getrusage/proc deltas instead, resetting the
+peak RSS counter of the process before each step where the kernel allows.
+"""
+# Copyright (c) 2025 HomomorphicEncryption.org
+# All rights reserved.
+#
+# This software is licensed under the terms of the Apache v2 License.
+# See the LICENSE.md file for details.
+import os
+import sys
+import time
+import resource
+import subprocess
+
+# How the measured quantities are shown in the results. All of them are
+# summed over the processes of a step, except for the peak RSS which is
+# their maximum.
+FIELD_NAMES = {"wall": "Wall", "user_cpu": "User CPU", "system_cpu": "System CPU",
+               "peak_rss": "Peak RSS", "read": "Read", "written": "Written",
+               "disk_read": "Disk read", "disk_written": "Disk written"}
+
+# Map the fields of /proc/<pid>/io to ours. rchar/wchar count all the
+# bytes passed to read/write calls (including page-cache hits), and
+# read_bytes/write_bytes only the bytes that reached the storage layer.
+PROC_IO_FIELDS = {"rchar": "read", "wchar": "written",
+                  "read_bytes": "disk_read", "write_bytes": "disk_written"}
+
+def read_proc_io(pid="self") -> dict:
+    """Read the I/O counters of a process, empty if not available."""
+    try:
+        with open(f"/proc/{pid}/io") as f:
+            lines = [line.split(":") for line in f]
+    except OSError:  # not Linux, or no permission
+        return {}
+    return {PROC_IO_FIELDS[k]: int(v) for k, v in lines if k in PROC_IO_FIELDS}
+
+def maxrss_bytes(ru) -> int:
+    """ru_maxrss is in kilobytes on Linux and in bytes on macOS."""
+    return ru.ru_maxrss if sys.platform == "darwin" else ru.ru_maxrss * 1024
+
+def run_measured(cmd, env=None, check=True) -> dict:
+    """
+    Run a command to completion (as subprocess.run would), and return the
+    resources that it used.
+    """
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, env=env)
+    io = {}
+    try:
+        if hasattr(os, "waitid"):  # wait, but leave the child a zombie
+            os.waitid(os.P_PID, proc.pid, os.WEXITED | os.WNOWAIT)
+            io = read_proc_io(proc.pid)
+        _, status, ru = os.wait4(proc.pid, 0)
+    except BaseException:
+        proc.kill()
+        proc.wait()
+        raise
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    usage = {"wall": time.perf_counter() - start,
+             "user_cpu": ru.ru_utime, "system_cpu": ru.ru_stime,
+             "peak_rss": maxrss_bytes(ru), **io}
+    if check and proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+    return usage
+
+def peak_rss_self(ru) -> int:
+    """The peak RSS of this process since the last reset, if available."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return maxrss_bytes(ru)  # the peak over the lifetime of the process
+
+class InProcessMeter:
+    """Measure the resources used by code running in this process."""
+
+    def __init__(self):
+        # Reset the peak RSS ("VmHWM") counter of this process, if possible
+        try:
+            with open("/proc/self/clear_refs", "w") as f:
+                f.write("5")
+        except OSError:
+            pass
+        self.start = time.perf_counter()
+        self.self_ru = resource.getrusage(resource.RUSAGE_SELF)
+        self.child_ru = resource.getrusage(resource.RUSAGE_CHILDREN)
+        self.io = read_proc_io()
+
+    def stop(self) -> dict:
+        """Return the resources used since the meter was created."""
+        self_ru = resource.getrusage(resource.RUSAGE_SELF)
+        child_ru = resource.getrusage(resource.RUSAGE_CHILDREN)
+        usage = {"wall": time.perf_counter() - self.start,
+                 "user_cpu": (self_ru.ru_utime - self.self_ru.ru_utime
+                              + child_ru.ru_utime - self.child_ru.ru_utime),
+                 "system_cpu": (self_ru.ru_stime - self.self_ru.ru_stime
+                                + child_ru.ru_stime - self.child_ru.ru_stime),
+                 "peak_rss": peak_rss_self(self_ru)}
+        # The children's peak is over the lifetime of this process, it is
+        # only relevant if a child of this step set a new peak
+        if child_ru.ru_maxrss > self.child_ru.ru_maxrss:
+            usage["peak_rss"] = max(usage["peak_rss"], maxrss_bytes(child_ru))
+        io = read_proc_io()
+        usage.update({k: io[k] - self.io.get(k, 0) for k in io})
+        return usage
+
+def combine(a: dict, b: dict) -> dict:
+    """Combine the resources of two processes that ran as part of one step."""
+    if not a:
+        return dict(b)
+    out = {k: a.get(k, 0) + b.get(k, 0) for k in set(a) | set(b) if k != "peak_rss"}
+    out["peak_rss"] = max(a.get("peak_rss", 0), b.get("peak_rss", 0))
+    return out
@@ -8,11 +8,30 @@ run_submission.py - run the entire submission process, from build to verify
 # This software is licensed under the terms of the Apache v2 License.
 # See the LICENSE.md file for details.
 import sys
+import json
+import atexit
+import time
+import shutil
 import argparse
+import threading
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import utils
 from params import InstanceParams, TOY, LARGE, instance_name
+from artifact_cache import ArtifactCache
+from resources import combine
+from bandwidth import scan
+from compare_measurements import flatten, stats, ci_is_tight, MAIN_STEP
+from generate_dataset import DATASET_FILES
+from load_test import run_load_test
+from update_bench import run_update_bench
+from upload_server import UploadServer
+from server_daemon import ServerDaemon
+
+# The submission steps whose outputs are stored in the artifact cache
+SETUP_STEPS = ["client_preprocess_dataset", "client_key_generation",
+               "client_encode_encrypt_db", "server_preprocess_dataset"]
 
 def main():
     """
@@ -30,6 +49,71 @@ def main():
                         help='Only count # of matches, do not return payloads')
     parser.add_argument('--remote', action='store_true',
                         help='Run example submission in remote backend mode')
+    parser.add_argument('--batch_oracle', action='store_true',
+                        help='Generate all the queries up front and compute their '
+                             'expected results in a single pass over the dataset')
+    parser.add_argument('--cache', action='store_true',
+                        help='Reuse the dataset, keys and encrypted database of '
+                             'an earlier run with the same size, seed and code '
+                             '(requires --seed, local backend only)')
+    parser.add_argument('--persistent_runner', action='store_true',
+                        help='Run the Python steps in one long-lived worker process '
+                             'instead of a new interpreter per step')
+    parser.add_argument('--target_ci', type=float, metavar='FRAC',
+                        help='Keep adding runs (beyond --num_runs) until the 95%% confidence '
+                             'interval of the encrypted computation time is within '
+                             '+-FRAC of its mean, e.g. 0.01 for 1%%')
+    parser.add_argument('--max_runs', type=int, default=20,
+                        help='Maximal number of runs with --target_ci (default: 20)')
+    parser.add_argument('--pipeline', type=int, default=0, metavar='DEPTH',
+                        help='Overlap the client and server steps of up to DEPTH '
+                             'runs, each in its own io subdirectory (default: 0, '
+                             'run one after the other)')
+    parser.add_argument('--batch_queries', type=int, default=0, metavar='K',
+                        help='Send the queries to the server in batches of K, so each '
+                             'server invocation reads the encrypted database once for '
+                             'K queries (local backend only, default: 0, no batching)')
+    parser.add_argument('--daemon', action='store_true',
+                        help='Run the server step in a long-lived daemon that loads the '
+                             'keys once, rather than in a new process per query '
+                             '(local backend only)')
+    parser.add_argument('--resident_db', action='store_true',
+                        help='With --daemon, also keep the encrypted database in memory')
+    parser.add_argument('--prefetch', type=int, metavar='DEPTH',
+                        help='How many encrypted database rows the server reads ahead '
+                             'of the matrix-vector product (local backend only, '
+                             '0 reads them synchronously, default: the submission\'s)')
+    parser.add_argument('--payload_cache', type=int, metavar='MB',
+                        help='Memory budget of the server\'s cache of payload ciphertexts '
+                             '(local backend only, 0 disables it, default: the submission\'s)')
+    parser.add_argument('--packed_db', action='store_true',
+                        help='Store the encrypted database in a few large segment files '
+                             'with an index, rather than one file per ciphertext '
+                             '(local backend only)')
+    parser.add_argument('--load', type=int, default=0, metavar='N',
+                        help='Load-test the server step instead of steps 6-12: encrypt '
+                             'N queries up front, then send them concurrently (see --concurrency)')
+    parser.add_argument('--update_bench', type=str, metavar='COUNTS',
+                        help='Benchmark incremental updates of the encrypted database '
+                             'instead of steps 6-12: for each comma-separated number of '
+                             'records, change that many records (modify, delete and '
+                             'append), re-encrypt only what changed, then run and verify '
+                             'one query (local backend only)')
+    parser.add_argument('--concurrency', type=str, default='1,2,4',
+                        help='Comma-separated concurrency levels for --load (default: 1,2,4)')
+    parser.add_argument('--duration', type=float, default=30.0, metavar='SECONDS',
+                        help='Length of the time window of each concurrency level '
+                             'with --load (default: 30)')
+    parser.add_argument('--link_speeds', type=str, default='100,1000,10000',
+                        help='Comma-separated link speeds in Mbit/s, for the estimated '
+                             'transfer times of the keys and ciphertexts (default: 100,1000,10000)')
+    parser.add_argument('--strict_verify', action='store_true',
+                        help='Require all the matching payloads to be returned, even '
+                             'for queries with more than 32 matches')
+    parser.add_argument('--upload_url', type=str, metavar='URL',
+                        help='Upload the keys and encrypted database in chunks to this server '
+                             '(remote backend only), "local" starts a local stand-in server. '
+                             'Only steps 1-5 are run, the queries are not')
 
     args, _ = parser.parse_known_args()
     size = args.size
@@ -67,24 +151,255 @@ def main():
     if args.seed is not None:
         np.random.seed(args.seed)
         rng = np.random.default_rng(args.seed)
+    utils.init_step_runner(args.persistent_runner)
+    utils.set_link_speeds([float(x) for x in args.link_speeds.split(",")])
     utils.log_step(0, "Init", True)
 
     # Common command-line arguments for all steps
     cmd_args = [str(size), ]
     if args.count_only:
         cmd_args.extend(["--count_only"])
+    if args.prefetch is not None:  # Only used by the server, other steps ignore it
+        cmd_args.extend(["--prefetch", str(args.prefetch)])
+    if args.payload_cache is not None:  # Likewise
+        cmd_args.extend(["--payload_cache", str(args.payload_cache)])
+    if args.packed_db:  # Used by client_encode_encrypt_db, the server finds the index
+        cmd_args.extend(["--packed_db"])
     query_args = cmd_args      # Query steps should not get the global seed
     if args.seed is not None:  # Use seed if provided
         generic_seed = rng.integers(0,0x7fffffff)
         cmd_args.extend(["--seed", str(generic_seed)])
 
+    # Extra arguments for verify_result
+    verify_args = ["--strict"] if args.strict_verify else []
+
+    # Optionally upload with the chunked protocol, to a local stand-in server
+    upload_args, upload_server = [], None
+    if args.upload_url:
+        if not remote_be:
+            print("         [harness] --upload_url requires the remote backend, not used")
+        else:
+            upload_url = args.upload_url
+            if upload_url == "local":
+                # Kept across runs, so already uploaded keys are not sent again
+                upload_server = UploadServer(params.rootdir / "cache" / "upload_server")
+                upload_url = upload_server.url
+                print(f"         [harness] Local upload server at {upload_url}")
+            upload_args = ["--upload_url", upload_url]
+
+    # Steps 1-5, or restore their outputs from the artifact cache
+    cache, cache_key, cache_entry = None, None, None
+    if args.cache:
+        if args.seed is None or remote_be:
+            print("         [harness] Artifact cache requires --seed and the local backend, not used")
+        else:
+            cache = ArtifactCache(params.rootdir / "cache")
+            cache_key = ArtifactCache.make_key(
+                {"size": size, "count_only": args.count_only, "seed": args.seed,
+                 "packed_db": args.packed_db},
+                setup_code_files(harness_dir, exec_dir))
+            cache_entry = cache.lookup(cache_key)
+
+    cache_items = {"dataset": params.datadir(),
+                   "keys": io_dir / "keys",
+                   "ciphertexts_upload": io_dir / "ciphertexts_upload"}
+    if cache_entry is not None:
+        ArtifactCache.restore(cache_entry, cache_items)
+        utils.log_step(5, "Restore dataset, keys and encrypted database from cache")
+        utils.log_size(io_dir / "keys", "Public and evaluation keys")
+        utils.log_size(io_dir / "ciphertexts_upload", "Encrypted database")
+    else:
+        run_setup_steps(harness_dir, exec_dir, io_dir, cmd_args, remote_be, upload_args)
+        if cache is not None:
+            cache.store(cache_key, cache_items, files={"dataset": DATASET_FILES})
+    if cache is not None:
+        utils.log_cache(cache_key, cache_entry is not None)
+    if upload_server is not None:
+        upload_server.close()
+
+    # The uploads went to the given server rather than to the remote
+    # backend, which would answer the queries from stale (or no) state, so
+    # only the upload steps are benchmarked
+    if upload_args:
+        params.measuredir().mkdir(parents=True, exist_ok=True)
+        utils.save_run(params.measuredir() / "upload.json", io_dir / "server_reported_steps.json")
+        utils.close_step_runner()
+        print("         [harness] --upload_url only benchmarks the uploads, steps 6-12 are not run")
+        print(f"\nAll steps completed for the {instance_name(size,args.count_only)} dataset!")
+        return
+
+    # Optionally load-test the server step, instead of steps 6-12
+    if args.load > 0:
+        if args.daemon:
+            print("         [harness] --daemon is not used with --load")
+        load_seeds = [None] * args.load
+        if args.seed is not None:
+            load_seeds = [rng.integers(0,0x7fffffff) for _ in range(args.load)]
+        levels = [int(c) for c in args.concurrency.split(",")]
+        failures = run_load_test(params, harness_dir, exec_dir, cmd_args,
+                                 load_seeds, levels, args.duration, verify_args)
+        utils.close_step_runner()
+        if failures > 0:
+            print(f"Error: {failures} answers failed verification in the load test")
+            sys.exit(1)
+        print(f"\nAll steps completed for the {instance_name(size,args.count_only)} dataset!")
+        return
+
+    # Derive the seeds for the queries of all the runs
+    qry_seeds = [None] * args.num_runs
+    if args.seed is not None:  # Use dervied seed if seed argument is provided
+        qry_seeds = [rng.integers(0,0x7fffffff) for _ in range(args.num_runs)]
+
+    # 5.1 Optionally generate all the queries up front and compute all the
+    # expected results in one pass over the dataset
+    if args.batch_oracle:
+        batch_oracle(params, harness_dir, query_args, qry_seeds)
+        utils.log_step(5.1, "Query generation and cleartext computation (all runs)")
+
+    # 5.2 Optionally start the server daemon, its one-time load is timed here
+    daemon = None
+    if args.daemon:
+        if remote_be:
+            print("         [harness] --daemon requires the local backend, not used")
+        else:
+            daemon = ServerDaemon(exec_dir, io_dir / "daemon", cmd_args, args.resident_db)
+            atexit.register(daemon.close)
+            utils.log_daemon(daemon.wait_ready())
+            utils.log_step(5.2, "Server daemon start")
+
+    # Optionally benchmark updates of the encrypted database, instead of
+    # steps 6-12 (the daemon, if any, serves the queries after each update)
+    if args.update_bench:
+        if remote_be:
+            print("         [harness] --update_bench requires the local backend, not used")
+        else:
+            counts = [int(n) for n in args.update_bench.split(",")]
+            change_seed, update_seeds = None, [None] * len(counts)
+            if args.seed is not None:
+                change_seed = rng.integers(0,0x7fffffff)
+                update_seeds = [rng.integers(0,0x7fffffff) for _ in counts]
+            failures = run_update_bench(params, harness_dir, exec_dir, cmd_args, counts,
+                                        change_seed, update_seeds, verify_args, daemon)
+            utils.close_step_runner()
+            if failures > 0:
+                print(f"Error: {failures} queries failed verification after updates")
+                sys.exit(1)
+            print(f"\nAll steps completed for the {instance_name(size,args.count_only)} dataset!")
+            return
+
+    # Optionally process the queries in batches, one server call per batch
+    if args.batch_queries > 1:
+        if remote_be:
+            print("         [harness] --batch_queries requires the local backend, not used")
+        else:
+            run_batched(params, harness_dir, exec_dir, cmd_args, qry_seeds,
+                        args.batch_queries, args.batch_oracle, verify_args, daemon)
+            utils.close_step_runner()
+            print(f"\nAll steps completed for the {instance_name(size,args.count_only)} dataset!")
+            return
+
+    # Optionally run steps 6-12 of different runs concurrently
+    if args.pipeline > 0:
+        run_pipelined(params, harness_dir, exec_dir, cmd_args, qry_seeds,
+                      args.pipeline, args.batch_oracle, verify_args, daemon)
+        utils.close_step_runner()
+        print(f"\nAll steps completed for the {instance_name(size,args.count_only)} dataset!")
+        return
+
+    # Run steps 6-11 multiple times if requested. With --target_ci, keep
+    # going until the confidence interval of the computation time is tight.
+    n_batch = len(qry_seeds) if args.batch_oracle else 0
+    server_times = []
+    run = 0
+    while run < args.num_runs or (args.target_ci is not None and run < args.max_runs
+                                  and not ci_is_tight(server_times, args.target_ci)):
+        if args.num_runs > 1 or args.target_ci is not None:
+            print(f"\n         [harness] Run {run+1} of {args.num_runs}"
+                  + (f" (at most {args.max_runs})" if args.target_ci is not None else ""))
+        if run == len(qry_seeds):  # An extra run with --target_ci
+            qry_seeds.append(rng.integers(0,0x7fffffff) if args.seed is not None else None)
+
+        # 6. Client-side: Generate a new random query using generate_query.py
+        this_query_args = query_args
+        if qry_seeds[run] is not None:
+            this_query_args.extend(["--seed", str(qry_seeds[run])])
+        if run < n_batch:  # Queries were generated up front
+            shutil.copyfile(params.datadir() / f"query-{run+1}.bin",
+                            params.datadir() / "query.bin")
+        else:
+            utils.run_exe_or_python(harness_dir, "generate_query", *this_query_args)
+        utils.log_step(6, "Query generation")
+
+        # 7. Client-side: preprocess query
+        utils.run_exe_or_python(exec_dir, "client_preprocess_query", *this_query_args)
+        utils.log_step(7, "Query preprocessing")
+
+        # 8. Client-side: Encrypt the query
+        utils.run_exe_or_python(exec_dir, "client_encode_encrypt_query", *this_query_args)
+        utils.log_step(8, "Query encryption")
+        utils.log_size(io_dir / "ciphertexts_upload" / "query.bin" , "Encrypted query")
+
+        # 9. Server-side: run server_encrypted_compute (or send to the daemon)
+        if daemon is not None:
+            daemon.compute([io_dir])
+        else:
+            utils.run_exe_or_python(exec_dir, "server_encrypted_compute", *this_query_args)
+        utils.log_step(9, "Encrypted computation")
+        utils.log_size(io_dir / "ciphertexts_download" / "results.bin" , "Encrypted results")
+
+        # 10. Client-side: decrypt and postprocess
+        utils.run_exe_or_python(exec_dir, "client_decrypt_decode", *this_query_args)
+        utils.run_exe_or_python(exec_dir, "client_postprocess", *this_query_args)
+        utils.log_step(10, "Result decryption and postprocessing")
+
+        # 11. Run the plaintext processing in cleartext_impl.py and verify_results
+        if run < n_batch:  # Expected results were computed up front
+            expected_file = params.datadir() / f"expected-{run+1}.bin"
+        else:
+            utils.run_exe_or_python(harness_dir, "cleartext_impl", *this_query_args)
+            expected_file = params.datadir() / "expected.bin"
+
+        # 12. Verify results
+        result_file = io_dir / "results.bin"
+
+        if not result_file.exists():
+            print(f"Error: Result file {result_file} not found")
+            sys.exit(1)
+
+        utils.run_exe_or_python(harness_dir, "verify_result", str(expected_file), str(result_file),
+                                *this_query_args[1:], *verify_args)  # skip size arg
+
+        # 13. Store measurements
+        run_path = params.measuredir() / f"results-{run+1}.json"
+        run_path.parent.mkdir(parents=True, exist_ok=True)
+        submission_report_path = io_dir / "server_reported_steps.json"
+        utils.save_run(run_path, submission_report_path)
+
+        values, _ = flatten(json.loads(run_path.read_text()))
+        server_times.append(values[f"Timing/{MAIN_STEP}"])
+        run += 1
+        if args.target_ci is not None and len(server_times) > 1:
+            s = stats(server_times)
+            print(f"         [harness] {MAIN_STEP}: {round(s['mean'], 4)}s",
+                  f"+- {round(s['ci'], 4)}s (95% CI, {run} runs, target",
+                  f"+- {round(args.target_ci * s['mean'], 4)}s)")
+
+    utils.close_step_runner()
+    print(f"\nAll steps completed for the {instance_name(size,args.count_only)} dataset!")
+
+def run_setup_steps(harness_dir, exec_dir, io_dir, cmd_args, remote_be, upload_args=()):
+    """
+    Run steps 1-5: generate the dataset, generate the keys, and encrypt and
+    upload the database. The upload_args are passed to the upload steps of
+    the remote backend.
+    """
     # 1. Client-side: Generate the datasets
     utils.run_exe_or_python(harness_dir, "generate_dataset", *cmd_args)
     utils.log_step(1, "Dataset generation")
 
     # 1.1 Communication: Get cryptographic context
     if remote_be:
-        utils.run_exe_or_python(exec_dir, "server_get_params", str(size))
+        utils.run_exe_or_python(exec_dir, "server_get_params", cmd_args[0])
         utils.log_step(1.1 , "Communication: Get cryptographic context")
 
     # 2. Client-side: Preprocess the dataset using client_preprocess_dataset
@@ -97,14 +412,18 @@ def main():
     #   seed multiple times, the keys and ciphertexts will still be different.
     utils.run_exe_or_python(exec_dir, "client_key_generation", *cmd_args)
     utils.log_step(3, "Key Generation")
+    if remote_be:
+        utils.log_key_store(io_dir / "key_store.json")
 
     # Report size of keys
     utils.log_size(io_dir / "keys", "Public and evaluation keys")
 
     # 3.1 Communication: Upload evaluation key
     if remote_be:
-        utils.run_exe_or_python(exec_dir, "server_upload_ek", str(size))
+        utils.run_exe_or_python(exec_dir, "server_upload_ek", cmd_args[0], *upload_args)
         utils.log_step(3.1 , "Communication: Upload evaluation key")
+        if upload_args:
+            utils.log_upload(io_dir / "upload_ek.json", "Communication: Upload evaluation key")
 
     # 4. Client-side: Encode and encrypt the dataset
     utils.run_exe_or_python(exec_dir, "client_encode_encrypt_db", *cmd_args)
@@ -115,66 +434,284 @@ def main():
 
     # 4.1 Communication: Upload encrypted database
     if remote_be:
-        utils.run_exe_or_python(exec_dir, "server_upload_db", str(size))
+        utils.run_exe_or_python(exec_dir, "server_upload_db", cmd_args[0], *upload_args)
         utils.log_step(4.1 , "Communication: Upload encrypted database")
+        if upload_args:
+            utils.log_upload(io_dir / "upload_db.json", "Communication: Upload encrypted database")
 
 
     # 5. Server-side: Preprocess the encrypted dataset using server_preprocess_dataset
     utils.run_exe_or_python(exec_dir, "server_preprocess_dataset", *cmd_args)
     utils.log_step(5, "Encrypted dataset preprocessing")
 
-    # Run steps 6-11 multiple times if requested
-    for run in range(args.num_runs):
-        if args.num_runs > 1:
-            print(f"\n         [harness] Run {run+1} of {args.num_runs}")
-
-        # 6. Client-side: Generate a new random query using generate_query.py
-        this_query_args = query_args
-        if args.seed is not None:  # Use dervied seed if seed argument is provided
-            genqry_seed = rng.integers(0,0x7fffffff)
-            this_query_args.extend(["--seed", str(genqry_seed)])
-        utils.run_exe_or_python(harness_dir, "generate_query", *this_query_args)
-        utils.log_step(6, "Query generation")
-
-        # 7. Client-side: preprocess query
-        utils.run_exe_or_python(exec_dir, "client_preprocess_query", *this_query_args)
-        utils.log_step(7, "Query preprocessing")
-
-        # 8. Client-side: Encrypt the query
-        utils.run_exe_or_python(exec_dir, "client_encode_encrypt_query", *this_query_args)
-        utils.log_step(8, "Query encryption")
-        utils.log_size(io_dir / "ciphertexts_upload" / "query.bin" , "Encrypted query")
-
-        # 9. Server-side: run server_encrypted_compute
-        utils.run_exe_or_python(exec_dir, "server_encrypted_compute", *this_query_args)
-        utils.log_step(9, "Encrypted computation")
-        utils.log_size(io_dir / "ciphertexts_download" / "results.bin" , "Encrypted results")
-
-        # 10. Client-side: decrypt and postprocess
-        utils.run_exe_or_python(exec_dir, "client_decrypt_decode", *this_query_args)
-        utils.run_exe_or_python(exec_dir, "client_postprocess", *this_query_args)
-        utils.log_step(10, "Result decryption and postprocessing")
-
-        # 11. Run the plaintext processing in cleartext_impl.py and verify_results
-        utils.run_exe_or_python(harness_dir, "cleartext_impl", *this_query_args)
-
-        # 12. Verify results
-        expected_file = params.datadir() / "expected.bin"
-        result_file = io_dir / "results.bin"
-
-        if not result_file.exists():
-            print(f"Error: Result file {result_file} not found")
-            sys.exit(1)
-
-        utils.run_exe_or_python(harness_dir, "verify_result", str(expected_file), str(result_file), *this_query_args[1:])  # skip size arg
-
-        # 13. Store measurements
-        run_path = params.measuredir() / f"results-{run+1}.json"
+def setup_code_files(harness_dir, exec_dir):
+    """The code files that the outputs of steps 1-5 depend on."""
+    files = [harness_dir / "generate_dataset.py", harness_dir / "params.py"]
+    for name in SETUP_STEPS:
+        files += [exec_dir / f"{name}.py", exec_dir / "build" / name]
+    files += exec_dir.glob("*.py")  # modules shared by the python steps
+    files.append(exec_dir / "tuning.txt")  # read at runtime by the submission
+    return files
+
+def run_pipelined(params, harness_dir, exec_dir, cmd_args, qry_seeds, depth, batch_oracle,
+                  verify_args=(), daemon=None):
+    """
+    Run steps 6-12 for all the queries as a three-stage pipeline: the client
+    generates and encrypts query k+1 and decrypts and verifies query k-1
+    while the server computes on query k. Each query uses its own directory
+    io/<size>/run<k> for its files, and at most depth queries are in flight.
+    The server stage uses the server daemon, if one is given.
+    """
+    io_dir = params.iodir()
+    n_runs = len(qry_seeds)
+    in_flight = threading.Semaphore(depth)
+    step_times = [{} for _ in range(n_runs)]
+    sizes = [{} for _ in range(n_runs)]
+    resources = [{} for _ in range(n_runs)]
+    started = [0.0] * n_runs
+    latencies = [0.0] * n_runs
+
+    def run_args(k):
+        seed_args = ["--seed", str(qry_seeds[k])] if qry_seeds[k] is not None else []
+        return [*cmd_args, *seed_args, "--query_dir", str(io_dir / f"run{k+1}")]
+
+    def timed(k, step_name, fn, *fn_args):
+        start = time.perf_counter()
+        usage = fn(*fn_args)
+        step_times[k][step_name] = step_times[k].get(step_name, 0.0) + time.perf_counter() - start
+        if fn is utils.run_exe_or_python:
+            resources[k][step_name] = combine(resources[k].get(step_name, {}), usage)
+
+    # Stage 1 (client): steps 6-8
+    def client_query(k):
+        in_flight.acquire()
+        started[k] = time.perf_counter()
+        qry_dir = io_dir / f"run{k+1}"
+        qry_dir.mkdir(parents=True, exist_ok=True)
+        if batch_oracle:  # Queries were generated up front
+            timed(k, "Query generation", shutil.copyfile,
+                  params.datadir() / f"query-{k+1}.bin", qry_dir / "query.bin")
+        else:
+            timed(k, "Query generation", utils.run_exe_or_python,
+                  harness_dir, "generate_query", *run_args(k))
+        timed(k, "Query preprocessing", utils.run_exe_or_python,
+              exec_dir, "client_preprocess_query", *run_args(k))
+        timed(k, "Query encryption", utils.run_exe_or_python,
+              exec_dir, "client_encode_encrypt_query", *run_args(k))
+        sizes[k]["Encrypted query"] = scan(qry_dir / "ciphertexts_upload" / "query.bin")
+
+    # Stage 2 (server): step 9
+    def server_compute(k):
+        if daemon is not None:
+            timed(k, "Encrypted computation", daemon.compute, [io_dir / f"run{k+1}"])
+        else:
+            timed(k, "Encrypted computation", utils.run_exe_or_python,
+                  exec_dir, "server_encrypted_compute", *run_args(k))
+        sizes[k]["Encrypted results"] = scan(
+            io_dir / f"run{k+1}" / "ciphertexts_download" / "results.bin")
+
+    # Stage 3 (client): steps 10-13
+    def client_verify(k):
+        qry_dir = io_dir / f"run{k+1}"
+        try:
+            timed(k, "Result decryption and postprocessing", utils.run_exe_or_python,
+                  exec_dir, "client_decrypt_decode", *run_args(k))
+            timed(k, "Result decryption and postprocessing", utils.run_exe_or_python,
+                  exec_dir, "client_postprocess", *run_args(k))
+            if batch_oracle:  # Expected results were computed up front
+                expected_file = params.datadir() / f"expected-{k+1}.bin"
+            else:
+                utils.run_exe_or_python(harness_dir, "cleartext_impl", *run_args(k))
+                expected_file = qry_dir / "expected.bin"
+            result_file = qry_dir / "results.bin"
+            if not result_file.exists():
+                raise FileNotFoundError(f"Result file {result_file} not found")
+            print(f"         [harness] Run {k+1} of {n_runs}")
+            utils.run_exe_or_python(harness_dir, "verify_result", str(expected_file),
+                                    str(result_file), *run_args(k)[1:], *verify_args)  # skip size arg
+            latencies[k] = time.perf_counter() - started[k]
+        finally:
+            in_flight.release()  # free the slot of this query, even if it failed
+
+        run_path = params.measuredir() / f"results-{k+1}.json"
         run_path.parent.mkdir(parents=True, exist_ok=True)
-        submission_report_path = io_dir / "server_reported_steps.json"
-        utils.save_run(run_path, submission_report_path)
-
-    print(f"\nAll steps completed for the {instance_name(size,args.count_only)} dataset!")
+        utils.save_pipelined_run(run_path, qry_dir / "server_reported_steps.json",
+                                 step_times[k], sizes[k], resources[k],
+                                 {"End-to-end latency": f"{round(latencies[k], 4)}s",
+                                  "Depth": depth})
+        print(f"         [harness] Run {k+1} end-to-end latency: {round(latencies[k], 4)}s")
+
+    # One thread per stage, each stage handles the queries in order, and
+    # starts on a query once the previous stage is done with it
+    aborted = threading.Event()
+
+    def stage(fn, k, upstream=None):
+        if upstream is not None:
+            upstream.result()  # re-raises the errors of earlier stages
+        if aborted.is_set():
+            raise RuntimeError("pipeline aborted")
+        fn(k)
+
+    start = time.perf_counter()
+    error = None
+    with ThreadPoolExecutor(1) as client_pool, ThreadPoolExecutor(1) as server_pool, \
+         ThreadPoolExecutor(1) as verify_pool:
+        done = []
+        for k in range(n_runs):
+            queried = client_pool.submit(stage, client_query, k)
+            computed = server_pool.submit(stage, server_compute, k, queried)
+            done.append(verify_pool.submit(stage, client_verify, k, computed))
+        try:
+            for f in done:
+                f.result()
+        except Exception as e:  # any failure of a stage aborts the pipeline
+            error = e
+            aborted.set()
+            for _ in range(n_runs):  # unblock a client stage waiting for a slot
+                in_flight.release()
+    if error is not None:
+        print(f"Error: {error}")
+        sys.exit(1)
+    wall = time.perf_counter() - start
+
+    throughput = 60 * n_runs / wall
+    summary = {"Queries": n_runs, "Depth": depth,
+               "Wall time": f"{round(wall, 4)}s",
+               "Throughput": f"{round(throughput, 2)} queries/min",
+               "End-to-end latency": {f"Run {k+1}": f"{round(t, 4)}s"
+                                      for k, t in enumerate(latencies)}}
+    params.measuredir().mkdir(parents=True, exist_ok=True)
+    with open(params.measuredir() / "pipeline.json", "w") as f:
+        json.dump(summary, f, indent=2)
+    print(f"{utils.TextFormat.GREEN}         [harness] Pipelined throughput: {round(throughput, 2)}",
+          f"queries/min ({n_runs} queries in {round(wall, 4)}s){utils.TextFormat.RESET}")
+
+def run_batched(params, harness_dir, exec_dir, cmd_args, qry_seeds, batch_size,
+                batch_oracle, verify_args=(), daemon=None):
+    """
+    Run steps 6-12 for all the queries, with a single server invocation for
+    every batch of batch_size queries. The server reads each ciphertext of
+    the encrypted database once per batch and uses it for all the queries
+    in the batch. Each query uses its own directory io/<size>/run<k> for its
+    files (as in run_pipelined), the server gets all the directories of a
+    batch. The encrypted computation time of each query is reported as its
+    amortized share, the batch time divided by the number of queries.
+    The batches are sent to the server daemon, if one is given.
+    """
+    io_dir = params.iodir()
+    n_runs = len(qry_seeds)
+    step_times = [{} for _ in range(n_runs)]
+    sizes = [{} for _ in range(n_runs)]
+    resources = [{} for _ in range(n_runs)]
+
+    def run_args(k):
+        seed_args = ["--seed", str(qry_seeds[k])] if qry_seeds[k] is not None else []
+        return [*cmd_args, *seed_args, "--query_dir", str(io_dir / f"run{k+1}")]
+
+    def timed(k, step_name, fn, *fn_args):
+        start = time.perf_counter()
+        usage = fn(*fn_args)
+        step_times[k][step_name] = step_times[k].get(step_name, 0.0) + time.perf_counter() - start
+        if fn is utils.run_exe_or_python:
+            resources[k][step_name] = combine(resources[k].get(step_name, {}), usage)
+
+    batch_times = []
+    for first in range(0, n_runs, batch_size):
+        batch = range(first, min(first + batch_size, n_runs))
+        print(f"\n         [harness] Batch of runs {batch[0]+1}-{batch[-1]+1} of {n_runs}")
+
+        # 6-8. Client-side: generate, preprocess and encrypt the queries
+        for k in batch:
+            qry_dir = io_dir / f"run{k+1}"
+            qry_dir.mkdir(parents=True, exist_ok=True)
+            if batch_oracle:  # Queries were generated up front
+                timed(k, "Query generation", shutil.copyfile,
+                      params.datadir() / f"query-{k+1}.bin", qry_dir / "query.bin")
+            else:
+                timed(k, "Query generation", utils.run_exe_or_python,
+                      harness_dir, "generate_query", *run_args(k))
+            timed(k, "Query preprocessing", utils.run_exe_or_python,
+                  exec_dir, "client_preprocess_query", *run_args(k))
+            timed(k, "Query encryption", utils.run_exe_or_python,
+                  exec_dir, "client_encode_encrypt_query", *run_args(k))
+            sizes[k]["Encrypted query"] = scan(qry_dir / "ciphertexts_upload" / "query.bin")
+        utils.log_step(8, "Query generation, preprocessing and encryption")
+
+        # 9. Server-side: one server_encrypted_compute call for the batch
+        qry_dir_args = [arg for k in batch for arg in ("--query_dir", str(io_dir / f"run{k+1}"))]
+        start = time.perf_counter()
+        if daemon is not None:
+            usage = daemon.compute([io_dir / f"run{k+1}" for k in batch])
+        else:
+            usage = utils.run_exe_or_python(exec_dir, "server_encrypted_compute",
+                                            *cmd_args, *qry_dir_args)
+        batch_times.append(time.perf_counter() - start)
+        utils.log_step(9, f"Encrypted computation ({len(batch)} queries)")
+        for k in batch:
+            step_times[k]["Encrypted computation"] = batch_times[-1] / len(batch)
+            resources[k]["Encrypted computation"] = usage  # of the whole batch
+            sizes[k]["Encrypted results"] = scan(
+                io_dir / f"run{k+1}" / "ciphertexts_download" / "results.bin")
+
+        # 10-13. Client-side: decrypt, verify and store the measurements
+        for k in batch:
+            qry_dir = io_dir / f"run{k+1}"
+            timed(k, "Result decryption and postprocessing", utils.run_exe_or_python,
+                  exec_dir, "client_decrypt_decode", *run_args(k))
+            timed(k, "Result decryption and postprocessing", utils.run_exe_or_python,
+                  exec_dir, "client_postprocess", *run_args(k))
+            if batch_oracle:  # Expected results were computed up front
+                expected_file = params.datadir() / f"expected-{k+1}.bin"
+            else:
+                utils.run_exe_or_python(harness_dir, "cleartext_impl", *run_args(k))
+                expected_file = qry_dir / "expected.bin"
+            result_file = qry_dir / "results.bin"
+            if not result_file.exists():
+                print(f"Error: Result file {result_file} not found")
+                sys.exit(1)
+            utils.run_exe_or_python(harness_dir, "verify_result", str(expected_file),
+                                    str(result_file), *run_args(k)[1:], *verify_args)
+
+            run_path = params.measuredir() / f"results-{k+1}.json"
+            run_path.parent.mkdir(parents=True, exist_ok=True)
+            utils.save_pipelined_run(run_path, qry_dir / "server_reported_steps.json",
+                                     step_times[k], sizes[k], resources[k],
+                                     {"Batch size": len(batch),
+                                      "Batch computation": f"{round(batch_times[-1], 4)}s"},
+                                     section="Batch")
+        utils.log_step(10, "Result decryption, postprocessing and verification")
+
+    n_batches = len(batch_times)
+    per_query = sum(batch_times) / n_runs
+    summary = {"Queries": n_runs, "Batch size": batch_size,
+               "Batches": n_batches,
+               "Batch computation": {f"Batch {b+1}": f"{round(t, 4)}s"
+                                     for b, t in enumerate(batch_times)},
+               "Amortized per-query computation": f"{round(per_query, 4)}s",
+               "Server throughput": f"{round(60 / per_query, 2)} queries/min"}
+    params.measuredir().mkdir(parents=True, exist_ok=True)
+    with open(params.measuredir() / "batch.json", "w") as f:
+        json.dump(summary, f, indent=2)
+    print(f"{utils.TextFormat.GREEN}         [harness] Amortized encrypted computation:",
+          f"{round(per_query, 4)}s per query ({n_runs} queries in {n_batches}",
+          f"batches of up to {batch_size}){utils.TextFormat.RESET}")
+
+def batch_oracle(params, harness_dir, query_args, qry_seeds):
+    """
+    Generate the queries for all the runs, storing the k'th one in
+    query-<k>.bin, then compute all their expected results expected-<k>.bin
+    with a single call to cleartext_impl.
+    """
+    datadir = params.datadir()
+    for k, seed in enumerate(qry_seeds, start=1):
+        seed_args = ["--seed", str(seed)] if seed is not None else []
+        utils.run_exe_or_python(harness_dir, "generate_query", *query_args,
+                                *seed_args, "--out", str(datadir / f"query-{k}.bin"))
+    with open(datadir / "queries.bin", "wb") as f:
+        for k in range(1, len(qry_seeds) + 1):
+            f.write((datadir / f"query-{k}.bin").read_bytes())
+    utils.run_exe_or_python(harness_dir, "cleartext_impl", *query_args,
+                            "--queries", str(datadir / "queries.bin"))
 
 if __name__ == "__main__":
     main()
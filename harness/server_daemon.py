@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+server_daemon.py - Run the server step as a long-lived daemon, which loads
+the crypto context and evaluation keys (and optionally the encrypted
+database) once, rather than in every call to server_encrypted_compute.
+
+The daemon is server_encrypted_compute --daemon <spool_dir>, it is driven
+through files in the spool directory: it writes ready.json with its load
+times once it is ready, then serves each request file <name>.req (listing
+the query directories of a batch, one per line) by writing <name>.done or
+<name>.err, and exits when a file named stop appears.
+"""
+# Copyright (c) 2025, Amazon Web Services
+# All rights reserved.
+#
+# This software is licensed under the terms of the Apache v2 License.
+# See the LICENSE.md file for details.
+import os
+import json
+import time
+import shutil
+import subprocess
+from pathlib import Path
+
+POLL_INTERVAL = 0.01  # seconds
+
+class ServerDaemon:
+    """A server_encrypted_compute daemon, and a client for its spool directory."""
+
+    def __init__(self, exec_dir: Path, spool_dir: Path, cmd_args, resident_db: bool):
+        exe = Path(exec_dir) / "build" / "server_encrypted_compute"
+        if not exe.exists():
+            raise FileNotFoundError(f"{exe} not found, the daemon requires the local backend")
+        self.spool_dir = Path(spool_dir)
+        if self.spool_dir.exists():
+            shutil.rmtree(self.spool_dir)
+        self.spool_dir.mkdir(parents=True)
+        cmd = [exe, *cmd_args, "--daemon", str(self.spool_dir)]
+        if resident_db:
+            cmd.append("--resident_db")
+        self.proc = subprocess.Popen(cmd)
+        self.n_requests = 0
+
+    def wait_ready(self) -> dict:
+        """Wait until the daemon finished loading, return its load times."""
+        ready = self.spool_dir / "ready.json"
+        while not ready.exists():
+            self._check_alive()
+            time.sleep(POLL_INTERVAL)
+        with open(ready) as f:
+            return json.load(f)
+
+    def compute(self, query_dirs) -> dict:
+        """
+        Run the encrypted computation on the queries in query_dirs (as one
+        batch) and wait for it to finish. Returns the resources used, which
+        are not measured for the daemon, for compatibility with
+        utils.run_exe_or_python.
+        """
+        self.n_requests += 1
+        name = f"{self.n_requests:06d}"
+        tmp = self.spool_dir / f"{name}.req.tmp"
+        tmp.write_text("".join(f"{Path(d).resolve()}\n" for d in query_dirs))
+        os.rename(tmp, self.spool_dir / f"{name}.req")
+
+        done = self.spool_dir / f"{name}.done"
+        err = self.spool_dir / f"{name}.err"
+        while not done.exists():
+            if err.exists():
+                raise RuntimeError(f"server daemon failed: {err.read_text()}")
+            self._check_alive()
+            time.sleep(POLL_INTERVAL)
+        done.unlink()
+        return {}
+
+    def close(self, timeout: float = 60.0):
+        """Ask the daemon to exit, and kill it if it does not."""
+        if self.proc.poll() is None:
+            (self.spool_dir / "stop").touch()
+            try:
+                self.proc.wait(timeout)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+                self.proc.wait()
+
+    def _check_alive(self):
+        if self.proc.poll() is not None:
+            raise subprocess.CalledProcessError(self.proc.returncode, self.proc.args)
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+similarity.py - The matching rule of the cleartext oracle for
+fetch-by-similarity.
+
+A record x matches a query v if <x,v> > THRESHOLD. The similarities are
+computed in float32, but the float32 result of <x,v> depends (in the last
+bits) on how the BLAS library blocks the computation, which differs
+between a matrix-vector product, a matrix-matrix product, and different
+block sizes. To make all the oracle engines agree bit-for-bit, similarities
+within TIE_EPS of the threshold are recomputed in float64.
+"""
+# Copyright (c) 2025, Amazon Web Services
+# All rights reserved.
+#
+# This software is licensed under the terms of the Apache v2 License.
+# See the LICENSE.md file for details.
+import numpy as np
+
+# A record matches the query if their similarity is above this threshold
+THRESHOLD = 0.8
+
+# Float32 similarities this close to the threshold are recomputed in float64
+TIE_EPS = 1e-5
+
+def is_match(records: np.ndarray, qs: np.ndarray, threshold: float = THRESHOLD) -> np.ndarray:
+    """
+    Return a (records x queries) boolean matrix, telling which of the
+    records match which of the queries (the rows of qs).
+    """
+    sim = records @ qs.T
+    match = sim > threshold
+    ties = np.abs(sim - threshold) <= TIE_EPS
+    rows = np.flatnonzero(ties.any(axis=1))
+    if len(rows) > 0:
+        exact = records[rows].astype(np.float64) @ qs.T.astype(np.float64)
+        match[rows] = np.where(ties[rows], exact > threshold, match[rows])
+    return match
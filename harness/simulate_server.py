@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+simulate_server.py - A slot-level simulator of the encrypted computation of
+the reference submission, for tuning it without running CKKS.
+
+The pipeline of submission/src/server_encrypted_compute.cpp is replayed in
+NumPy on cleartext slot vectors, with the same slot layout (getNSlots,
+getNCols, and columns of 64 slots per ciphertext), and decoded as in
+submission/src/client_postprocess.cpp:
+  1. Matrix-vector product: the similarity of every record, in the slot of
+     its ciphertext (record k*n_slots+s is in slot s of ciphertext k).
+  2. Compare to threshold: the same Chebyshev interpolant of the sigmoid as
+     EvalChebyshevFunction (same function, interval and degree).
+  3. Running sums in the columns of the matrix form (as in RunningSums),
+     multiplied back by the matches and shifted to [-1,1].
+  4. Output compression: for each of the 8 matches in a column, the impulse
+     indicator, the payload rotations, total sums and mask.
+  5. Decoding the payload vectors from the result slots.
+Optionally, Gaussian noise of standard deviation --noise is added to the
+encrypted inputs and to the output of every step, as a stand-in for the
+CKKS noise.
+
+For a batch of random queries (drawn as in generate_query.py) it reports
+how often the threshold approximation misclassifies a record, how often a
+column has more matches than it can hold, and how often the decoded
+results differ from the cleartext oracle. The report is saved to
+simulation.json in the measurements directory.
+
+Usage:
+    python3 harness/simulate_server.py <size> [--count_only] [--num_queries N]
+        [--seed SEED] [--noise SIGMA]
+(after the dataset was generated, e.g. by step 1 of run_submission.py).
+"""
+# Copyright (c) 2025, Amazon Web Services
+# All rights reserved.
+#
+# This software is licensed under the terms of the Apache v2 License.
+# See the LICENSE.md file for details.
+import json
+import time
+import argparse
+import numpy as np
+from numpy.polynomial import Chebyshev
+from params import InstanceParams, TOY, LARGE, PAYLOAD_DIM
+from similarity import THRESHOLD, is_match
+from verify_result import compare_payloads
+from utils import TextFormat
+
+# Constants from submission/include/params.h
+COL_HEIGHT = 64                # slots of a column in each ciphertext
+PAYLOAD_SLOTS = PAYLOAD_DIM+1  # the payload values and a marker
+MAX_N_MATCH = COL_HEIGHT // PAYLOAD_SLOTS
+MAX_PAYLOAD_VAL = 256
+PAYLOAD_PRECISION = 16
+MARKER = 2 * MAX_PAYLOAD_VAL * PAYLOAD_PRECISION
+
+# Constants from submission/src/server_encrypted_compute.cpp
+SIGMOID_INSCALE = 69.0
+IMPULSE_SIGMA = 0.04
+THRESHOLD_DEGREE = {True: 247, False: 59}  # by count_only
+THRESHOLD_OUTSCALE = {True: 1.0, False: 0.504}
+IMPULSE_DEGREE = 119
+
+class SlotLayout:
+    """The packing of the records in the slots of the ciphertexts."""
+
+    def __init__(self, size: int, db_size: int):
+        ring_dim = 1024 if size == TOY else 65536
+        self.n_slots = ring_dim // 2
+        self.n_cols = ring_dim // 128
+        self.n_ctxts = (db_size + self.n_slots - 1) // self.n_slots
+        self.db_size = db_size
+
+    def to_slots(self, values: np.ndarray) -> np.ndarray:
+        """Pack one value per record into (n_ctxts, n_slots), padded with zeros."""
+        slots = np.zeros(self.n_ctxts * self.n_slots, dtype=np.float64)
+        slots[:len(values)] = values
+        return slots.reshape(self.n_ctxts, self.n_slots)
+
+    def to_matrix_form(self, slots: np.ndarray) -> np.ndarray:
+        """Same as RunningSums::to_matrix_form, row i is in ciphertext i%n_ctxts."""
+        n_ctxts = len(slots)
+        return slots.reshape(n_ctxts, -1, self.n_cols).transpose(1, 0, 2).reshape(-1, self.n_cols)
+
+    def from_matrix_form(self, matrix: np.ndarray, n_ctxts: int) -> np.ndarray:
+        """Same as RunningSums::from_matrix_form, the inverse of to_matrix_form."""
+        return matrix.reshape(-1, n_ctxts, self.n_cols).transpose(1, 0, 2).reshape(n_ctxts, -1)
+
+    def payload_slots(self, payloads: np.ndarray, k: int) -> np.ndarray:
+        """
+        The PAYLOAD_SLOTS payload rows of ciphertext k, as encoded by
+        client_encode_encrypt_db (a marker then the payload values, scaled
+        down by PAYLOAD_PRECISION).
+        """
+        rows = np.asarray(payloads[k * self.n_slots:(k+1) * self.n_slots])
+        slots = np.zeros((PAYLOAD_SLOTS, self.n_slots), dtype=np.float64)
+        slots[0, :len(rows)] = MARKER
+        slots[1:, :len(rows)] = rows.T
+        return slots / PAYLOAD_PRECISION
+
+class Noise:
+    """Adds N(0,sigma^2) noise to the slots, or nothing if sigma is 0."""
+
+    def __init__(self, sigma: float, rng: np.random.Generator):
+        self.sigma = sigma
+        self.rng = rng
+
+    def __call__(self, slots: np.ndarray) -> np.ndarray:
+        if self.sigma == 0:
+            return slots
+        return slots + self.rng.normal(0.0, self.sigma, slots.shape)
+
+def chebyshev(func, degree: int) -> Chebyshev:
+    """The interpolant that EvalChebyshevFunction uses on [-1,1]."""
+    return Chebyshev.interpolate(func, degree, domain=[-1.0, 1.0])
+
+def threshold_poly(count_only: bool) -> Chebyshev:
+    outscale = THRESHOLD_OUTSCALE[count_only]
+    sigmoid = lambda x: outscale / (1.0 + np.exp(-(x - THRESHOLD) * SIGMOID_INSCALE))
+    return chebyshev(sigmoid, THRESHOLD_DEGREE[count_only])
+
+def impulse_poly(number: float) -> Chebyshev:
+    impulse = lambda x: np.exp(-((x - number) / IMPULSE_SIGMA) ** 2 / 2)
+    return chebyshev(impulse, IMPULSE_DEGREE)
+
+def running_sums(slots: np.ndarray, layout: SlotLayout) -> np.ndarray:
+    """Running sums in the columns of the matrix form of the ciphertexts."""
+    matrix = np.cumsum(layout.to_matrix_form(slots), axis=0)
+    return layout.from_matrix_form(matrix, len(slots))
+
+def total_sums(slots: np.ndarray, layout: SlotLayout) -> np.ndarray:
+    """Same as total_sums in the server: sums of all the slots period apart."""
+    period = layout.n_cols * PAYLOAD_SLOTS
+    sums = slots.reshape(-1, period).sum(axis=0)
+    return np.tile(sums, len(slots) // period)
+
+def compress_output(result: np.ndarray, payloads: np.ndarray, layout: SlotLayout,
+                    noise: Noise, impulses: list) -> np.ndarray:
+    """
+    The output compression of the server: move the payloads of the i'th
+    match in every column to rows [(i-1)*PAYLOAD_SLOTS, i*PAYLOAD_SLOTS)
+    of that column. Returns the slots of the single result ciphertext.
+    """
+    # to_replicate of all the MAX_N_MATCH iterations, accumulated one
+    # ciphertext at a time so the payload slots are only built once each
+    to_replicate = np.zeros((MAX_N_MATCH, layout.n_slots))
+    for k in range(layout.n_ctxts):
+        indicators = np.stack([noise(p(result[k])) for p in impulses])
+        payload = noise(layout.payload_slots(payloads, k))
+        for j in range(PAYLOAD_SLOTS):
+            # EvalRotate by -j*n_cols, i.e. j rows down in every column
+            to_replicate += np.roll(indicators * payload[j], j * layout.n_cols, axis=1)
+
+    rows = np.arange(layout.n_slots) // layout.n_cols
+    accumulator = np.zeros(layout.n_slots)
+    for i in range(1, MAX_N_MATCH + 1):
+        replicated = noise(total_sums(noise(to_replicate[i-1]), layout))
+        mask = (rows >= (i-1) * PAYLOAD_SLOTS) & (rows < i * PAYLOAD_SLOTS)
+        accumulator += replicated * mask
+    return noise(accumulator)
+
+def decode_results(slots: np.ndarray, n_cols: int) -> tuple[np.ndarray, int]:
+    """
+    Same as decode_results in client_postprocess: returns the payload
+    vectors, and the number of groups that have a non-zero value but no
+    marker (where client_postprocess throws an error).
+    """
+    groups = slots.reshape(-1, PAYLOAD_SLOTS, n_cols).transpose(2, 0, 1).reshape(-1, PAYLOAD_SLOTS)
+    marker = groups.argmax(axis=1)
+    maxval = groups[np.arange(len(groups)), marker]
+    found = maxval > MAX_PAYLOAD_VAL
+    errors = found & (maxval < MAX_PAYLOAD_VAL * 1.4)
+    found &= ~errors
+    groups, marker, maxval = groups[found], marker[found], maxval[found]
+    scale = MARKER / maxval
+    idx = (marker[:, None] + np.arange(1, PAYLOAD_SLOTS)) % PAYLOAD_SLOTS
+    values = np.take_along_axis(groups, idx, axis=1) * scale[:, None]
+    return np.rint(values).astype(np.int16), int(errors.sum())
+
+def simulate_query(db, payloads, qry, layout: SlotLayout, count_only: bool,
+                   noise: Noise, polys: dict) -> dict:
+    """Run the pipeline for one query, and compare it to the cleartext oracle."""
+    truth = is_match(np.asarray(db), qry[None, :])[:, 0]
+    sims = np.asarray(db) @ qry.astype(np.float64)
+    outscale = THRESHOLD_OUTSCALE[count_only]
+
+    result = noise(layout.to_slots(sims))                  # matrix-vector product
+    result = noise(polys["threshold"](result))             # compare to threshold
+    out = result.ravel()[:layout.db_size]
+    stats = {"matches": int(truth.sum()),
+             "threshold_errors": int(((out > outscale / 2) != truth).sum()),
+             "max_threshold_error": float(np.abs(out - outscale * truth).max(initial=0.0))}
+
+    if count_only:
+        count = int(np.rint(noise(result.sum())))
+        stats["count"] = count
+        stats["exact"] = count == stats["matches"]
+        return stats
+
+    # Matches that do not fit in their column are lost (and corrupt the
+    # indicators of the column, as the running sums exceed the interval)
+    per_column = layout.to_matrix_form(layout.to_slots(truth)).sum(axis=0)
+    stats["overflowing_columns"] = int((per_column > MAX_N_MATCH).sum())
+    stats["dropped_matches"] = int(np.maximum(per_column - MAX_N_MATCH, 0).sum())
+
+    sums = noise(running_sums(result, layout))             # running sums
+    result = noise(sums * result) - 1.0
+    out_slots = compress_output(result, payloads, layout, noise, polys["impulses"])
+    decoded, stats["decode_errors"] = decode_results(out_slots, layout.n_cols)
+
+    cmp = compare_payloads(np.asarray(payloads[truth]), decoded)
+    stats["precision"] = cmp["precision"]
+    stats["recall"] = cmp["recall"]
+    stats["exact"] = (stats["decode_errors"] == 0 and len(decoded) == stats["matches"]
+                      and cmp["precision"] == 1.0 and cmp["recall"] == 1.0)
+    return stats
+
+def make_queries(centers: np.ndarray, dim: int, n: int, rng: np.random.Generator) -> np.ndarray:
+    """Random unit queries, half of them near a center (as in generate_query.py)."""
+    qs = rng.standard_normal((n, dim), dtype=np.float32)
+    near = rng.integers(0, 2, n) == 0
+    picks = centers[rng.integers(0, len(centers), n)]
+    qs[near] = picks[near] + 0.3 * qs[near] / np.linalg.norm(qs[near], axis=1, keepdims=True)
+    return qs / np.linalg.norm(qs, axis=1, keepdims=True)
+
+def summarize(all_stats: list, count_only: bool) -> dict:
+    """Aggregate the per-query statistics into the report."""
+    n = len(all_stats)
+    total = lambda key: sum(s[key] for s in all_stats)
+    exact = total("exact")
+    report = {
+        "Matches per query": {"Mean": total("matches") / n,
+                              "Max": max(s["matches"] for s in all_stats)},
+        "Threshold errors": total("threshold_errors"),
+        "Max threshold error": max(s["max_threshold_error"] for s in all_stats),
+        "Exact results": exact,
+        "Failure rate": (n - exact) / n,
+    }
+    if count_only:
+        report["Max count error"] = max(abs(s["count"] - s["matches"]) for s in all_stats)
+        return report
+    overflowed = sum(1 for s in all_stats if s["overflowing_columns"] > 0)
+    approx_failures = sum(1 for s in all_stats
+                          if not s["exact"] and s["overflowing_columns"] == 0)
+    report.update({
+        "Overflowing columns": total("overflowing_columns"),
+        "Dropped matches": total("dropped_matches"),
+        "Overflow rate": overflowed / n,
+        "Approximation failure rate": approx_failures / n,
+        "Decode errors": total("decode_errors"),
+        "Mean precision": total("precision") / n,
+        "Mean recall": total("recall") / n,
+    })
+    return report
+
+def main():
+    """
+    Simulate the encrypted computation for a batch of random queries,
+    print and save the report.
+    """
+    parser = argparse.ArgumentParser(description='Simulate the encrypted computation in NumPy.')
+    parser.add_argument('size', type=int, choices=range(TOY, LARGE+1),
+                        help='Dataset size (0-toy/1-small/2-medium/3-large)')
+    parser.add_argument('--count_only', action='store_true',
+                        help='Only count # of matches, do not return payloads')
+    parser.add_argument('--num_queries', type=int, default=10,
+                        help='Number of random queries to simulate (default: 10)')
+    parser.add_argument('--seed', type=int, help='Random seed for the queries and noise')
+    parser.add_argument('--noise', type=float, default=0.0, metavar='SIGMA',
+                        help='Standard deviation of the noise added after every step (default: 0)')
+    args, _ = parser.parse_known_args()
+
+    params = InstanceParams(args.size, args.count_only)
+    dim = params.get_record_dim()
+    dataset_dir = params.datadir()
+    db = np.memmap(dataset_dir / "db.bin", dtype=np.float32, mode="r").reshape(-1, dim)
+    payloads = np.memmap(dataset_dir / "payloads.bin", dtype=np.int16,
+                         mode="r").reshape(-1, PAYLOAD_DIM)
+    centers = np.fromfile(dataset_dir / "centers.bin", dtype=np.float32).reshape(-1, dim)
+    layout = SlotLayout(args.size, len(db))
+
+    rng = np.random.default_rng(args.seed)
+    noise = Noise(args.noise, rng)
+    polys = {"threshold": threshold_poly(args.count_only),
+             "impulses": [impulse_poly(i / 4.0 - 1.0) for i in range(1, MAX_N_MATCH + 1)]}
+
+    start = time.perf_counter()
+    all_stats = []
+    for n, qry in enumerate(make_queries(centers, dim, args.num_queries, rng), start=1):
+        stats = simulate_query(db, payloads, qry, layout, args.count_only, noise, polys)
+        all_stats.append(stats)
+        color = TextFormat.GREEN if stats["exact"] else TextFormat.RED
+        details = (f"count {stats['count']}" if args.count_only else
+                   f"{stats['overflowing_columns']} overflowing columns, "
+                   f"recall {round(stats['recall'], 4)}")
+        print(f"{color}         [harness] query {n}: {stats['matches']} matches,",
+              f"{stats['threshold_errors']} threshold errors, {details}{TextFormat.RESET}")
+    elapsed = time.perf_counter() - start
+
+    report = {"Queries": args.num_queries, "Noise": args.noise,
+              "Layout": {"Slots": layout.n_slots, "Columns": layout.n_cols,
+                         "Ciphertexts": layout.n_ctxts,
+                         "Column height": COL_HEIGHT * layout.n_ctxts},
+              **summarize(all_stats, args.count_only),
+              "Simulation time": f"{round(elapsed, 4)}s"}
+    print(f"         [harness] Simulated {args.num_queries} queries in {round(elapsed, 4)}s:",
+          f"failure rate {report['Failure rate']}",
+          "" if args.count_only else f"(overflow rate {report['Overflow rate']})")
+
+    params.measuredir().mkdir(parents=True, exist_ok=True)
+    with open(params.measuredir() / "simulation.json", "w") as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
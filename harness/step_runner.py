@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+step_runner.py - Run the Python steps of the harness and the submission
+in one long-lived worker process, rather than one interpreter per step.
+
+The worker executes each step script as __main__ (using runpy), with the
+same sys.argv, sys.path and working directory that a fresh interpreter
+would see. Modules imported by a step stay in sys.modules, so later steps
+(and later runs) do not pay again for importing numpy, torch, etc., and
+objects memoized at module level (e.g. by submission_utils) stay loaded.
+
+The worker is started with
+
+    python3 harness/step_runner.py --worker <reply_fd>
+
+and reads one JSON request per line from stdin, replying on reply_fd.
+Step output goes to the worker's stdout/stderr, i.e., to the console.
+"""
+# Copyright (c) 2025 HomomorphicEncryption.org
+# All rights reserved.
+#
+# This software is licensed under the terms of the Apache v2 License.
+# See the LICENSE.md file for details.
+import os
+import sys
+import json
+import time
+import runpy
+import argparse
+import threading
+import traceback
+import subprocess
+from pathlib import Path
+from resources import InProcessMeter
+
+def calibrate_startup(n_reps=3) -> float:
+    """
+    Measure (the median of n_reps runs of) the time to start and exit a
+    bare Python interpreter, with the same environment as the steps.
+    """
+    env = {**os.environ, "PYTHONPATH": "."}
+    times = []
+    for _ in range(n_reps):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], check=True, env=env)
+        times.append(time.perf_counter() - start)
+    return sorted(times)[len(times) // 2]
+
+class StepRunner:
+    """Client side of the persistent worker, used by the harness."""
+
+    def __init__(self):
+        start = time.perf_counter()
+        reply_r, reply_w = os.pipe()
+        env = {**os.environ, "PYTHONPATH": "."}
+        self.proc = subprocess.Popen(
+            [sys.executable, str(Path(__file__).resolve()), "--worker", str(reply_w)],
+            stdin=subprocess.PIPE, pass_fds=(reply_w,), env=env, text=True)
+        os.close(reply_w)
+        self.replies = os.fdopen(reply_r, "r")
+        self.lock = threading.Lock()  # one request at a time
+        self._request({"cmd": "ping"})
+        self.startup_time = time.perf_counter() - start
+
+    def _request(self, msg: dict) -> dict:
+        self.proc.stdin.write(json.dumps(msg) + "\n")
+        self.proc.stdin.flush()
+        line = self.replies.readline()
+        if not line:
+            raise RuntimeError("step runner worker exited unexpectedly")
+        return json.loads(line)
+
+    def run(self, script: Path, *args) -> tuple[int, dict]:
+        """
+        Run a step script in the worker. Returns the exit code and the
+        resources used by the script (see resources.py).
+        """
+        with self.lock:
+            reply = self._request({"cmd": "run", "script": str(script),
+                                   "args": [str(a) for a in args]})
+        return reply["returncode"], reply["resources"]
+
+    def close(self):
+        """Shut down the worker."""
+        if self.proc.poll() is None:
+            self.proc.stdin.close()
+            self.proc.wait()
+        self.replies.close()
+
+def evict_shadowed(script_dir: Path):
+    """
+    Forget top-level modules that were imported from another directory but
+    that a script in script_dir would import from its own directory.
+    """
+    for name, module in list(sys.modules.items()):
+        fname = getattr(module, "__file__", None)
+        if ("." not in name and fname is not None
+                and Path(fname).parent != script_dir
+                and (script_dir / f"{name}.py").exists()):
+            del sys.modules[name]
+
+def run_step(script: str, args: list[str]) -> int:
+    """Execute one step script as __main__, return its exit code."""
+    saved_fds = os.dup(1), os.dup(2)
+    saved_argv, saved_path = sys.argv, sys.path[:]
+    sys.argv = [script, *args]
+    # The script's own directory comes first, as in a fresh interpreter
+    script_dir = Path(script).absolute().parent
+    evict_shadowed(script_dir)
+    sys.path.insert(0, str(script_dir))
+    returncode = 0
+    try:
+        runpy.run_path(script, run_name="__main__")
+    except SystemExit as e:
+        if e.code is None:
+            returncode = 0
+        elif isinstance(e.code, int):
+            returncode = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            returncode = 1
+    except BaseException:  # pylint: disable=broad-except
+        traceback.print_exc()
+        returncode = 1
+    finally:
+        # Steps may redirect fds 1/2 (e.g. submission_utils.init mutes
+        # them), restore the console for the next step
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(saved_fds[0], 1)
+        os.dup2(saved_fds[1], 2)
+        os.close(saved_fds[0])
+        os.close(saved_fds[1])
+        sys.argv, sys.path[:] = saved_argv, saved_path
+    return returncode
+
+def worker(reply_fd: int):
+    """Serve step requests from stdin until it is closed."""
+    # Keep the requests pipe away from the steps
+    requests = os.fdopen(os.dup(0), "r")
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.close(devnull)
+    sys.path[0] = os.getcwd()  # PYTHONPATH="." rather than the harness dir
+    with os.fdopen(reply_fd, "w") as replies:
+        for line in requests:
+            msg = json.loads(line)
+            reply = {}
+            if msg["cmd"] == "run":
+                meter = InProcessMeter()
+                reply["returncode"] = run_step(msg["script"], msg["args"])
+                reply["resources"] = meter.stop()
+            replies.write(json.dumps(reply) + "\n")
+            replies.flush()
+
+def main():
+    """
+    Usage: python3 step_runner.py --worker <reply_fd> - run the worker loop
+    """
+    parser = argparse.ArgumentParser(description='Persistent worker for the Python steps.')
+    parser.add_argument('--worker', type=int, required=True,
+                        help='File descriptor to send the replies on')
+    args, _ = parser.parse_known_args()
+    worker(args.worker)
+
+
+if __name__ == "__main__":
+    main()
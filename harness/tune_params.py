@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+tune_params.py - Pick the shape of the slot-replication tree and the level
+budget of the running sums for the reference submission, using a cost model
+of the server computation.
+
+For every instance size, all the valid configurations are enumerated: the
+tree degrees (all >= 2, multiplying to the record dimension, ordered from
+root to leaves) and the running-sums level budgets, keeping only those that
+fit in the multiplicative depth of the keys. For each configuration the
+rotations, multiplications and additions of server_encrypted_compute are
+counted step by step, together with the level at which they happen. The
+cost of an operation at level l is its cost on a fresh ciphertext (from
+submission/build/bench_ops, run with --calibrate) scaled by the fraction
+of moduli that are left at level l. Without a calibration, rough default
+costs (relative to one rotation) are used.
+
+The configurations with the lowest predicted cost are printed and saved to
+tuning.json in the measurements directory. With --write, the best one for
+each size is written to submission/tuning.txt, which the submission reads
+at runtime (see InstanceParams::read_tuning in submission/include/params.h).
+
+The Chebyshev evaluations are modeled as Paterson-Stockmeyer with about
+2*sqrt(degree)+log2(degree) ciphertext multiplications, at the midpoint of
+the levels they consume.
+
+The model also charges for the rotation keys of each configuration (the
+same set of shift amounts that client_key_generation generates), since
+a small running-sum budget or a wide replication tree needs many more of
+them. Each key is about 100MB for the larger sizes, and costs time to
+generate, to write to rk.bin and to load on the server. Since the key
+material is paid once while the model counts the cost of one query, the
+configurations are also limited (by default) to no more rotation keys
+than the compiled-in default configuration uses.
+"""
+# Copyright (c) 2025, Amazon Web Services
+# All rights reserved.
+#
+# This software is licensed under the terms of the Apache v2 License.
+# See the LICENSE.md file for details.
+import math
+import json
+import argparse
+import subprocess
+from pathlib import Path
+from collections import Counter
+from params import InstanceParams, instance_name, TOY, SMALL, MEDIUM, LARGE
+
+# The multiplicative depth of the keys (MULT_DEPTH in submission/include/params.h)
+DEPTH = 23
+
+# The compiled-in defaults of submission/include/params.h
+DEFAULT_DEGREES = {TOY: (8, 4, 4), SMALL: (8, 4, 4), MEDIUM: (8, 8, 4), LARGE: (16, 8, 4)}
+DEFAULT_RUNNING_SUM_LEVELS = 3
+
+# Constants of the server computation (params.h, server_encrypted_compute.cpp)
+PAYLOAD_DIM = 8
+MAX_N_MATCH = 8
+COL_HEIGHT = 64
+THRESHOLD_DEGREE = {True: 247, False: 59}  # by count_only
+IMPULSE_DEGREE = 119
+
+# Rough costs of the operations on a fresh ciphertext, relative to a rotation.
+# A rotation key is charged for generating, serializing and loading it.
+DEFAULT_COSTS = {"rotate": 1.0, "precompute": 0.35, "fast_rotate": 0.7, "mult": 1.1,
+                 "mult_norelin": 0.08, "relin": 1.0, "mult_plain": 0.05, "add": 0.01,
+                 "rotation_key": 4.0}
+
+# The hybrid key switching of OpenFHE splits the 24 moduli into 3 digits,
+# and a key has two polynomials per digit over the moduli and the special
+# moduli (about one digit's worth), with 8-byte coefficients
+KEY_DIGITS = 3
+def rotation_key_bytes(ring_dim: int) -> int:
+    """The approximate size of one rotation key."""
+    n_moduli = DEPTH + 1
+    return 2 * KEY_DIGITS * (n_moduli + math.ceil(n_moduli / KEY_DIGITS)) * ring_dim * 8
+
+# The levels consumed by EvalChebyshevFunction, by the bounds on the degree
+CHEBYSHEV_DEPTHS = [(5, 3), (13, 4), (27, 5), (59, 6), (119, 7), (247, 8), (495, 9), (1007, 10)]
+
+def chebyshev_depth(degree: int) -> int:
+    return next(depth for bound, depth in CHEBYSHEV_DEPTHS if degree <= bound)
+
+class OpCount:
+    """Counts of the operations, and their counts weighted by level."""
+
+    def __init__(self):
+        self.counts = Counter()
+        self.weighted = Counter()
+
+    def add(self, op: str, n: float, level: float):
+        self.counts[op] += n
+        self.weighted[op] += n * (DEPTH + 1 - level) / (DEPTH + 1)
+
+    def cost(self, costs: dict) -> float:
+        return sum(costs[op] * n for op, n in self.weighted.items())
+
+    def summary(self) -> dict:
+        c = self.counts
+        return {"Rotations": round(c["rotate"] + c["fast_rotate"]),
+                "Ciphertext mults": round(c["mult"] + c["mult_norelin"]),
+                "Plaintext mults": round(c["mult_plain"]),
+                "Additions": round(c["add"])}
+
+def replication(ops: OpCount, degrees, level: int) -> int:
+    """The slot replicator (DFSSlotReplicator), returns the level of the replicas."""
+    for depth, deg in enumerate(degrees):
+        installs = math.prod(degrees[:depth])
+        outputs = installs * deg
+        if deg == 2:
+            ops.add("rotate", installs, level)
+        else:  # hoisted rotations
+            ops.add("precompute", installs, level)
+            ops.add("fast_rotate", installs * (deg - 1), level)
+        ops.add("mult_plain", outputs * deg, level)
+        ops.add("add", outputs * (deg - 1), level)
+        level += 1
+    return level
+
+def chebyshev(ops: OpCount, degree: int, n_ctxts: int, level: int) -> int:
+    """n_ctxts evaluations of EvalChebyshevFunction, returns the output level."""
+    depth = chebyshev_depth(degree)
+    mults = 2 * math.isqrt(degree) + math.ceil(math.log2(degree))
+    ops.add("mult", n_ctxts * mults, level + depth / 2)
+    ops.add("add", n_ctxts * degree, level + depth / 2)  # and mult by constants
+    return level + depth
+
+def running_sums(ops: OpCount, n_slots: int, n_cols: int, n_ctxts: int, budget: int,
+                 level: int) -> int:
+    """The RunningSums shift-and-add procedure, returns the output level."""
+    ops.add("add", n_ctxts - 1, level)
+    n_intervals = n_slots // n_cols
+    log_n = int(math.log2(n_intervals))
+    budget = log_n if budget <= 0 or budget > log_n else budget
+    factor = 1 << math.ceil(log_n / budget)
+    phases = []
+    while n_intervals > factor:
+        n_intervals //= factor
+        phases.append(factor - 1)
+    if n_intervals > 1:
+        phases.append(n_intervals - 1)
+    for n_shifts in phases:
+        ops.add("rotate", n_shifts, level)
+        ops.add("mult_plain", n_shifts, level)
+        ops.add("add", n_shifts - 1 + n_ctxts, level)
+        level += 1
+    return level
+
+def running_sum_shifts(n_slots: int, n_cols: int, budget: int) -> list[int]:
+    """The shift amounts of RunningSums::get_shift_amounts."""
+    n_intervals = n_slots // n_cols
+    log_n = int(math.log2(n_intervals))
+    budget = log_n if budget <= 0 or budget > log_n else budget
+    factor = 1 << math.ceil(log_n / budget)
+    shifts = []
+    while n_intervals > factor:
+        n_intervals //= factor
+        shifts += [-n_cols * n_intervals * i for i in range(factor - 1, 0, -1)]
+    shifts += [-n_cols * i for i in range(n_intervals - 1, 0, -1)]
+    return shifts
+
+def rotation_keys(params: InstanceParams, count_only: bool, degrees, rs_levels: int) -> int:
+    """The number of rotation keys that client_key_generation generates."""
+    ring_dim = 1024 if params.size == TOY else 65536
+    n_slots, n_cols = ring_dim // 2, ring_dim // 128
+    shifts, rot_amt = set(), math.prod(degrees)
+    for deg in degrees:  # DFSSlotReplicator::get_rotation_amounts
+        rot_amt //= deg
+        shifts.update(-i * rot_amt for i in range(1, deg))
+    if count_only:  # and EvalSumKeyGen
+        return len(shifts) + int(math.log2(n_slots))
+    shifts.update(-i * n_cols for i in range(1, PAYLOAD_DIM))
+    shifts.update(running_sum_shifts(n_slots, n_cols, rs_levels))
+    # and EvalSumRowsKeyGen
+    return len(shifts) + int(math.log2(n_slots // (n_cols * PAYLOAD_DIM)))
+
+def server_ops(params: InstanceParams, count_only: bool, degrees, rs_levels: int):
+    """Count the operations of server_encrypted_compute, return them and the levels used."""
+    ring_dim = 1024 if params.size == TOY else 65536
+    n_slots, n_cols = ring_dim // 2, ring_dim // 128
+    n_ctxts = (params.get_db_size() + n_slots - 1) // n_slots
+    dim = params.get_record_dim()
+    ops = OpCount()
+
+    # 1. Matrix-vector product, with the database rows at the level of the replicas
+    level = replication(ops, degrees, 0)
+    ops.add("mult_norelin", dim * n_ctxts, level)
+    ops.add("add", (dim - 1) * n_ctxts, level)
+    ops.add("relin", n_ctxts, level)
+    level += 1
+
+    # 2. Compare to threshold
+    level = chebyshev(ops, THRESHOLD_DEGREE[count_only], n_ctxts, level)
+    if count_only:  # 3. Sum all the slots
+        ops.add("add", n_ctxts - 1 + math.log2(n_slots), level)
+        ops.add("rotate", math.log2(n_slots), level)
+        return ops, level
+
+    # 3. Running sums, multiplied by the matches
+    level = running_sums(ops, n_slots, n_cols, n_ctxts, rs_levels, level)
+    ops.add("mult", n_ctxts, level)
+    level += 1
+
+    # 4. Output compression, for each of the matches in a column
+    level = chebyshev(ops, IMPULSE_DEGREE, MAX_N_MATCH * n_ctxts, level)
+    total_sum_rots = int(math.log2(n_slots // (n_cols * PAYLOAD_DIM)))
+    ops.add("mult", MAX_N_MATCH * PAYLOAD_DIM * n_ctxts, level)
+    ops.add("rotate", MAX_N_MATCH * (PAYLOAD_DIM - 1) * n_ctxts, level + 1)
+    ops.add("rotate", MAX_N_MATCH * total_sum_rots, level + 1)
+    ops.add("add", MAX_N_MATCH * (PAYLOAD_DIM * n_ctxts + total_sum_rots), level + 1)
+    ops.add("mult_plain", MAX_N_MATCH, level + 1)
+    return ops, level + 2
+
+def factorizations(n: int, max_len: int):
+    """All the ordered tuples of integers >= 2 with product n and length <= max_len."""
+    if n == 1:
+        yield ()
+        return
+    if max_len == 0:
+        return
+    for d in range(2, n + 1):
+        if n % d == 0:
+            for rest in factorizations(n // d, max_len - 1):
+                yield (d,) + rest
+
+def rank_configs(params: InstanceParams, count_only: bool, costs: dict,
+                 max_keys: int | None = None, key_bytes: int | None = None) -> list[dict]:
+    """
+    All the configurations that fit in DEPTH levels and use at most
+    max_keys rotation keys (if given), cheapest first.
+    """
+    log_rows = int(math.log2(COL_HEIGHT))
+    ring_dim = 1024 if params.size == TOY else 65536
+    key_bytes = key_bytes or rotation_key_bytes(ring_dim)
+    budgets = [DEFAULT_RUNNING_SUM_LEVELS] if count_only else range(1, log_rows + 1)
+    configs = []
+    for degrees in factorizations(params.get_record_dim(), DEPTH):
+        for rs_levels in budgets:
+            ops, levels = server_ops(params, count_only, degrees, rs_levels)
+            n_keys = rotation_keys(params, count_only, degrees, rs_levels)
+            if levels <= DEPTH and (max_keys is None or n_keys <= max_keys):
+                ops.add("rotation_key", n_keys, 0)
+                configs.append({"Degrees": list(degrees), "Running-sum levels": rs_levels,
+                                "Levels": levels, **ops.summary(), "Rotation keys": n_keys,
+                                "Rotation key bytes": n_keys * key_bytes,
+                                "Predicted cost": ops.cost(costs)})
+    return sorted(configs, key=lambda c: (c["Predicted cost"], c["Running-sum levels"]))
+
+def load_costs(params: InstanceParams, exec_dir: Path, calibrate: bool, reps: int):
+    """
+    The operation costs: measured now, from an earlier calibration, or the
+    defaults. Also returns their unit, and the measured size of a rotation
+    key (or None).
+    """
+    cost_file = params.measuredir() / "op_costs.json"
+    if calibrate:
+        out = subprocess.run([exec_dir / "build" / "bench_ops", str(params.size), "--reps", str(reps)],
+                             check=True, capture_output=True, text=True).stdout
+        params.measuredir().mkdir(parents=True, exist_ok=True)
+        cost_file.write_text(out)
+    if cost_file.exists():
+        calibration = json.loads(cost_file.read_text())
+        costs = calibration["seconds"]
+        if "rotation_key" not in costs:  # calibrated by an older bench_ops
+            costs["rotation_key"] = DEFAULT_COSTS["rotation_key"] * costs["rotate"]
+        return costs, "s", calibration.get("rotation_key_bytes")
+    return DEFAULT_COSTS, " rotations", None
+
+def write_tuning(tuning_file: Path, best: dict):
+    """Update the lines of the tuned instance sizes in the tuning file."""
+    lines = tuning_file.read_text().splitlines() if tuning_file.exists() else [
+        "# Written by harness/tune_params.py, see InstanceParams::read_tuning",
+        "# <instance> <tree degrees> <running-sum levels>"]
+    lines = [l for l in lines if not l.split() or l.split()[0] not in best]
+    for name, cfg in best.items():
+        degrees = ",".join(str(d) for d in cfg["Degrees"])
+        lines.append(f"{name} {degrees} {cfg['Running-sum levels']}")
+    tuning_file.write_text("\n".join(lines) + "\n")
+
+def main():
+    """
+    Rank the configurations for the given instance sizes, print and save
+    the best ones, and optionally write them to the tuning file.
+    """
+    parser = argparse.ArgumentParser(description='Tune the replication tree and running-sum depth.')
+    parser.add_argument('sizes', type=int, nargs='*',
+                        help='Instance sizes to tune, 0-toy/1-small/2-medium/3-large (default: all)')
+    parser.add_argument('--count_only', action='store_true',
+                        help='Tune the count-only computation (the report only, not written)')
+    parser.add_argument('--calibrate', action='store_true',
+                        help='Time the operations with submission/build/bench_ops first')
+    parser.add_argument('--reps', type=int, default=10,
+                        help='Repetitions of every operation when calibrating (default: 10)')
+    parser.add_argument('--max_keys', type=int,
+                        help='Most rotation keys in a configuration (default: as many as the default one)')
+    parser.add_argument('--top', type=int, default=5,
+                        help='Number of configurations to print (default: 5)')
+    parser.add_argument('--write', action='store_true',
+                        help='Write the best configurations to submission/tuning.txt')
+    args, _ = parser.parse_known_args()
+    if any(size not in range(TOY, LARGE+1) for size in args.sizes):
+        parser.error("instance sizes must be 0-3")
+
+    rootdir = Path.cwd()
+    exec_dir = rootdir / "submission"
+    best = {}
+    for size in args.sizes or [TOY, SMALL, MEDIUM, LARGE]:
+        params = InstanceParams(size, args.count_only)
+        costs, unit, key_bytes = load_costs(params, exec_dir, args.calibrate, args.reps)
+        max_keys = args.max_keys or rotation_keys(params, args.count_only, DEFAULT_DEGREES[size],
+                                                  DEFAULT_RUNNING_SUM_LEVELS)
+        configs = rank_configs(params, args.count_only, costs, max_keys, key_bytes)
+        default = next(c for c in configs if tuple(c["Degrees"]) == DEFAULT_DEGREES[size]
+                       and c["Running-sum levels"] == DEFAULT_RUNNING_SUM_LEVELS)
+        print(f"         [harness] {instance_name(size, args.count_only)}: {len(configs)}",
+              f"configurations fit in {DEPTH} levels and {max_keys} rotation keys,",
+              "default predicted",
+              f"{round(default['Predicted cost'], 4)}{unit}")
+        for c in configs[:args.top]:
+            print(f"         [harness]   degrees {c['Degrees']}, running-sum levels",
+                  f"{c['Running-sum levels']}: {round(c['Predicted cost'], 4)}{unit}",
+                  f"({c['Rotations']} rotations, {c['Ciphertext mults']} mults,",
+                  f"{c['Levels']} levels, {c['Rotation keys']} rotation keys of",
+                  f"{round(c['Rotation key bytes'] / (1 << 30), 2)}GB)")
+        best[instance_name(size, False)] = configs[0]
+        params.measuredir().mkdir(parents=True, exist_ok=True)
+        with open(params.measuredir() / "tuning.json", "w") as f:
+            json.dump({"Cost unit": unit.strip(), "Default": default,
+                       "Best": configs[:args.top]}, f, indent=2)
+
+    if args.write and args.count_only:
+        print("         [harness] The tuning file is shared with the fetch computation, not written")
+    elif args.write:
+        write_tuning(exec_dir / "tuning.txt", best)
+        print(f"         [harness] Wrote {exec_dir / 'tuning.txt'}",
+              "(the keys and encrypted database must be regenerated)")
+
+
+if __name__ == "__main__":
+    main()
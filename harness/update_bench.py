@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+update_bench.py - Benchmark incremental updates of the encrypted database:
+change some records of the dataset, let the client re-encrypt only what
+changed, then check that the server answers queries on the new database.
+
+Each round changes n records of the cleartext dataset: a third of them are
+modified in place, a third are deleted (replaced by tombstones, all-zero
+records that never match a query), and the rest are appended at the end.
+The indices of the changed records are written to db_updates.txt in the
+dataset directory, and the update is timed as one call of
+client_encode_encrypt_db --update. Then one query is run through steps
+6-12 (on the server daemon, if one is running, so the new database is
+picked up without a restart) and verified against the changed dataset.
+
+This is used by run_submission.py --update_bench, after steps 1-5.
+"""
+# Copyright (c) 2025, Amazon Web Services
+# All rights reserved.
+#
+# This software is licensed under the terms of the Apache v2 License.
+# See the LICENSE.md file for details.
+import os
+import json
+import time
+import shutil
+import subprocess
+from pathlib import Path
+import numpy as np
+import utils
+from params import PAYLOAD_DIM
+from generate_dataset import generate_db_points, generate_payloads
+
+def make_private(path: Path):
+    """
+    Break the hard links of a dataset file (e.g. into the artifact cache)
+    before it is modified in place.
+    """
+    if path.stat().st_nlink > 1:
+        tmp = path.with_name(path.name + ".tmp")
+        shutil.copyfile(path, tmp)
+        os.replace(tmp, path)
+
+def change_records(params, n_changes: int, rng: np.random.Generator) -> dict:
+    """
+    Change n_changes records of the dataset (modify, delete and append),
+    and write their indices to db_updates.txt. Returns the number of
+    records of each kind of change.
+    """
+    dataset_dir = params.datadir()
+    dim = params.get_record_dim()
+    for fname in ["db.bin", "labels.bin", "payloads.bin"]:
+        make_private(dataset_dir / fname)
+    n_records = (dataset_dir / "db.bin").stat().st_size // (dim * 4)
+    centers = np.fromfile(dataset_dir / "centers.bin", dtype=np.float32).reshape(-1, dim)
+
+    n_modified = n_deleted = min(n_changes // 3, n_records // 2)
+    n_appended = n_changes - n_modified - n_deleted
+    changed = rng.choice(n_records, size=n_modified + n_deleted, replace=False)
+    modified, deleted = changed[:n_modified], changed[n_modified:]
+
+    db = np.memmap(dataset_dir / "db.bin", dtype=np.float32, mode="r+").reshape(-1, dim)
+    labels = np.memmap(dataset_dir / "labels.bin", dtype=np.int32, mode="r+")
+    payloads = np.memmap(dataset_dir / "payloads.bin", dtype=np.int16,
+                         mode="r+").reshape(-1, PAYLOAD_DIM)
+    db[modified], labels[modified] = generate_db_points(rng, centers, n_modified, dim)
+    payloads[modified] = generate_payloads(rng, n_modified)
+    db[deleted], labels[deleted], payloads[deleted] = 0, -1, 0
+    for mm in (db, labels, payloads):
+        mm.flush()
+    del db, labels, payloads
+
+    new_db, new_labels = generate_db_points(rng, centers, n_appended, dim)
+    for fname, data in [("db.bin", new_db), ("labels.bin", new_labels),
+                        ("payloads.bin", generate_payloads(rng, n_appended))]:
+        with open(dataset_dir / fname, "ab") as f:
+            data.tofile(f)
+
+    appended = np.arange(n_records, n_records + n_appended)
+    indices = np.sort(np.concatenate([changed, appended]))
+    (dataset_dir / "db_updates.txt").write_text("".join(f"{i}\n" for i in indices))
+    return {"Modified": n_modified, "Deleted": n_deleted, "Appended": n_appended}
+
+def run_query(params, harness_dir, exec_dir, cmd_args, seed, verify_args, daemon) -> tuple:
+    """
+    Run steps 6-12 for one query. Returns the latency of the server step,
+    and whether the result passed verification.
+    """
+    io_dir = params.iodir()
+    qry_args = [*cmd_args, *(["--seed", str(seed)] if seed is not None else [])]
+    utils.run_exe_or_python(harness_dir, "generate_query", *qry_args)
+    utils.run_exe_or_python(exec_dir, "client_preprocess_query", *qry_args)
+    utils.run_exe_or_python(exec_dir, "client_encode_encrypt_query", *qry_args)
+    start = time.perf_counter()
+    if daemon is not None:
+        daemon.compute([io_dir])
+    else:
+        utils.run_exe_or_python(exec_dir, "server_encrypted_compute", *qry_args)
+    latency = time.perf_counter() - start
+    utils.run_exe_or_python(exec_dir, "client_decrypt_decode", *qry_args)
+    utils.run_exe_or_python(exec_dir, "client_postprocess", *qry_args)
+    utils.run_exe_or_python(harness_dir, "cleartext_impl", *qry_args)
+    try:
+        utils.run_exe_or_python(harness_dir, "verify_result",
+                                str(params.datadir() / "expected.bin"),
+                                str(io_dir / "results.bin"), *qry_args[1:], *verify_args)
+    except subprocess.CalledProcessError:
+        return latency, False
+    return latency, True
+
+def run_update_bench(params, harness_dir, exec_dir, cmd_args, counts, change_seed,
+                     qry_seeds, verify_args=(), daemon=None) -> int:
+    """
+    Run an update round for each number of changed records in counts (the
+    changes are drawn from change_seed, the queries use qry_seeds), print
+    a report and save it to updates.json in the measurements directory.
+    Returns the number of queries that failed verification.
+    """
+    rng = np.random.default_rng(change_seed)
+    report = {"Rounds": {}}
+    failures = 0
+    for n, seed in zip(counts, qry_seeds):
+        print(f"         [harness] Update benchmark: changing {n} records")
+        kinds = change_records(params, n, rng)
+        start = time.perf_counter()
+        utils.run_exe_or_python(exec_dir, "client_encode_encrypt_db", *cmd_args, "--update")
+        update_s = time.perf_counter() - start
+        db_size = utils.dir_size(params.iodir() / "ciphertexts_upload")
+
+        query_s, ok = run_query(params, harness_dir, exec_dir, cmd_args, seed,
+                                verify_args, daemon)
+        failures += not ok
+        server_report = params.iodir() / "server_reported_steps.json"
+        report["Rounds"][str(n)] = {
+            **kinds,
+            "Update latency": f"{round(update_s, 4)}s",
+            "Update latency per record": f"{round(update_s / max(n, 1), 6)}s",
+            "Encrypted database on disk": db_size,
+            "Query latency": f"{round(query_s, 4)}s",
+            "Verified": ok,
+            **({"Server Reported": json.loads(server_report.read_text())}
+               if server_report.exists() else {}),
+        }
+        color = utils.TextFormat.GREEN if ok else utils.TextFormat.RED
+        print(f"{color}         [harness] {n} changed records: update {round(update_s, 4)}s,",
+              f"query {round(query_s, 4)}s,",
+              f"{'verified' if ok else 'failed verification'}{utils.TextFormat.RESET}")
+
+    params.measuredir().mkdir(parents=True, exist_ok=True)
+    with open(params.measuredir() / "updates.json", "w") as f:
+        json.dump(report, f, indent=2)
+    return failures
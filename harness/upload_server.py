@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+upload_server.py - A local stand-in for the upload endpoints of a remote
+backend, implementing the chunked upload protocol of
+submission_remote/src/chunked_upload.py. It lets the upload steps (3.1 and
+4.1) be run and benchmarked offline.
+
+Chunks are written in place into <dir>/<id>.part, and the indices of the
+stored chunks are appended to <dir>/<id>.acks, so an upload can be resumed
+even after the server restarts. Completed uploads are renamed to
+<dir>/<name>, and GET /files/<name> tells the client whether a file was
+already uploaded (e.g. an evaluation key by its fingerprint).
+
+Usage:
+    python3 harness/upload_server.py <dir> [--port PORT]
+run_submission.py --upload_url local starts one in the harness process.
+"""
+# Copyright (c) 2025 HomomorphicEncryption.org
+# All rights reserved.
+#
+# This software is licensed under the terms of the Apache v2 License.
+# See the LICENSE.md file for details.
+import os
+import re
+import json
+import hashlib
+import argparse
+import threading
+from pathlib import Path
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from artifact_cache import file_digest
+
+CHUNK_RE = re.compile(r"^/uploads/([0-9a-f]+)/chunks/(\d+)$")
+COMPLETE_RE = re.compile(r"^/uploads/([0-9a-f]+)/complete$")
+FILE_RE = re.compile(r"^/files/([^/]+)$")
+
+class UploadStore:
+    """The state of the uploads, kept in a directory."""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.sessions = {}
+
+    def start(self, meta: dict) -> dict:
+        """Start (or resume) an upload, return its id and stored chunks."""
+        upload_id = hashlib.sha256(f"{meta['name']}:{meta['sha256']}".encode()).hexdigest()[:32]
+        with self.lock:
+            part = self.root / f"{upload_id}.part"
+            acks = self.root / f"{upload_id}.acks"
+            if upload_id not in self.sessions or not part.exists():
+                if not part.exists():
+                    with open(part, "wb") as f:
+                        f.truncate(meta["size"])
+                    acks.write_text("")
+                received = {int(i) for i in acks.read_text().split()}
+                self.sessions[upload_id] = {**meta, "received": received}
+            return {"id": upload_id, "received": sorted(self.sessions[upload_id]["received"])}
+
+    def put_chunk(self, upload_id: str, index: int, data: bytes, checksum: str) -> bool:
+        """Store a chunk, return False if it does not match its checksum."""
+        s = self.sessions[upload_id]
+        offset = index * s["chunk_size"]
+        if offset >= max(s["size"], 1) or len(data) != min(s["chunk_size"], s["size"] - offset):
+            return False
+        if hashlib.sha256(data).hexdigest() != checksum:
+            return False
+        fd = os.open(self.root / f"{upload_id}.part", os.O_WRONLY)
+        try:
+            os.pwrite(fd, data, offset)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        with self.lock:
+            s["received"].add(index)
+            with open(self.root / f"{upload_id}.acks", "a") as f:
+                f.write(f"{index}\n")
+        return True
+
+    def complete(self, upload_id: str) -> tuple[int, dict]:
+        """Check that all the chunks arrived and the file matches its checksum."""
+        s = self.sessions[upload_id]
+        n_chunks = max(1, (s["size"] + s["chunk_size"] - 1) // s["chunk_size"])
+        missing = [i for i in range(n_chunks) if i not in s["received"]]
+        if missing:
+            return 409, {"error": "missing chunks", "missing": missing}
+        part = self.root / f"{upload_id}.part"
+        if file_digest(part).hexdigest() != s["sha256"]:
+            return 400, {"error": "checksum mismatch"}
+        os.replace(part, self.root / Path(s["name"]).name)
+        (self.root / f"{upload_id}.acks").unlink(missing_ok=True)
+        with self.lock:
+            del self.sessions[upload_id]
+        return 200, {"name": s["name"], "size": s["size"], "sha256": s["sha256"]}
+
+class UploadHandler(BaseHTTPRequestHandler):
+    """HTTP front end of an UploadStore (set as the server's store)."""
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def reply(self, status, body=None):
+        data = json.dumps(body).encode() if body is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(data)))
+        if body is not None:
+            self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def do_POST(self):
+        store = self.server.store
+        body = self.read_body()
+        m = COMPLETE_RE.match(self.path)
+        if self.path == "/uploads":
+            self.reply(200, store.start(json.loads(body)))
+        elif m and m.group(1) in store.sessions:
+            self.reply(*store.complete(m.group(1)))
+        else:
+            self.reply(404, {"error": "unknown upload"})
+
+    def do_GET(self):
+        m = FILE_RE.match(self.path)
+        path = self.server.store.root / m.group(1) if m else None
+        if path is not None and path.is_file():
+            self.reply(200, {"name": m.group(1), "size": path.stat().st_size})
+        else:
+            self.reply(404, {"error": "no such file"})
+
+    def do_PUT(self):
+        store = self.server.store
+        data = self.read_body()
+        m = CHUNK_RE.match(self.path)
+        if not m or m.group(1) not in store.sessions:
+            self.reply(404, {"error": "unknown upload"})
+        elif store.put_chunk(m.group(1), int(m.group(2)), data,
+                             self.headers.get("X-Chunk-SHA256", "")):
+            self.reply(204)
+        else:
+            self.reply(400, {"error": "bad chunk"})
+
+    def log_message(self, format, *args):
+        pass  # do not print a line per request
+
+class UploadServer:
+    """An upload server running on a background thread of this process."""
+
+    def __init__(self, root: Path, port: int = 0):
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), UploadHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.store = UploadStore(root)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def main():
+    """
+    Run the stand-in upload server in the foreground.
+    """
+    parser = argparse.ArgumentParser(description='Local stand-in for the remote upload endpoints.')
+    parser.add_argument('dir', type=str, help='Directory to store the uploaded files')
+    parser.add_argument('--port', type=int, default=8765, help='Port to listen on (default: 8765)')
+    args, _ = parser.parse_known_args()
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", args.port), UploadHandler)
+    httpd.store = UploadStore(Path(args.dir))
+    print(f"         [harness] Upload server listening on http://127.0.0.1:{args.port}")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
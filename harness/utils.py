@@ -12,11 +12,15 @@ utils.py - Scaffolding code for running the submission.
 
 import sys
 import os
-import platform
 import subprocess
 import json
+import time
+import threading
 from datetime import datetime
 from pathlib import Path
+from step_runner import StepRunner, calibrate_startup
+from resources import run_measured, combine, FIELD_NAMES
+from bandwidth import scan, artifact_report, DEFAULT_LINK_SPEEDS
 
 # Global variable to track the last timestamp
 _last_timestamp: datetime | None = None
@@ -25,6 +29,31 @@ _timestamps = {}
 _timestampsStr = {}
 # Global variable to store measured sizes
 _bandwidth = {}
+# Global variables to store the per-class byte counts of the artifacts,
+# and the link speeds (Mbit/s) for their transfer-time estimates
+_artifacts = {}
+_link_speeds = DEFAULT_LINK_SPEEDS
+# Global variable to store the throughput of the chunked uploads
+_uploads = {}
+# Global variable to store the key store status of the remote backend
+_key_store = {}
+# Global variable to store the artifact cache status
+_cache = {}
+# Global variable to store the one-time load times of the server daemon
+_daemon = {}
+# Persistent runner for the Python steps (None = one interpreter per step)
+_step_runner = None
+# Global variables to track the interpreter startup time spent in each step
+_startup = {}
+_startup_pending = 0.0
+_startup_per_process = 0.0
+_runner_info = {}
+# Global variables to store the resources used by each step
+_resources = {}
+_resources_pending = {}
+# The pending startup time and resources are updated from several threads
+# in the pipelined and load-test modes
+_pending_lock = threading.Lock()
 
 def ensure_directories(rootdir: Path):
     """ Check that the current directory has the rquired sub-directories
@@ -66,6 +95,8 @@ def log_step(step_num: float, step_name: str, start: bool = False):
     global _last_timestamp
     global _timestamps
     global _timestampsStr
+    global _startup_pending
+    global _resources_pending
     now = datetime.now()
     # Format with milliseconds precision
     timestamp = now.strftime("%H:%M:%S")
@@ -84,31 +115,101 @@ def log_step(step_num: float, step_name: str, start: bool = False):
         print(f"{TextFormat.BLUE}{timestamp} [harness] {step_num}: {step_name} completed{elapsed_str}{TextFormat.RESET}")
         _timestampsStr[step_name] = f"{round(elapsed_seconds, 4)}s"
         _timestamps[step_name] = elapsed_seconds
+    with _pending_lock:
+        if not start:
+            if _runner_info:
+                _startup[step_name] = f"{round(_startup_pending, 4)}s"
+            if _resources_pending:
+                _resources[step_name] = format_resources(_resources_pending)
+        _startup_pending = 0.0
+        _resources_pending = {}
+
+def set_link_speeds(speeds: list[float]):
+    """Set the link speeds (in Mbit/s) for the transfer-time estimates"""
+    global _link_speeds
+    _link_speeds = speeds
+
+def dir_size(path: Path) -> int:
+    """Return the size in bytes of a directory or file on disk"""
+    return sum(scan(path).values())
 
 def log_size(path: Path, object_name: str, flag: bool = False, previous: int = 0):
-    """Measure the size of a directory or file on disk
+    """Measure the size of a directory or file on disk, by class of files
     """
     global _bandwidth
 
-    if not path.exists():
-        size = 0
-    elif platform.system() == "Darwin":  # macOS
-        # Use -s for summary and multiply by 1024 since macOS du reports in 1K blocks by default
-        result = subprocess.run(["du", "-sk", path], check=True,
-                               capture_output=True, text=True)
-        size = int(result.stdout.split()[0]) * 1024
-    else:
-        # Linux/other systems support -b flag
-        size = int(subprocess.run(["du", "-sb", path], check=True,
-                           capture_output=True, text=True).stdout.split()[0])
+    classes = scan(path)
+    size = sum(classes.values())
     if flag:
         size -= previous
 
     print(f"{TextFormat.YELLOW}         [harness] {object_name} size: {human_readable_size(size)}{TextFormat.RESET}")
+    if len(classes) > 1:
+        for cls, n in classes.items():
+            print(f"{TextFormat.YELLOW}         [harness]   {cls}: {human_readable_size(n)}{TextFormat.RESET}")
 
     _bandwidth[object_name] = human_readable_size(size)
+    _artifacts[object_name] = artifact_report(classes, _link_speeds)
     return size
 
+def log_cache(key: str, hit: bool):
+    """Record whether steps 1-5 were restored from the artifact cache"""
+    global _cache
+    _cache = {"Key": key, "Hit": hit}
+    status = "hit, steps 1-5 skipped" if hit else "miss, outputs of steps 1-5 stored"
+    print(f"{TextFormat.GREEN}         [harness] Artifact cache {status} ({key}){TextFormat.RESET}")
+
+def log_daemon(load_times: dict):
+    """Record the one-time load times of the server daemon (see server_daemon.py)"""
+    global _daemon
+    _daemon = {"Load keys": f"{round(load_times['Load keys'], 4)}s",
+               "Load database": f"{round(load_times['Load database'], 4)}s",
+               "Resident database": load_times["Resident database"]}
+    loaded = f"the keys in {_daemon['Load keys']}"
+    if load_times["Resident database"]:
+        loaded += f" and the encrypted database in {_daemon['Load database']}"
+    print(f"{TextFormat.GREEN}         [harness] Server daemon loaded {loaded}{TextFormat.RESET}")
+
+def log_upload(report_path: Path, step_name: str):
+    """Record the throughput of a chunked upload, as reported by the upload step"""
+    with open(report_path) as f:
+        stats = json.load(f)
+    if stats.get("skipped"):
+        print(f"{TextFormat.GREEN}         [harness] {stats['name']} is already on the server,",
+              f"upload skipped{TextFormat.RESET}")
+        _uploads[step_name] = {"Bytes": 0, "Time": f"{round(stats['seconds'], 4)}s",
+                               "Skipped": True}
+        return
+    rate = stats["bytes"] / stats["seconds"] if stats["seconds"] > 0 else 0.0
+    print(f"{TextFormat.YELLOW}         [harness] Uploaded {human_readable_size(stats['bytes'])}",
+          f"at {human_readable_size(rate)}/s ({stats['chunks']} chunks,",
+          f"{stats['resumed']} already on the server){TextFormat.RESET}")
+    _uploads[step_name] = {"Bytes": stats["bytes"],
+                           "Time": f"{round(stats['seconds'], 4)}s",
+                           "Throughput": f"{human_readable_size(rate)}/s",
+                           "Chunks": stats["chunks"],
+                           "Resumed chunks": stats["resumed"]}
+
+def log_key_store(report_path: Path):
+    """Record whether the remote backend's keys were taken from its key store"""
+    global _key_store
+    with open(report_path) as f:
+        report = json.load(f)
+    _key_store = {"Fingerprint": report["fingerprint"], "Hit": report["hit"]}
+    status = "hit, key generation skipped" if report["hit"] else "miss, new keys stored"
+    print(f"{TextFormat.GREEN}         [harness] Key store {status} ({report['fingerprint']}){TextFormat.RESET}")
+
+def format_resources(usage: dict) -> dict:
+    """Format the resources used by a step for the results JSON"""
+    out = {}
+    for k, name in FIELD_NAMES.items():
+        if k in usage:
+            if k in ("wall", "user_cpu", "system_cpu"):
+                out[name] = f"{round(usage[k], 4)}s"
+            else:
+                out[name] = human_readable_size(usage[k])
+    return out
+
 def human_readable_size(n: int):
     """Pretty print for size in bytes"""
     n_float : float = n
@@ -118,6 +219,26 @@ def human_readable_size(n: int):
         n_float /= 1024
     return f"{n_float:.1f}P"
 
+def read_server_report(submission_report_path: Path) -> dict:
+    """
+    Read (and print) the timing reported by the server, if any. Groups of
+    counters (e.g. bytes read) are reported as nested objects, these are
+    kept as they are rather than as times.
+    """
+    _timestampsRemote = {}
+    if submission_report_path.exists():
+        with open(submission_report_path, "r") as f:
+            server_reported_times = json.load(f)
+            for step_name, time_str in server_reported_times.items():
+                if isinstance(time_str, dict):
+                    _timestampsRemote[step_name] = time_str
+                    counters = ", ".join(f"{k} {v}" for k, v in time_str.items())
+                    print(f"{TextFormat.PURPLE}         [submission] {step_name}: {counters}{TextFormat.RESET}")
+                    continue
+                _timestampsRemote[step_name] = f"{time_str}s"
+                print(f"{TextFormat.PURPLE}         [submission] {step_name}: {time_str}s{TextFormat.RESET}")
+    return _timestampsRemote
+
 def save_run(path: Path, submission_report_path: Path):
     """Save the timing from the current run to disk"""
     global _timestamps
@@ -126,37 +247,126 @@ def save_run(path: Path, submission_report_path: Path):
 
     _timestampsStr["Total"] = f"{round(sum(_timestamps.values()), 4)}s"
 
-    _timestampsRemote = {}
-    if submission_report_path.exists():
-        with open(submission_report_path, "r") as f:
-            server_reported_times = json.load(f)
-            for step_name, time_str in server_reported_times.items():
-                _timestampsRemote[step_name] = f"{time_str}s"
-                print(f"{TextFormat.PURPLE}         [submission] {step_name}: {time_str}s{TextFormat.RESET}")
+    _timestampsRemote = read_server_report(submission_report_path)
 
     json.dump({
         "Timing": _timestampsStr,
         "Bandwidth": _bandwidth,
+        "Artifacts": _artifacts,
         "Server Reported": _timestampsRemote,
+        "Resources": _resources,
+        **({"Uploads": _uploads} if _uploads else {}),
+        **({"Key store": _key_store} if _key_store else {}),
+        **({"Cache": _cache} if _cache else {}),
+        **({"Daemon": _daemon} if _daemon else {}),
+        **({"Runner": {**_runner_info, "Interpreter startup": _startup}}
+           if _runner_info else {}),
     }, open(path,"w"), indent=2)
 
     print("[total latency]", f"{round(sum(_timestamps.values()), 4)}s")
 
-def run_exe_or_python(base, file_name, *args, check=True):
+def save_pipelined_run(path: Path, submission_report_path: Path,
+                       step_times: dict, sizes: dict, resources: dict, pipeline: dict,
+                       section: str = "Pipeline"):
     """
-        If {base}/{file_name}.py exists, run it with the current Python.
+    Save the measurements of one query of a pipelined execution to disk.
+    The steps of different queries overlap, so rather than the global
+    timestamps this uses the step times and sizes measured for this query.
+    Steps 1-5 are shared by all the queries, they are included as is.
+    The sizes map artifact names to their byte counts by class (see scan).
+    The pipeline information is stored under the given section name (the
+    batched execution uses the same format, with a "Batch" section).
+    """
+    timing = {name: f"{round(t, 4)}s" for name, t in step_times.items()}
+    total = sum(_timestamps.values()) + sum(step_times.values())
+    timing["Total"] = f"{round(total, 4)}s"
+    bandwidth = {**_bandwidth,
+                 **{name: human_readable_size(sum(c.values())) for name, c in sizes.items()}}
+    artifacts = {**_artifacts,
+                 **{name: artifact_report(c, _link_speeds) for name, c in sizes.items()}}
+
+    _timestampsRemote = read_server_report(submission_report_path)
+
+    json.dump({
+        "Timing": {**_timestampsStr, **timing},
+        "Bandwidth": bandwidth,
+        "Artifacts": artifacts,
+        "Server Reported": _timestampsRemote,
+        "Resources": {**_resources,
+                      **{name: format_resources(r) for name, r in resources.items()}},
+        section: pipeline,
+        **({"Uploads": _uploads} if _uploads else {}),
+        **({"Key store": _key_store} if _key_store else {}),
+        **({"Cache": _cache} if _cache else {}),
+        **({"Daemon": _daemon} if _daemon else {}),
+    }, open(path,"w"), indent=2)
+
+def init_step_runner(persistent: bool):
+    """
+    Set up how the Python steps are run: in a persistent worker process, or
+    (by default) in a new interpreter per step. In both modes, the time that
+    each step spent starting interpreters is recorded in the Runner section
+    of the results (an estimate based on calibrating a bare interpreter
+    startup in the default mode, the measured per-step dispatch overhead
+    in the persistent mode).
+    """
+    global _step_runner
+    global _runner_info
+    global _startup_per_process
+    startup = calibrate_startup()
+    _runner_info = {"Mode": "persistent" if persistent else "subprocess",
+                    "Calibrated interpreter startup": f"{round(startup, 4)}s"}
+    if persistent:
+        _step_runner = StepRunner()
+        _runner_info["Worker startup"] = f"{round(_step_runner.startup_time, 4)}s"
+        print(f"         [harness] Persistent step runner started in {round(_step_runner.startup_time, 4)}s",
+              f"(interpreter startup is {round(startup, 4)}s per step otherwise)")
+    else:
+        _startup_per_process = startup
+
+def close_step_runner():
+    """Shut down the persistent worker, if any."""
+    global _step_runner
+    if _step_runner is not None:
+        _step_runner.close()
+        _step_runner = None
+
+def run_exe_or_python(base, file_name, *args, check=True, in_process=True):
+    """
+        If {base}/{file_name}.py exists, run it with the current Python
+        (in the persistent step runner if one was started, unless
+        in_process is False, e.g. for steps that must run concurrently).
         Otherwise, run {base}/build/{file_name} as an executable.
+        Returns the resources used (see resources.py), these are also
+        accumulated and recorded for the step at the next log_step.
     """
+    global _startup_pending
+    global _resources_pending
     py =  base / f"{file_name}.py"
     exe = base / "build" / file_name
     env = os.environ.copy()
 
-    if py.exists():
-        env["PYTHONPATH"] = "."
-        cmd = [sys.executable, py, *args]
-    elif exe.exists():
-        cmd = [exe, *args]
-    else:
-        cmd = None
-    if cmd is not None:
-        subprocess.run(cmd, check=check, env=env)
\ No newline at end of file
+    usage, startup = {}, 0.0
+    try:
+        if py.exists() and _step_runner is not None and in_process:
+            start = time.perf_counter()
+            returncode, usage = _step_runner.run(py, *args)
+            startup = time.perf_counter() - start - usage["wall"]
+            if check and returncode != 0:
+                raise subprocess.CalledProcessError(returncode, [py, *args])
+        else:
+            if py.exists():
+                env["PYTHONPATH"] = "."
+                cmd = [sys.executable, py, *args]
+                startup = _startup_per_process
+            elif exe.exists():
+                cmd = [exe, *args]
+            else:
+                cmd = None
+            if cmd is not None:
+                usage = run_measured(cmd, env=env, check=check)
+    finally:
+        with _pending_lock:
+            _startup_pending += startup
+            _resources_pending = combine(_resources_pending, usage)
+    return usage
\ No newline at end of file
@@ -7,19 +7,83 @@ verify_result.py - correctness oracle for cosine similarity
 #
 # This software is licensed under the terms of the Apache v2 License.
 # See the LICENSE.md file for details.
-import argparse
+import os
 import sys
+import argparse
 import numpy as np
 from utils import TextFormat
 
 # The payloads are vectors of 7 int16 numbers
 PAYLOAD_DIM = 7
 
+# Submissions only need to return all the matches exactly if there are at
+# most this many of them (unless running with --strict)
+MAX_CHECKED_MATCHES = 32
+
+# Rows hashed at a time in the first-pass check
+BLOCK_ROWS = 1 << 20
+
+# Odd 64-bit multipliers for the row hash, one per payload column
+HASH_MULTS = np.array([0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9,
+                       0xD6E8FEB86659FD93, 0xFF51AFD7ED558CCD, 0xC4CEB9FE1A85EC53,
+                       0x94D049BB133111EB], dtype=np.uint64)
+
+def load_payloads(path: str) -> np.ndarray:
+    """Memory-map a file of payload vectors as an (n, PAYLOAD_DIM) int16 array."""
+    n_rows = os.path.getsize(path) // (2 * PAYLOAD_DIM)
+    if n_rows == 0:
+        return np.zeros((0, PAYLOAD_DIM), dtype=np.int16)
+    return np.memmap(path, dtype=np.int16, mode="r", shape=(n_rows, PAYLOAD_DIM))
+
+def multiset_hash(payloads: np.ndarray) -> int:
+    """
+    An order-independent hash of the rows: the sum (mod 2^64) of a mixing
+    hash of each row, computed in blocks of rows.
+    """
+    total = 0
+    for start in range(0, len(payloads), BLOCK_ROWS):
+        block = payloads[start:start + BLOCK_ROWS].astype(np.uint64)
+        h = (block * HASH_MULTS).sum(axis=1, dtype=np.uint64)
+        h ^= h >> np.uint64(31)
+        h *= np.uint64(0xBF58476D1CE4E5B9)
+        h ^= h >> np.uint64(29)
+        total = (total + int(h.sum(dtype=np.uint64))) % (1 << 64)
+    return total
+
+def as_rows(payloads: np.ndarray) -> np.ndarray:
+    """View each payload vector as one opaque value, for sorting and set operations."""
+    return np.ascontiguousarray(payloads).view(np.dtype((np.void, 2 * PAYLOAD_DIM))).ravel()
+
+def compare_payloads(expected: np.ndarray, results: np.ndarray) -> dict:
+    """
+    Compare the multisets of expected and obtained payload vectors. Returns
+    the number of true positives, the precision and recall, and a few of
+    the missing and unexpected vectors.
+    """
+    n_exp, n_res = len(expected), len(results)
+    if n_exp == n_res and multiset_hash(expected) == multiset_hash(results):
+        return {"true_positives": n_exp, "precision": 1.0, "recall": 1.0,
+                "missing": [], "unexpected": []}
+
+    # The hashes differ, count the common vectors (with multiplicities)
+    u_exp, c_exp = np.unique(as_rows(expected), return_counts=True)
+    u_res, c_res = np.unique(as_rows(results), return_counts=True)
+    _, i_exp, i_res = np.intersect1d(u_exp, u_res, assume_unique=True, return_indices=True)
+    tp = int(np.minimum(c_exp[i_exp], c_res[i_res]).sum())
+    missing = np.setdiff1d(u_exp, u_res, assume_unique=True)[:3]
+    unexpected = np.setdiff1d(u_res, u_exp, assume_unique=True)[:3]
+    to_list = lambda rows: [np.frombuffer(r.tobytes(), dtype=np.int16).tolist() for r in rows]
+    return {"true_positives": tp,
+            "precision": tp / n_res if n_res else 1.0,
+            "recall": tp / n_exp if n_exp else 1.0,
+            "missing": to_list(missing), "unexpected": to_list(unexpected)}
+
 def main():
     """
-    Usage:  python3 verify_result.py  <expected_file>  <result_file> [--count_only]
-    Returns exit-code 0 if equal or if there are more than 32 expected results, 1 otherwise.
-    Prints a message so the caller can log it.
+    Usage:  python3 verify_result.py  <expected_file>  <result_file> [--count_only] [--strict]
+    Returns exit-code 0 if equal or if there are more than 32 expected results
+    (without --strict), 1 otherwise.
+    Prints a message with the precision and recall so the caller can log it.
     """
     # Parse arguments using argparse
     parser = argparse.ArgumentParser(description='Copmare expeocted vs obtained results.')
@@ -29,6 +93,9 @@ def main():
                         help='File containing the obtained results')
     parser.add_argument('--count_only', action='store_true',
                         help='Only # of matches, not payloads')
+    parser.add_argument('--strict', action='store_true',
+                        help=f'Require all the payloads to match even if there are more '
+                             f'than {MAX_CHECKED_MATCHES} of them')
 
     args, _ = parser.parse_known_args()
 
@@ -45,38 +112,33 @@ def main():
                   f"but found {result_data})")
             sys.exit(1)
 
-    # Read the expected and result binary files containing payload vectors
-    expected_data = np.fromfile(args.expected_file, dtype=np.int16)
-    result_data = np.fromfile(args.result_file, dtype=np.int16)
-
-    # Reshape into payload vectors
-    expected_payloads = expected_data.reshape(-1, PAYLOAD_DIM)
-    result_payloads = result_data.reshape(-1, PAYLOAD_DIM)
-
+    # Map the expected and result binary files containing payload vectors
+    expected_payloads = load_payloads(args.expected_file)
+    result_payloads = load_payloads(args.result_file)
     num_expected = len(expected_payloads)
     num_results = len(result_payloads)
 
-    # If there are more than 32 expected results, always report success
-    if num_expected > 32:
-        print(f"{TextFormat.GREEN}         [harness] PASS (Too many matches: {num_expected} > 32,",
-              f"skipping detailed comparison){TextFormat.RESET}")
+    cmp = compare_payloads(expected_payloads, result_payloads)
+    summary = (f"precision {cmp['precision']:.4f}, recall {cmp['recall']:.4f}, "
+               f"{cmp['true_positives']} of {num_expected} expected, {num_results} returned")
+    exact = cmp["true_positives"] == num_expected == num_results
+
+    if exact:
+        print(f"{TextFormat.GREEN}         [harness] PASS (All {num_expected} payload vectors match){TextFormat.RESET}")
         sys.exit(0)
 
-    # Otherwise, compare the payloads
-    if num_expected != num_results:
-        print(f"{TextFormat.RED}         [harness] FAIL (Expected {num_expected} payloads, got {num_results}){TextFormat.RESET}")
-        sys.exit(1)
-
-    # Compare each payload vector
-    for i in range(num_expected):
-        if not np.array_equal(expected_payloads[i], result_payloads[i]):
-            print(f"{TextFormat.RED}         [harness] FAIL (Payload {i} mismatch){TextFormat.RESET}")
-            print(f"  Expected: {expected_payloads[i]}")
-            print(f"  Got:      {result_payloads[i]}")
-            sys.exit(1)
+    # With many matches, submissions are not required to return all of them
+    if num_expected > MAX_CHECKED_MATCHES and not args.strict:
+        print(f"{TextFormat.GREEN}         [harness] PASS (Too many matches: {num_expected} > {MAX_CHECKED_MATCHES},",
+              f"not required to match exactly; {summary}){TextFormat.RESET}")
+        sys.exit(0)
 
-    print(f"{TextFormat.GREEN}         [harness] PASS (All {num_expected} payload vectors match){TextFormat.RESET}")
-    sys.exit(0)
+    print(f"{TextFormat.RED}         [harness] FAIL ({summary}){TextFormat.RESET}")
+    for row in cmp["missing"]:
+        print(f"  Missing:    {row}")
+    for row in cmp["unexpected"]:
+        print(f"  Unexpected: {row}")
+    sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,109 @@
+#ifndef CT_CACHE_H_
+#define CT_CACHE_H_
+/// ct_cache.h - A memory-budgeted cache for ciphertexts read from files
+//============================================================================
+// Copyright (c) 2025, Amazon Web Services
+// All rights reserved.
+//
+// This software is licensed under the terms of the Apache License v2.
+// See the file LICENSE.md for details.
+//============================================================================
+/// The output-compression phase of the server reads the same payload
+/// ciphertexts once per match index, always in the same order. A ScanCache
+/// keeps the ciphertexts that fit in its budget (measured by their file
+/// sizes), so that they are read from disk only once.
+///
+/// The eviction policy is tailored to repeated scans in a fixed order:
+/// items that are cached stay cached, and items that do not fit in the
+/// budget are not cached at all. For a scan that is longer than the cache,
+/// the usual LRU policy would evict every item just before it is needed
+/// again, while this policy keeps the first part of the scan in memory and
+/// reads only the rest from disk, which is the best possible (it evicts the
+/// item that will be needed last, namely the one that was just read).
+///
+/// Items are keyed by their file names, and an item whose file was modified
+/// since it was cached is read again. Items that are not separate files
+/// (e.g. records of a packed store) are given with their size and version.
+
+#include <cstdint>
+#include <filesystem>
+#include <functional>
+#include <string>
+#include <unordered_map>
+#include <utility>
+
+template <typename T>
+class ScanCache {
+ public:
+  using Loader = std::function<T(const std::filesystem::path&)>;
+
+  /// @param budget the total size (in bytes) of the files whose contents
+  /// can be cached, 0 disables the cache
+  explicit ScanCache(uint64_t budget = 0) : budget(budget) {}
+
+  void set_budget(uint64_t new_budget) { budget = new_budget; }
+
+  /// @brief Returns the item for a file, from the cache or using load()
+  T get(const std::filesystem::path& fname, const Loader& load) {
+    return get(fname.string(), std::filesystem::file_size(fname),
+               std::filesystem::last_write_time(fname),
+               [&load, &fname] { return load(fname); });
+  }
+
+  /// @brief Returns an item by its key, from the cache or using load()
+  /// @param size the size of the item, counted against the budget
+  /// @param version if it differs from that of the cached item, the item
+  /// is loaded again
+  T get(const std::string& key, uint64_t size,
+        std::filesystem::file_time_type version, const std::function<T()>& load) {
+    bytes_requested += size;
+
+    auto it = items.find(key);
+    if (it != items.end()) {
+      if (it->second.version == version) {
+        hits++;
+        return it->second.value;
+      }
+      bytes_cached -= it->second.size;  // stale, the file was modified
+      items.erase(it);
+    }
+
+    misses++;
+    bytes_read += size;
+    T value = load();
+    if (bytes_cached + size <= budget) {
+      items.emplace(key, Entry{value, size, version});
+      bytes_cached += size;
+    }
+    return value;
+  }
+
+  /// Drop all the cached items
+  void clear() {
+    items.clear();
+    bytes_cached = 0;
+  }
+
+  /// Reset the counters below, but keep the cached items
+  void reset_counters() {
+    bytes_requested = bytes_read = hits = misses = 0;
+  }
+
+  // Counters, since the last reset_counters()
+  uint64_t bytes_requested = 0;  // total size of the items that were asked for
+  uint64_t bytes_read = 0;       // total size of the items read from disk
+  uint64_t hits = 0;
+  uint64_t misses = 0;
+  // The total size of the cached items
+  uint64_t bytes_cached = 0;
+
+ private:
+  struct Entry {
+    T value;
+    uint64_t size;
+    std::filesystem::file_time_type version;
+  };
+  uint64_t budget;
+  std::unordered_map<std::string, Entry> items;
+};
+#endif  // CT_CACHE_H_
@@ -0,0 +1,120 @@
+#ifndef DB_MANIFEST_H_
+#define DB_MANIFEST_H_
+/// db_manifest.h - The versioned list of batches of an updated database
+//============================================================================
+// Copyright (c) 2025, Amazon Web Services
+// All rights reserved.
+//
+// This software is licensed under the terms of the Apache License v2.
+// See the file LICENSE.md for details.
+//============================================================================
+/// The initial encryption writes batch i of the encrypted dataset under
+/// batchNNNN/ in the upload directory (or as records with these names in a
+/// packed store). After that, client_encode_encrypt_db --update re-encrypts
+/// only the batches with appended, modified or deleted records, and writes
+/// each of them to a new directory batchNNNN.vK, where K is the version of
+/// the update. The manifest file in the upload directory lists the
+/// directory of every batch:
+///     db-manifest 1 <version> <number-of-records>
+///     batch0000
+///     batch0001.v3
+///     ...
+/// The manifest is replaced atomically after all the new ciphertexts are
+/// written, so a server that reads it at the start of every computation
+/// uses either the old or the new database, never a mix of the two. A
+/// database without a manifest is the initial one, version 0.
+///
+/// The directories of the previous version are kept (for computations that
+/// started before the update), older ones are removed by the next update.
+
+#include <cstdint>
+#include <filesystem>
+#include <fstream>
+#include <iomanip>
+#include <sstream>
+#include <stdexcept>
+#include <string>
+#include <vector>
+
+constexpr char MANIFEST_NAME[] = "manifest.txt";
+
+/// The name of the directory of a batch in the initial database, batchNNNN
+inline std::string batch_dir_name(size_t batch) {
+  std::stringstream ss;
+  ss << "batch" << std::setw(4) << std::setfill('0') << batch;
+  return ss.str();
+}
+
+/// The name of a ciphertext file in a batch directory, <prefix>MMMM.bin
+inline std::string ct_file_name(const std::string& prefix, size_t idx) {
+  std::stringstream ss;
+  ss << prefix << std::setw(4) << std::setfill('0') << idx << ".bin";
+  return ss.str();
+}
+
+struct DbManifest {
+  uint64_t version = 0;
+  uint64_t n_records = 0;
+  std::vector<std::string> batch_dirs;  // relative to the upload directory
+
+  /// The initial database, with n_records in batches of n_slots records
+  static DbManifest initial(uint64_t n_records, uint64_t n_slots) {
+    DbManifest m;
+    m.n_records = n_records;
+    for (uint64_t b = 0; b < (n_records + n_slots - 1) / n_slots; b++) {
+      m.batch_dirs.push_back(batch_dir_name(b));
+    }
+    return m;
+  }
+
+  /// Read the manifest of the database in updir, or return the initial
+  /// database if there is no manifest
+  static DbManifest read(const std::filesystem::path& updir,
+                         uint64_t n_records, uint64_t n_slots) {
+    auto fname = updir / MANIFEST_NAME;
+    std::ifstream file(fname);
+    if (!file.is_open()) {
+      return initial(n_records, n_slots);
+    }
+    DbManifest m;
+    std::string magic;
+    int format;
+    if (!(file >> magic >> format >> m.version >> m.n_records)
+        || magic != "db-manifest" || format != 1) {
+      throw std::runtime_error("bad manifest " + fname.string());
+    }
+    for (std::string dir; file >> dir; ) {
+      m.batch_dirs.push_back(dir);
+    }
+    if (m.batch_dirs.size() != (m.n_records + n_slots - 1) / n_slots) {
+      throw std::runtime_error("wrong number of batches in " + fname.string());
+    }
+    return m;
+  }
+
+  /// Write the manifest to updir, atomically
+  void write(const std::filesystem::path& updir) const {
+    auto fname = updir / MANIFEST_NAME;
+    auto tmp = fname;
+    tmp += ".tmp";
+    std::ofstream file(tmp);
+    file << "db-manifest 1 " << version << ' ' << n_records << '\n';
+    for (auto& dir : batch_dirs) {
+      file << dir << '\n';
+    }
+    file.close();
+    if (!file) {
+      throw std::runtime_error("failed to write " + tmp.string());
+    }
+    std::filesystem::rename(tmp, fname);
+  }
+
+  size_t n_batches() const { return batch_dirs.size(); }
+
+  /// The directory that holds the ciphertexts of a batch
+  std::filesystem::path batch_dir(const std::filesystem::path& updir,
+                                  size_t batch) const {
+    return updir / batch_dirs.at(batch);
+  }
+};
+#endif  // DB_MANIFEST_H_
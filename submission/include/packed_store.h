@@ -0,0 +1,230 @@
+#ifndef PACKED_STORE_H_
+#define PACKED_STORE_H_
+/// packed_store.h - Storing many serialized ciphertexts in a few large files
+//============================================================================
+// Copyright (c) 2025, Amazon Web Services
+// All rights reserved.
+//
+// This software is licensed under the terms of the Apache License v2.
+// See the file LICENSE.md for details.
+//============================================================================
+/// By default the encrypted dataset is stored with one file per ciphertext,
+/// batchNNNN/row_MMMM.bin and batchNNNN/payload_MMMM.bin, which for the
+/// large instance means over 300K files. The packed format stores the same
+/// serialized ciphertexts as records in a few large segment files, and an
+/// index that maps the name of each record (the name of the file that it
+/// replaces, e.g. batch0003/row_0017.bin) to its place in the segments.
+///
+/// The files in a packed directory are:
+///  - db_seg_NNNN.bin: the segments, each one up to segment_size bytes
+///    (unless a single record is larger). Records start at offsets that
+///    are multiples of the alignment (the page size by default), the gaps
+///    between them are zero padding.
+///  - db.idx: a text file, the first line is "packed-db 1 <alignment>"
+///    followed by a line "<name> <segment> <offset> <length>" per record.
+///
+/// PackedWriter creates these files, and PackedStore maps the segments
+/// to memory (read-only) and returns the bytes of a record by its name,
+/// so a record can be deserialized straight from the mapped memory.
+
+#include <sys/mman.h>
+#include <fcntl.h>
+#include <unistd.h>
+
+#include <cstdint>
+#include <filesystem>
+#include <fstream>
+#include <iomanip>
+#include <sstream>
+#include <stdexcept>
+#include <streambuf>
+#include <string>
+#include <unordered_map>
+#include <vector>
+
+namespace fs = std::filesystem;
+
+constexpr char PACKED_INDEX_NAME[] = "db.idx";
+
+inline fs::path packed_segment_name(fs::path dir, size_t seg) {
+  std::stringstream ss;
+  ss << "db_seg_" << std::setw(4) << std::setfill('0') << seg << ".bin";
+  return dir / ss.str();
+}
+
+/// Writes records to segment files, then the index when closed
+class PackedWriter {
+ public:
+  explicit PackedWriter(fs::path dir, uint64_t segment_size = 1ULL << 32,
+                        uint64_t alignment = 4096)
+      : dir(dir), segment_size(segment_size), alignment(alignment) {
+    fs::create_directories(dir);
+    index << "packed-db 1 " << alignment << "\n";
+    open_segment();
+  }
+
+  PackedWriter(const PackedWriter&) = delete;
+  PackedWriter& operator=(const PackedWriter&) = delete;
+
+  ~PackedWriter() {
+    if (!closed) {
+      try { close(); } catch (...) {}
+    }
+  }
+
+  /// Append a record, e.g. a serialized ciphertext
+  void add(const std::string& name, const std::string& data) {
+    uint64_t offset = (seg_size + alignment - 1) / alignment * alignment;
+    if (offset > 0 && offset + data.size() > segment_size) {  // next segment
+      open_segment();
+      offset = 0;
+    }
+    seg_file << std::string(offset - seg_size, '\0') << data;  // pad, write
+    if (!seg_file) {
+      throw std::runtime_error("failed to write to " +
+                               packed_segment_name(dir, n_segments-1).string());
+    }
+    seg_size = offset + data.size();
+    index << name << ' ' << (n_segments - 1) << ' ' << offset << ' '
+          << data.size() << '\n';
+  }
+
+  /// Close the last segment and write the index
+  void close() {
+    closed = true;
+    seg_file.close();
+    // Write the index last and atomically, a directory without an index
+    // is not a (complete) packed store
+    auto idx_fname = dir / PACKED_INDEX_NAME;
+    auto tmp = idx_fname;
+    tmp += ".tmp";
+    std::ofstream idx_file(tmp);
+    idx_file << index.str();
+    idx_file.close();
+    if (!idx_file) {
+      throw std::runtime_error("failed to write " + tmp.string());
+    }
+    fs::rename(tmp, idx_fname);
+  }
+
+ private:
+  void open_segment() {
+    seg_file.close();
+    auto fname = packed_segment_name(dir, n_segments++);
+    seg_file.open(fname, std::ios::binary);
+    if (!seg_file) {
+      throw std::runtime_error("failed to create " + fname.string());
+    }
+    seg_size = 0;
+  }
+
+  fs::path dir;
+  uint64_t segment_size;
+  uint64_t alignment;
+  std::ofstream seg_file;
+  size_t n_segments = 0;  // including the current one
+  uint64_t seg_size = 0;  // bytes written to the current segment
+  std::stringstream index;
+  bool closed = false;
+};
+
+/// Read-only access to the records of a packed directory, via mmap
+class PackedStore {
+ public:
+  struct Record {
+    const char* data;
+    size_t length;
+  };
+
+  /// Does this directory contain a packed store?
+  static bool exists(fs::path dir) { return fs::exists(dir / PACKED_INDEX_NAME); }
+
+  /// Read the index and map all the segments to memory. The records can be
+  /// found by their full names, dir/<name>.
+  explicit PackedStore(fs::path dir) : index_mtime(fs::last_write_time(dir / PACKED_INDEX_NAME)) {
+    std::ifstream idx_file(dir / PACKED_INDEX_NAME);
+    std::string magic;
+    int version;
+    uint64_t alignment;
+    if (!(idx_file >> magic >> version >> alignment) || magic != "packed-db" || version != 1) {
+      throw std::runtime_error("bad packed index in " + dir.string());
+    }
+    std::string name;
+    size_t seg;
+    uint64_t offset, length;
+    while (idx_file >> name >> seg >> offset >> length) {
+      while (segments.size() <= seg) {
+        map_segment(packed_segment_name(dir, segments.size()));
+      }
+      if (offset + length > segments[seg].second) {
+        throw std::runtime_error("record " + name + " is out of its segment");
+      }
+      auto full_name = (dir / name).string();
+      records[full_name] = {segments[seg].first + offset, size_t(length)};
+      names.push_back(full_name);
+    }
+  }
+
+  PackedStore(const PackedStore&) = delete;
+  PackedStore& operator=(const PackedStore&) = delete;
+
+  ~PackedStore() {
+    for (auto& [addr, len] : segments) {
+      if (len > 0) {
+        munmap(const_cast<char*>(addr), len);
+      }
+    }
+  }
+
+  /// Find a record by its full name, returns false if there is none
+  bool find(const std::string& full_name, Record& rec) const {
+    auto it = records.find(full_name);
+    if (it == records.end()) {
+      return false;
+    }
+    rec = it->second;
+    return true;
+  }
+
+  /// The full names of all the records, in the order they were written
+  const std::vector<std::string>& record_names() const { return names; }
+
+  /// When the store was written, to tell apart different versions of it
+  fs::file_time_type version() const { return index_mtime; }
+
+ private:
+  void map_segment(fs::path fname) {
+    int fd = open(fname.c_str(), O_RDONLY);
+    if (fd < 0) {
+      throw std::runtime_error("failed to open " + fname.string());
+    }
+    size_t len = fs::file_size(fname);
+    const char* addr = nullptr;
+    if (len > 0) {
+      void* p = mmap(nullptr, len, PROT_READ, MAP_PRIVATE, fd, 0);
+      if (p == MAP_FAILED) {
+        ::close(fd);
+        throw std::runtime_error("failed to map " + fname.string());
+      }
+      addr = static_cast<const char*>(p);
+    }
+    ::close(fd);  // the mapping stays valid
+    segments.emplace_back(addr, len);
+  }
+
+  fs::file_time_type index_mtime;
+  std::vector<std::pair<const char*, size_t>> segments;  // mapped segments
+  std::unordered_map<std::string, Record> records;
+  std::vector<std::string> names;
+};
+
+/// A read-only stream buffer over a memory region, e.g. for deserializing a
+/// record with std::istream without copying it
+class MemoryBuf : public std::streambuf {
+ public:
+  MemoryBuf(const char* data, size_t length) {
+    char* p = const_cast<char*>(data);
+    setg(p, p, p + length);
+  }
+};
+#endif  // PACKED_STORE_H_
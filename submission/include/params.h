@@ -10,13 +10,24 @@
 //============================================================================
 #include <vector>
 #include <string>
+#include <sstream>
+#include <fstream>
 #include <stdexcept>
 #include <filesystem>
 namespace fs = std::filesystem;
 
-// The level budget for the running-sums procedure
+// The default level budget for the running-sums procedure (can be
+// overridden in the tuning file, see InstanceParams::read_tuning below)
 constexpr int RUNNING_SUM_LEVELS = 3;
 
+// The multiplicative depth of the keys, and the levels that the fetch
+// computation consumes besides the slot replication and the running sums:
+// 1 for the matrix-vector product, 6 for the comparison to the threshold,
+// 1 to multiply the running sums by the matches, 7 for the impulse function
+// and 2 for the output compression (see also harness/tune_params.py)
+constexpr int MULT_DEPTH = 23;
+constexpr int FIXED_FETCH_LEVELS = 17;
+
 // The payload slots contain numbers in the range [0,MAX_PAYLOAD_VAL)
 // with precision of 1/PAYLOAD_PRECISION
 constexpr int MAX_PAYLOAD_VAL = 256;
@@ -47,13 +58,17 @@ class InstanceParams {
     int dbSize;     // number of records in the dataset
     int ringDim;    // dimenion of the FHE ring
     std::vector<int> degrees;  // must multiply to the record dimension
+    int runningSumLevels; // level budget for the running sums
     fs::path rootdir; // root of the submission dir structure (see below)
+    fs::path querydir; // optional directory for the per-query files
 
 public:
     // Constructor
     explicit InstanceParams(InstanceSize _size,
-                            fs::path _rootdir = fs::current_path())
-                            : size(_size), rootdir(_rootdir)
+                            fs::path _rootdir = fs::current_path(),
+                            fs::path _querydir = fs::path())
+                            : size(_size), rootdir(_rootdir),
+                              querydir(_querydir.empty()? _querydir : _rootdir/_querydir)
     {
         if (unsigned(_size) > unsigned(InstanceSize::LARGE)) {
             throw std::invalid_argument("Invalid instance size");
@@ -87,6 +102,71 @@ public:
             default:
                 degrees = {8, 4, 4};
         }
+        runningSumLevels = RUNNING_SUM_LEVELS;
+
+        // The defaults above can be overridden at runtime (e.g. by the
+        // output of harness/tune_params.py) without recompiling
+        read_tuning(tuningFile());
+    }
+
+    // The tuning file has one line per instance size, of the form
+    //      <instance-name> <degree>,<degree>,... <running-sum-levels>
+    // e.g. "medium 16,4,4 2". Empty lines and lines starting with '#' are
+    // ignored, as are missing files and instance sizes. The keys, the
+    // encrypted database and the server must all use the same values, so
+    // the harness regenerates them when this file changes.
+    void read_tuning(const fs::path& fname) {
+        std::ifstream file(fname);
+        std::string line;
+        while (file.is_open() && std::getline(file, line)) {
+            std::istringstream ss(line);
+            std::string name, degs;
+            int levels;
+            if (!(ss >> name) || name[0]=='#' || name != instance_name(size)) {
+                continue;
+            }
+            if (!(ss >> degs >> levels) || levels < 1) {
+                throw std::invalid_argument("Bad line in "+fname.string()+": "+line);
+            }
+            std::vector<int> degs_vec;
+            std::istringstream ds(degs);
+            int product = 1;
+            for (std::string d; std::getline(ds, d, ',');) {
+                degs_vec.push_back(std::stoi(d));
+                product *= degs_vec.back();
+                if (degs_vec.back() < 2) {
+                    throw std::invalid_argument("Tree degrees in "+fname.string()
+                                                +" must all be at least 2");
+                }
+            }
+            if (product != recordDim) {
+                throw std::invalid_argument("Tree degrees in "+fname.string()
+                              +" must multiply to "+std::to_string(recordDim));
+            }
+            int depth = int(degs_vec.size()) + runningSumDepth(levels) + FIXED_FETCH_LEVELS;
+            if (depth > MULT_DEPTH) {
+                throw std::invalid_argument("The configuration in "+fname.string()
+                              +" needs "+std::to_string(depth)+" levels, more than the "
+                              +std::to_string(MULT_DEPTH)+" of the keys: "+line);
+            }
+            degrees = degs_vec;
+            runningSumLevels = levels;
+        }
+    }
+
+    // The levels that the running sums actually consume with a given
+    // budget, as in RunningSums::get_shift_amounts: the log2(64) doublings
+    // of a column are grouped into phases of ceil(log2(64)/budget) each
+    int runningSumDepth(int budget) const {
+        int log_rows = 0;
+        while ((getNCols() << (log_rows + 1)) <= getNSlots()) {
+            log_rows++;
+        }
+        if (budget <= 0 || budget > log_rows) {
+            budget = log_rows;
+        }
+        int per_phase = (log_rows + budget - 1) / budget;
+        return (log_rows + per_phase - 1) / per_phase;
     }
 
     // Getters for all the parameters. There are no setters, once
@@ -96,6 +176,7 @@ public:
     int getDbSize() const { return dbSize; }
     int getRingDim() const { return ringDim; }
     std::vector<int> getDegrees() const { return degrees; }
+    int getRunningSumLevels() const { return runningSumLevels; }
     int getNSlots() const { return ringDim/2; } // # of plaintext slots
 
     // # of ciphertexts needed to hold one column of the dataset
@@ -139,6 +220,7 @@ public:
     //       …
     // The relevant directories where things are found
     fs::path rtdir() const  { return rootdir; }
+    fs::path tuningFile() const { return rootdir/"submission"/"tuning.txt"; }
     fs::path iodir() const  { return rootdir/"io"/instance_name(size); }
     fs::path keydir() const { return iodir() / "keys"; }
     fs::path updir() const { return iodir() / "ciphertexts_upload"; }
@@ -146,6 +228,47 @@ public:
     fs::path datadir() const { 
         return rootdir/"datasets"/instance_name(size);
     }
+
+    // The per-query files (the cleartext query, the encrypted query and
+    // results, and the decrypted results) are by default in the dataset
+    // and I/O directories above. The harness can run several queries at
+    // once, giving each one its own query directory that holds all these
+    // files (with the same names and sub-directories).
+    fs::path qrydatadir() const {
+        return querydir.empty()? datadir() : querydir;
+    }
+    fs::path qryiodir() const {
+        return querydir.empty()? iodir() : querydir;
+    }
+    fs::path qryupdir() const { return qryiodir() / "ciphertexts_upload"; }
+    fs::path qrydowndir() const { return qryiodir() / "ciphertexts_download"; }
 };
 
+// Get the query directory from a "--query_dir <dir>" command-line
+// argument, returns an empty path if there is no such argument
+inline fs::path query_dir_arg(int argc, char* argv[]) {
+    for (int i = 1; i + 1 < argc; i++) {
+        if (std::string(argv[i]) == "--query_dir") {
+            return fs::path(argv[i+1]);
+        }
+    }
+    return fs::path();
+}
+
+// Get all the query directories from (possibly several) "--query_dir <dir>"
+// command-line arguments, for a server that processes a batch of queries.
+// Returns a single empty path if there are no such arguments.
+inline std::vector<fs::path> query_dirs_arg(int argc, char* argv[]) {
+    std::vector<fs::path> dirs;
+    for (int i = 1; i + 1 < argc; i++) {
+        if (std::string(argv[i]) == "--query_dir") {
+            dirs.push_back(fs::path(argv[++i]));
+        }
+    }
+    if (dirs.empty()) {
+        dirs.push_back(fs::path());
+    }
+    return dirs;
+}
+
 #endif  // ifndef PARAMS_H_
\ No newline at end of file
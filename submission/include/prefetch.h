@@ -0,0 +1,159 @@
+#ifndef PREFETCH_H_
+#define PREFETCH_H_
+/// prefetch.h - Loading files ahead of their use, in background threads
+//============================================================================
+// Copyright (c) 2025, Amazon Web Services
+// All rights reserved.
+//
+// This software is licensed under the terms of the Apache License v2.
+// See the file LICENSE.md for details.
+//============================================================================
+/// The server reads the encrypted dataset one ciphertext at a time, and on
+/// the larger instances reading and deserializing these ciphertexts takes
+/// about as long as the computation on them. A Prefetcher gets the list of
+/// files in the order that they will be used, and its reader threads load
+/// them ahead of time while the caller computes on the previous ones.
+///
+/// The queue is bounded: at most depth items are loaded (or being loaded)
+/// ahead of the consumer, so the memory overhead is depth ciphertexts. The
+/// items are returned in the order of the files, regardless of the order
+/// in which the reader threads finish loading them.
+///
+/// Example:
+///   Prefetcher<Ciphertext<DCRTPoly>> rows(fnames, get_ctxt, 8);
+///   for (size_t i = 0; i < fnames.size(); i++) {
+///     auto ct = rows.next();  // blocks until fnames[i] is loaded
+///     ...
+///   }
+///   std::cout << "waited " << rows.wait_seconds() << "s for I/O\n";
+
+#include <algorithm>
+#include <chrono>
+#include <condition_variable>
+#include <exception>
+#include <filesystem>
+#include <functional>
+#include <map>
+#include <mutex>
+#include <stdexcept>
+#include <thread>
+#include <utility>
+#include <vector>
+
+template <typename T>
+class Prefetcher {
+ public:
+  using Loader = std::function<T(const std::filesystem::path&)>;
+
+  /// @brief Start loading the files in the background
+  /// @param files the files to load, in the order that they will be used
+  /// @param load a function that loads one file, it is called from the
+  /// reader threads so it must be thread-safe
+  /// @param depth how many items to load ahead of the consumer, with depth=0
+  /// the files are loaded synchronously in next() (no reader threads)
+  /// @param n_readers how many reader threads to use
+  Prefetcher(std::vector<std::filesystem::path> files, Loader load,
+             size_t depth, size_t n_readers = 2)
+      : files(std::move(files)), load(std::move(load)), depth(depth) {
+    if (depth > 0) {
+      n_readers = std::min(n_readers, std::min(depth, this->files.size()));
+      for (size_t t = 0; t < n_readers; t++) {
+        readers.emplace_back([this] { read_loop(); });
+      }
+    }
+  }
+
+  Prefetcher(const Prefetcher&) = delete;
+  Prefetcher& operator=(const Prefetcher&) = delete;
+
+  ~Prefetcher() {
+    {
+      std::lock_guard<std::mutex> lock(mtx);
+      stopping = true;
+    }
+    space.notify_all();
+    for (auto& t : readers) {
+      t.join();
+    }
+  }
+
+  /// @brief Returns the next item, in the order of the files. Blocks until
+  /// it is loaded, and re-throws the exception if loading it failed.
+  T next() {
+    if (consumed >= files.size()) {
+      throw std::out_of_range("Prefetcher: no more files to load");
+    }
+    auto start = std::chrono::steady_clock::now();
+    if (readers.empty()) {  // synchronous mode
+      T value = load(files[consumed++]);
+      waited += std::chrono::steady_clock::now() - start;
+      return value;
+    }
+    std::unique_lock<std::mutex> lock(mtx);
+    loaded.wait(lock, [this] { return ready.count(consumed) > 0; });
+    waited += std::chrono::steady_clock::now() - start;
+    auto it = ready.find(consumed);
+    Item item = std::move(it->second);
+    ready.erase(it);
+    consumed++;
+    lock.unlock();
+    space.notify_all();  // a reader can start on the next file
+    if (item.error) {
+      std::rethrow_exception(item.error);
+    }
+    return std::move(item.value);
+  }
+
+  /// The total time that next() spent waiting for items to be loaded
+  double wait_seconds() const { return waited.count(); }
+
+ private:
+  struct Item {
+    T value;
+    std::exception_ptr error;
+  };
+
+  // The reader threads claim the files in order, each one loads the file
+  // that it claimed and puts it in the ready map under the file's index
+  void read_loop() {
+    while (true) {
+      size_t idx;
+      {
+        std::unique_lock<std::mutex> lock(mtx);
+        space.wait(lock, [this] {
+          return stopping || claimed >= files.size() || claimed < consumed + depth;
+        });
+        if (stopping || claimed >= files.size()) {
+          return;
+        }
+        idx = claimed++;
+      }
+      Item item;
+      try {
+        item.value = load(files[idx]);
+      } catch (...) {
+        item.error = std::current_exception();
+      }
+      {
+        std::lock_guard<std::mutex> lock(mtx);
+        ready.emplace(idx, std::move(item));
+      }
+      loaded.notify_all();
+    }
+  }
+
+  const std::vector<std::filesystem::path> files;
+  const Loader load;
+  const size_t depth;
+  std::vector<std::thread> readers;
+
+  std::mutex mtx;                    // protects all the fields below
+  std::condition_variable loaded;    // signaled when an item is ready
+  std::condition_variable space;     // signaled when the consumer advances
+  std::map<size_t, Item> ready;      // loaded items, by file index
+  size_t claimed = 0;                // files claimed by the readers
+  size_t consumed = 0;               // items returned by next()
+  bool stopping = false;
+  std::chrono::duration<double> waited{0};  // updated only by next()
+};
+#endif  // PREFETCH_H_
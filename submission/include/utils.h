@@ -8,12 +8,14 @@
 // This software is licensed under the terms of the Apache License v2.
 // See the file LICENSE.md for details.
 //============================================================================
+#include <cstdint>
 #include <string>
 #include <filesystem>
 #include <iostream>
 #include <fstream>
 #include <vector>
 #include <set>
+#include <utility>
 
 template<typename T>
 std::vector<T> vector_union(std::vector<std::vector<T> >& vecs)
@@ -53,6 +55,29 @@ template<typename T> std::vector<std::vector<T>> read2vecs(
   return a;
 }
 
+/// Read count records (of dimension record_dim) from a binary file, starting
+/// at record number start, into a vector of vectors
+template<typename T> std::vector<std::vector<T>> read_records(
+    std::filesystem::path fname, int record_dim, size_t start, size_t count)
+{
+  std::ifstream file(fname, std::ios::binary);
+  if (!file.is_open()) {
+    throw std::runtime_error("Cannot open " + fname.string() + " for read");
+  }
+  file.seekg(start * record_dim * sizeof(T), std::ios::beg);
+
+  std::vector<std::vector<T>> a(count);
+  for (auto& r : a) {
+    r.resize(record_dim);
+    file.read(reinterpret_cast<char*>(&r[0]), record_dim * sizeof(T));
+  }
+  if (!file) {
+    throw std::runtime_error("Cannot read records from " + fname.string());
+  }
+  file.close();
+  return a;
+}
+
 // Write a binary file containing the matrix in vecs
 template<typename T> void write2disk(
     std::filesystem::path fname,const std::vector<std::vector<T>>& vecs)
@@ -109,12 +134,29 @@ std::vector<std::vector<std::vector<double> > > transpose_matrix(
   return transposed;  // return the encoded matrix
 }
 
-/// Store the accumulated time in a JSON file
-inline void store_server_time(std::filesystem::path fname, int64_t compute, int64_t total) {
+/// Groups of named counters (not times) for the server report
+using ServerCounters =
+    std::vector<std::pair<std::string, std::vector<std::pair<std::string, uint64_t>>>>;
+
+/// Store the accumulated time in a JSON file, optionally with the times
+/// (in seconds) of some parts of the computation and some counters
+inline void store_server_time(std::filesystem::path fname, int64_t compute, int64_t total,
+    const std::vector<std::pair<std::string, double>>& parts = {},
+    const ServerCounters& counters = {}) {
   std::ofstream file(fname);
   if (file.is_open()) {
     file << "{\n";
     file << "  \"Encrypted computation\": " << compute << ',' << std::endl;
+    for (auto& [name, seconds] : parts) {
+      file << "  \"" << name << "\": " << seconds << ',' << std::endl;
+    }
+    for (auto& [group, values] : counters) {
+      file << "  \"" << group << "\": {";
+      for (size_t i = 0; i < values.size(); i++) {
+        file << (i > 0? ", " : "") << '"' << values[i].first << "\": " << values[i].second;
+      }
+      file << "}," << std::endl;
+    }
     file << "  \"Total\": " << total << std::endl;
     file << "}\n";
     file.close();
@@ -0,0 +1,129 @@
+// bench_ops.cpp - micro-benchmark of the homomorphic operations
+//============================================================================
+// Copyright (c) 2025, Amazon Web Services
+// All rights reserved.
+//
+// This software is licensed under the terms of the Apache License v2.
+// See the file LICENSE.md for details.
+//============================================================================
+// This is not one of the benchmark steps. It times the CKKS operations that
+// the server uses, with the same parameters as client_key_generation, and
+// prints the average time of each operation (in seconds) as JSON to stdout.
+// The harness script harness/tune_params.py uses these numbers to calibrate
+// its cost model of the server computation.
+//
+// All the operations are timed on fresh ciphertexts (i.e., at level 0). The
+// cost of most operations is roughly linear in the number of remaining
+// moduli, so the cost at other levels can be extrapolated from these.
+// The cost of a rotation key (generating it, serializing it and loading it
+// back) is also reported, with its size in bytes.
+#include <chrono>
+#include <cmath>
+#include <functional>
+#include <sstream>
+#include "openfhe.h"
+#include "cryptocontext-ser.h"  // header files needed for (de)serialization
+#include "key/key-ser.h"
+#include "scheme/ckksrns/ckksrns-ser.h"
+#include "params.h"
+
+using namespace lbcrypto;
+
+// Average wall-clock time of n_reps calls to op, in seconds
+double time_op(int n_reps, const std::function<void()>& op) {
+  op();  // warm-up, e.g. to get the NTT tables into the caches
+  auto start = std::chrono::steady_clock::now();
+  for (int i = 0; i < n_reps; i++) {
+    op();
+  }
+  std::chrono::duration<double> elapsed =
+      std::chrono::steady_clock::now() - start;
+  return elapsed.count() / n_reps;
+}
+
+int main(int argc, char* argv[]) {
+  if (argc < 2 || !std::isdigit(argv[1][0])) {
+    std::cout << "Usage: " << argv[0] << " instance-size [--reps N]\n";
+    std::cout << "  Instance-size: 0-TOY, 1-SMALL, 2-MEDIUM, 3-LARGE\n";
+    return 0;
+  }
+  auto size = static_cast<InstanceSize>(std::stoi(argv[1]));
+  InstanceParams prms(size);
+  int n_reps = 10;
+  for (int i = 2; i + 1 < argc; i++) {
+    if (std::string(argv[i]) == "--reps") {
+      n_reps = std::stoi(argv[i+1]);
+    }
+  }
+
+  // The same parameters as in client_key_generation
+  CCParams<CryptoContextCKKSRNS> cParams;
+  cParams.SetSecretKeyDist(UNIFORM_TERNARY);
+  cParams.SetKeySwitchTechnique(HYBRID);
+  cParams.SetMultiplicativeDepth(MULT_DEPTH);
+  if (prms.getSize()==InstanceSize::TOY) {
+    cParams.SetSecurityLevel(HEStd_NotSet);
+    cParams.SetRingDim(1 << 10);
+  } else {
+    cParams.SetSecurityLevel(HEStd_128_classic);
+  }
+  cParams.SetScalingTechnique(FLEXIBLEAUTO);
+  cParams.SetScalingModSize(42);
+  cParams.SetFirstModSize(57);
+  CryptoContext<DCRTPoly> cc = GenCryptoContext(cParams);
+  cc->Enable(PKE);
+  cc->Enable(KEYSWITCH);
+  cc->Enable(LEVELEDSHE);
+  cc->Enable(ADVANCEDSHE);
+
+  auto keys = cc->KeyGen();
+  cc->EvalMultKeyGen(keys.secretKey);
+  cc->EvalAtIndexKeyGen(keys.secretKey, {-1});
+
+  // Two fresh ciphertexts and a plaintext with random-looking slots
+  std::vector<double> slots(prms.getNSlots());
+  for (size_t i = 0; i < slots.size(); i++) {
+    slots[i] = std::sin(double(i));
+  }
+  auto pt = cc->MakeCKKSPackedPlaintext(slots);
+  auto ct1 = cc->Encrypt(keys.publicKey, pt);
+  auto ct2 = cc->Encrypt(keys.publicKey, pt);
+  auto product = cc->EvalMultNoRelin(ct1, ct2);
+  auto digits = cc->EvalFastRotationPrecompute(ct1);
+  auto m = cc->GetCyclotomicOrder();
+
+  std::vector<std::pair<std::string, double>> costs = {
+    {"rotate", time_op(n_reps, [&]{ cc->EvalRotate(ct1, -1); })},
+    {"precompute", time_op(n_reps, [&]{ cc->EvalFastRotationPrecompute(ct1); })},
+    {"fast_rotate", time_op(n_reps, [&]{ cc->EvalFastRotation(ct1, -1, m, digits); })},
+    {"mult", time_op(n_reps, [&]{ cc->EvalMult(ct1, ct2); })},
+    {"mult_norelin", time_op(n_reps, [&]{ cc->EvalMultNoRelin(ct1, ct2); })},
+    {"relin", time_op(n_reps, [&]{ cc->Relinearize(product); })},
+    {"mult_plain", time_op(n_reps, [&]{ cc->EvalMult(ct1, pt); })},
+    {"add", time_op(n_reps, [&]{ cc->EvalAdd(ct1, ct2); })},
+    {"rotation_key", time_op(n_reps, [&]{  // leaves the key of -1 in place
+      cc->ClearEvalAutomorphismKeys();
+      cc->EvalAtIndexKeyGen(keys.secretKey, {-1});
+      std::stringstream ss;
+      cc->SerializeEvalAutomorphismKey(ss, SerType::BINARY);
+      cc->ClearEvalAutomorphismKeys();
+      cc->DeserializeEvalAutomorphismKey(ss, SerType::BINARY);
+    })},
+  };
+
+  // The size of one serialized rotation key
+  std::stringstream key_ss;
+  cc->SerializeEvalAutomorphismKey(key_ss, SerType::BINARY);
+
+  std::cout << "{\n";
+  std::cout << "  \"ring_dim\": " << cc->GetRingDimension() << ",\n";
+  std::cout << "  \"levels\": " << MULT_DEPTH << ",\n";
+  std::cout << "  \"rotation_key_bytes\": " << key_ss.str().size() << ",\n";
+  std::cout << "  \"seconds\": {\n";
+  for (size_t i = 0; i < costs.size(); i++) {
+    std::cout << "    \"" << costs[i].first << "\": " << costs[i].second
+              << (i + 1 < costs.size()? ",\n" : "\n");
+  }
+  std::cout << "  }\n}\n";
+  return 0;
+}
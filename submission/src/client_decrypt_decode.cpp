@@ -30,11 +30,11 @@ int main(int argc, char* argv[]) {
     return 0;
   }
   auto size = static_cast<InstanceSize>(std::stoi(argv[1]));
-  InstanceParams prms(size);
+  InstanceParams prms(size, fs::current_path(), query_dir_arg(argc, argv));
 
   // Read the encrypted answer from disk
   Ciphertext<DCRTPoly> eres;
-  auto res_file = prms.downdir()/"results.bin";
+  auto res_file = prms.qrydowndir()/"results.bin";
   if (!Serial::DeserializeFromFile(res_file, eres, SerType::BINARY)) {
     throw std::runtime_error("failed to read answer from "+res_file.string());
   }
@@ -45,7 +45,7 @@ int main(int argc, char* argv[]) {
   sk->GetCryptoContext()->Decrypt(sk, eres, &pt);  // Decrypt
   auto slots = pt->GetRealPackedValue();           // Decode to slots
 
-  write2disk<double>(prms.iodir()/"raw-result.bin",{slots});  // write to disk
+  write2disk<double>(prms.qryiodir()/"raw-result.bin",{slots});  // write to disk
   return 0;
 }
 
@@ -7,6 +7,8 @@
 // See the file LICENSE.md for details.
 //============================================================================
 #include <cassert>
+#include <algorithm>
+#include <set>
 
 #include "openfhe.h"
 // header files needed for de/serialization
@@ -17,25 +19,78 @@
 
 #include "params.h"
 #include "utils.h"
+#include "packed_store.h"
+#include "db_manifest.h"
 
 using namespace lbcrypto;
 
+// The matrix rows will be multiplied by replicated cipehrtexts at level
+// at least degrees.size()-1, so encrypt them at that level to save space
+int row_level(const InstanceParams& prms) { return prms.getDegrees().size() - 1; }
+
+// encrypt the batch-payload and store to disk at a low level.
+constexpr int PAYLOAD_LEVEL = 20;
+
 // Read public encryption key from disk
 PublicKey<DCRTPoly> read_keys(InstanceParams prms);
+
+// The name of a ciphertext file relative to the upload directory,
+// batchNNNN/<prefix>MMMM.bin
+fs::path db_file_name(int batch, const std::string& prefix, int idx);
+
 void add_markers(std::vector<std::vector<int16_t>>& payloads);
 
+// Encode the payload records in slots: add the markers, transpose them to
+// column-major order and scale them down by PAYLOAD_PRECISION
+std::vector<std::vector<std::vector<double>>> encode_payloads(
+    std::vector<std::vector<int16_t>>& payloads, size_t n_slots);
+
+// Encrypt a vector of slots at the given level
+Ciphertext<DCRTPoly> encrypt_slots(const PublicKey<DCRTPoly>& pk,
+                                   const std::vector<double>& slots, int level);
+
+// Encrypt the (encoded) rows and payloads of one batch, and write them to
+// row_MMMM.bin and payload_MMMM.bin files in dir
+void encrypt_batch(const PublicKey<DCRTPoly>& pk, const InstanceParams& prms,
+                   const std::vector<std::vector<double>>& rows,
+                   const std::vector<std::vector<double>>& payloads,
+                   const fs::path& dir);
+
+// Re-encrypt only the batches that hold the records listed in the file
+// db_updates.txt in the dataset directory (after these records were
+// appended, modified or deleted in the dataset), see db_manifest.h
+void update_db(const PublicKey<DCRTPoly>& pk, const InstanceParams& prms);
+
 int main(int argc, char* argv[]) {
   if (argc < 2) {
-    std::cout << "Usage: " << argv[0] << " instance-size\n";
+    std::cout << "Usage: " << argv[0] << " instance-size [--packed_db | --update]\n";
     std::cout << "  Instance-size: 0-TOY, 1-SMALL, 2-MEDIUM, 3-LARGE\n";
     return 0;
   }
   auto size = static_cast<InstanceSize>(std::stoi(argv[1]));
   InstanceParams prms(size);
 
+  // With --packed_db, store the ciphertexts in a few large segment files
+  // rather than one file per ciphertext (see packed_store.h). With --update,
+  // re-encrypt only the changed batches of an existing encrypted dataset.
+  bool packed = false;
+  bool update = false;
+  for (int i = 2; i < argc; i++) {
+    if (std::string(argv[i]) == "--packed_db") {
+      packed = true;
+    } else if (std::string(argv[i]) == "--update") {
+      update = true;
+    }
+  }
+
   // Read the keys from storage
   auto pk = read_keys(prms);
 
+  if (update) {
+    update_db(pk, prms);
+    return 0;
+  }
+
   // Read the dataset matrix from storage
   auto db = read2vecs<float>(prms.datadir()/"db.bin", prms.getRecordDim());
   assert(int(db.size())==prms.getDbSize());
@@ -49,60 +104,42 @@ int main(int argc, char* argv[]) {
   std::vector<std::vector<int16_t>> payloads =
         read2vecs<int16_t>(payload_fname, PAYLOAD_DIM-1);
   assert(db.size() == payloads.size());
+  auto encoded_payloads = encode_payloads(payloads, prms.getNSlots());
 
-  // Add a marker at the beginning of each payload record, with value
-  // equals to 2*MAX_PAYLOAD_VAL*PAYLOAD_PRECISION
-  add_markers(payloads);
-
-  // Encode the payloads in slots in column-major order
-  auto encoded_payloads=transpose_matrix<int16_t>(payloads, prms.getNSlots());
+  // encrypt the batch-matrices and store to disk. This is a new initial
+  // database, so drop the manifest of earlier updates (if any).
+  fs::create_directories(prms.updir());
+  fs::remove(prms.updir() / MANIFEST_NAME);
 
-  // scale payloads down by PAYLOAD_PRECISION
-  for (auto& mat: encoded_payloads) for (auto& v: mat) for (auto& x: v) {
-    x /= PAYLOAD_PRECISION;
-  }
-
-  // encrypt the batch-matrices and store to disk
-
-  // The matrix rows will be multiplied by replicated cipehrtexts at level
-  // at least degrees.size()-1, so encrypt them at that level to save space
-  int encryption_level1 = prms.getDegrees().size() - 1;
-
-  // encrypt the batch-payload and store to disk at a low level.
-  int encryption_level2 = 20;
-
-  auto cc = pk->GetCryptoContext();
-  for (int i = 0; i < prms.getNCtxts(); i++) {  // go over the batches
-    std::stringstream ssi;
-    ssi << std::setw(4) << std::setfill('0') << i;
-    auto dir = prms.updir() / ("batch" + ssi.str());
-    // Create the batch directory and any parent directory as needed
-    std::filesystem::create_directories(dir);
-
-    // encrypt vectors in this batch
-    for (auto j = 0; j < prms.getRecordDim(); j++) {
-      auto pt = cc->MakeCKKSPackedPlaintext(encoded_dataset[i][j], 1,
-                                            encryption_level1);
-      auto ct = cc->Encrypt(pk, pt);
-      std::stringstream ssj;
-      ssj << std::setw(4) << std::setfill('0') << j;
-      auto ct_fname = dir / ("row_" + ssj.str() + ".bin");
-      if (!Serial::SerializeToFile(ct_fname, ct, SerType::BINARY)) {
-        throw std::runtime_error("failed to write file " + ct_fname.string());
+  if (packed) {
+    // Write the ciphertexts in the order that the server reads them: row j
+    // of all the batches, then row j+1 of all the batches, etc., and then
+    // the payloads in the same order.
+    PackedWriter writer(prms.updir());
+    auto add = [&writer](const std::string& name, Ciphertext<DCRTPoly> ct) {
+      std::ostringstream buf;
+      Serial::Serialize(ct, buf, SerType::BINARY);
+      writer.add(name, buf.str());
+    };
+    for (int j = 0; j < prms.getRecordDim(); j++) {
+      for (int i = 0; i < prms.getNCtxts(); i++) {
+        add(db_file_name(i, "row_", j),
+            encrypt_slots(pk, encoded_dataset[i][j], row_level(prms)));
       }
     }
-    // encrypt payloads in this batch
     for (size_t j = 0; j < PAYLOAD_DIM; j++) {
-      auto pt = cc->MakeCKKSPackedPlaintext(encoded_payloads[i][j], 1,
-                                            encryption_level2);
-      auto ct = cc->Encrypt(pk, pt);
-      std::stringstream ssj;
-      ssj << std::setw(4) << std::setfill('0') << j;
-      auto ct_fname = dir / ("payload_" + ssj.str() + ".bin");
-      if (!Serial::SerializeToFile(ct_fname, ct, SerType::BINARY)) {
-        throw std::runtime_error("failed to write file " + ct_fname.string());
+      for (int i = 0; i < prms.getNCtxts(); i++) {
+        add(db_file_name(i, "payload_", j),
+            encrypt_slots(pk, encoded_payloads[i][j], PAYLOAD_LEVEL));
       }
     }
+    writer.close();
+    return 0;
+  }
+
+  for (int i = 0; i < prms.getNCtxts(); i++) {  // go over the batches
+    encrypt_batch(pk, prms, encoded_dataset[i], encoded_payloads[i],
+                  prms.updir() / batch_dir_name(i));
   }
   return 0;
 }
@@ -131,4 +168,138 @@ void add_markers(std::vector<std::vector<int16_t>>& payloads)
     for (auto& p: payloads) {
         p.insert(p.begin(), 2*MAX_PAYLOAD_VAL*PAYLOAD_PRECISION);
     }
-}
\ No newline at end of file
+}
+
+// The name of a ciphertext file relative to the upload directory,
+// batchNNNN/<prefix>MMMM.bin
+fs::path db_file_name(int batch, const std::string& prefix, int idx)
+{
+  return fs::path(batch_dir_name(batch)) / ct_file_name(prefix, idx);
+}
+
+// Encode the payload records in slots
+std::vector<std::vector<std::vector<double>>> encode_payloads(
+    std::vector<std::vector<int16_t>>& payloads, size_t n_slots)
+{
+  // Add a marker at the beginning of each payload record, with value
+  // equals to 2*MAX_PAYLOAD_VAL*PAYLOAD_PRECISION
+  add_markers(payloads);
+
+  // Encode the payloads in slots in column-major order
+  auto encoded_payloads = transpose_matrix<int16_t>(payloads, n_slots);
+
+  // scale payloads down by PAYLOAD_PRECISION
+  for (auto& mat: encoded_payloads) for (auto& v: mat) for (auto& x: v) {
+    x /= PAYLOAD_PRECISION;
+  }
+  return encoded_payloads;
+}
+
+// Encrypt a vector of slots at the given level
+Ciphertext<DCRTPoly> encrypt_slots(const PublicKey<DCRTPoly>& pk,
+                                   const std::vector<double>& slots, int level)
+{
+  auto cc = pk->GetCryptoContext();
+  auto pt = cc->MakeCKKSPackedPlaintext(slots, 1, level);
+  return cc->Encrypt(pk, pt);
+}
+
+// Encrypt one batch and write its ciphertexts to files in dir
+void encrypt_batch(const PublicKey<DCRTPoly>& pk, const InstanceParams& prms,
+                   const std::vector<std::vector<double>>& rows,
+                   const std::vector<std::vector<double>>& payloads,
+                   const fs::path& dir)
+{
+  // Create the batch directory and any parent directory as needed
+  fs::create_directories(dir);
+
+  // encrypt vectors in this batch
+  for (size_t j = 0; j < rows.size(); j++) {
+    auto ct_fname = dir / ct_file_name("row_", j);
+    auto ct = encrypt_slots(pk, rows[j], row_level(prms));
+    if (!Serial::SerializeToFile(ct_fname, ct, SerType::BINARY)) {
+      throw std::runtime_error("failed to write file " + ct_fname.string());
+    }
+  }
+  // encrypt payloads in this batch
+  for (size_t j = 0; j < payloads.size(); j++) {
+    auto ct_fname = dir / ct_file_name("payload_", j);
+    auto ct = encrypt_slots(pk, payloads[j], PAYLOAD_LEVEL);
+    if (!Serial::SerializeToFile(ct_fname, ct, SerType::BINARY)) {
+      throw std::runtime_error("failed to write file " + ct_fname.string());
+    }
+  }
+}
+
+// Re-encrypt the batches with changed records. The dataset files already
+// include the changes: appended records at the end (possibly in new
+// batches), and deleted records as tombstones (all-zero rows, which never
+// match a query). Each changed batch is written to a new directory, then
+// the manifest is replaced to point to these directories.
+void update_db(const PublicKey<DCRTPoly>& pk, const InstanceParams& prms)
+{
+  size_t n_slots = prms.getNSlots();
+  auto old = DbManifest::read(prms.updir(), prms.getDbSize(), n_slots);
+
+  auto db_fname = prms.datadir()/"db.bin";
+  auto payload_fname = prms.datadir()/"payloads.bin";
+  uint64_t n_records =
+      fs::file_size(db_fname) / (prms.getRecordDim() * sizeof(float));
+  if (fs::file_size(payload_fname) != n_records * (PAYLOAD_DIM-1) * sizeof(int16_t)) {
+    throw std::runtime_error("db.bin and payloads.bin have different sizes");
+  }
+  if (n_records < old.n_records) {
+    throw std::runtime_error("records cannot be removed from the dataset, "
+                             "only replaced by tombstones");
+  }
+
+  // The unchanged batches stay where they are
+  auto manifest = DbManifest::initial(n_records, n_slots);
+  manifest.version = old.version + 1;
+  std::copy(old.batch_dirs.begin(), old.batch_dirs.end(),
+            manifest.batch_dirs.begin());
+
+  // The batches of the changed records, and all the new batches
+  std::set<size_t> batches;
+  auto updates_fname = prms.datadir()/"db_updates.txt";
+  std::ifstream updates(updates_fname);
+  if (!updates.is_open()) {
+    throw std::runtime_error("Cannot open " + updates_fname.string() + " for read");
+  }
+  for (uint64_t idx; updates >> idx; ) {
+    if (idx >= n_records) {
+      throw std::runtime_error("updated record " + std::to_string(idx)
+                               + " is not in the dataset");
+    }
+    batches.insert(idx / n_slots);
+  }
+  for (size_t b = old.n_batches(); b < manifest.n_batches(); b++) {
+    batches.insert(b);
+  }
+
+  for (auto b : batches) {
+    size_t start = b * n_slots;
+    size_t count = std::min<uint64_t>(n_slots, n_records - start);
+    auto rows = read_records<float>(db_fname, prms.getRecordDim(), start, count);
+    auto payloads = read_records<int16_t>(payload_fname, PAYLOAD_DIM-1, start, count);
+
+    manifest.batch_dirs[b] =
+        batch_dir_name(b) + ".v" + std::to_string(manifest.version);
+    auto dir = prms.updir() / manifest.batch_dirs[b];
+    fs::remove_all(dir);  // left over from an update that failed
+    encrypt_batch(pk, prms, transpose_matrix<float>(rows, n_slots)[0],
+                  encode_payloads(payloads, n_slots)[0], dir);
+  }
+  manifest.write(prms.updir());
+
+  // Remove the batch directories that neither this version nor the
+  // previous one uses, no computation should be using them anymore
+  std::set<std::string> keep(manifest.batch_dirs.begin(), manifest.batch_dirs.end());
+  keep.insert(old.batch_dirs.begin(), old.batch_dirs.end());
+  for (auto& entry : fs::directory_iterator(prms.updir())) {
+    auto name = entry.path().filename().string();
+    if (entry.is_directory() && name.rfind("batch", 0) == 0 && !keep.count(name)) {
+      fs::remove_all(entry.path());
+    }
+  }
+}
@@ -30,14 +30,14 @@ int main(int argc, char* argv[]) {
     return 0;
   }
   auto size = static_cast<InstanceSize>(std::stoi(argv[1]));
-  InstanceParams prms(size);
+  InstanceParams prms(size, fs::current_path(), query_dir_arg(argc, argv));
 
   // Read the keys from storage
   auto pk = read_keys(prms);
   auto cc = pk->GetCryptoContext();
 
   // Read the query vector from disk
-  auto qs = read2vecs<float>(prms.datadir()/"query.bin", prms.getRecordDim());
+  auto qs = read2vecs<float>(prms.qrydatadir()/"query.bin", prms.getRecordDim());
   assert(qs.size()==1);
   auto qry = qs[0];
 
@@ -48,7 +48,8 @@ int main(int argc, char* argv[]) {
   }
   auto pt = cc->MakeCKKSPackedPlaintext(slots);
   auto eqry = cc->Encrypt(pk, pt);  // the encrypted query vector at top level
-  auto q_file = prms.updir()/"query.bin";
+  fs::create_directories(prms.qryupdir());
+  auto q_file = prms.qryupdir()/"query.bin";
   if (!Serial::SerializeToFile(q_file, eqry, SerType::BINARY)) {
       throw std::runtime_error("failed to write query to "+q_file.string());
   }
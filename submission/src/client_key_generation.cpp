@@ -68,7 +68,7 @@ KeyPair<DCRTPoly> key_gen(const InstanceParams& prms, bool count_only)
   CCParams<CryptoContextCKKSRNS> cParams;
   cParams.SetSecretKeyDist(UNIFORM_TERNARY);
   cParams.SetKeySwitchTechnique(HYBRID);
-  cParams.SetMultiplicativeDepth(23);
+  cParams.SetMultiplicativeDepth(MULT_DEPTH);
   if (prms.getSize()==InstanceSize::TOY) {
     cParams.SetSecurityLevel(HEStd_NotSet);
     cParams.SetRingDim(1 << 10);
@@ -101,7 +101,7 @@ KeyPair<DCRTPoly> key_gen(const InstanceParams& prms, bool count_only)
       shifts[i - 1] = -i * prms.getNCols();
     }
     auto shifts2 = RunningSums::get_shift_amounts(
-      prms.getNSlots(), prms.getNCols(), RUNNING_SUM_LEVELS);
+      prms.getNSlots(), prms.getNCols(), prms.getRunningSumLevels());
     std::vector<std::vector<int>> all_shifts = {rots4reps, shifts, shifts2};
     cc->EvalAtIndexKeyGen(keyPair.secretKey, vector_union(all_shifts));
     cc->EvalSumRowsKeyGen(keyPair.secretKey, keyPair.publicKey,
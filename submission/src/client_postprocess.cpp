@@ -22,21 +22,21 @@ int main(int argc, char* argv[]) {
     return 0;
   }
   auto size = static_cast<InstanceSize>(std::stoi(argv[1]));
-  InstanceParams prms(size);
+  InstanceParams prms(size, fs::current_path(), query_dir_arg(argc, argv));
 
   bool count_only = (argc > 2 && std::string(argv[2])=="--count_only");
 
   // Read the raw result slots from disk
-  auto vs = read2vecs<double>(prms.iodir()/"raw-result.bin",prms.getNSlots());
+  auto vs = read2vecs<double>(prms.qryiodir()/"raw-result.bin",prms.getNSlots());
   assert(vs.size()==1);
   auto slots = vs[0];
 
   if (count_only) {  // Write a single integer containing the sum
     long count = std::round(slots[0]);
-    write2disk<long>(prms.iodir()/"results.bin", {{count}});
+    write2disk<long>(prms.qryiodir()/"results.bin", {{count}});
   } else {  // Decode the raw results to a list of playloads
     auto res = decode_results(slots, prms.getNCols());
-    write2disk<int16_t>(prms.iodir()/"results.bin", res);
+    write2disk<int16_t>(prms.qryiodir()/"results.bin", res);
   }
   return 0;
 }
@@ -7,6 +7,10 @@
 // See the file LICENSE.md for details.
 //============================================================================
 #include <cassert>
+#include <thread>
+#include <algorithm>
+#include <unordered_map>
+#include <memory>
 
 #include "openfhe.h"
 #include "cryptocontext-ser.h"  // header files needed for (de)serialization
@@ -18,6 +22,10 @@
 #include "utils.h"
 #include "slot_replication.h"
 #include "running_sums.h"
+#include "prefetch.h"
+#include "ct_cache.h"
+#include "packed_store.h"
+#include "db_manifest.h"
 
 using namespace lbcrypto;
 
@@ -26,11 +34,59 @@ using namespace lbcrypto;
 PrivateKey<DCRTPoly> sk;
 #endif
 
+// The encrypted dataset, when it is kept in memory by a daemon server
+// (see run_daemon below), indexed by the ciphertext file names
+std::unordered_map<std::string, Ciphertext<DCRTPoly>> resident_cts;
+
+// How many ciphertexts of the encrypted dataset to read ahead of their use
+// in the matrix-vector product (0 to read them synchronously), and how many
+// threads read them. The depth can be set with --prefetch <depth>.
+size_t prefetch_depth = 8;
+constexpr size_t PREFETCH_READERS = 2;
+
+// The payload ciphertexts are used once per match index in the output
+// compression, they are cached (up to a budget) so they are read from disk
+// only once. The cache persists across requests in daemon mode. The budget
+// in MB can be set with --payload_cache <MB>, 0 disables the cache.
+constexpr uint64_t MB = 1 << 20;
+ScanCache<Ciphertext<DCRTPoly>> payload_cache(1024 * MB);
+
+// The time that the matrix-vector product spent waiting for ciphertexts to
+// be read, and the rest of its time (computing), for the server report
+struct MatVecTimes {
+  double io_wait = 0.0;
+  double compute = 0.0;
+};
+
+// The encrypted dataset, if it was written in the packed format (see
+// packed_store.h) rather than as separate files
+std::unique_ptr<PackedStore> packed_db;
+
+// The version of the encrypted dataset (see db_manifest.h) that the last
+// computation used. When an update replaces it, the payload cache and the
+// resident ciphertexts are refreshed before the next computation.
+uint64_t db_version = 0;
+
 // A utility function to get one encrypted ciphertext from the dataset. This
-// implementation assumes that ciphertexts are just separate files on disk,
-// it should be re-written if they are streamed from a remote location.
+// implementation assumes that ciphertexts are just separate files on disk
+// (unless they are resident in memory, or records of a packed store that
+// are deserialized from its memory-mapped segments), it should be
+// re-written if they are streamed from a remote location.
 inline Ciphertext<DCRTPoly> get_ctxt(fs::path ct_name) {
+  if (!resident_cts.empty()) {
+    auto it = resident_cts.find(ct_name.string());
+    if (it != resident_cts.end()) {
+      return it->second;
+    }
+  }
   Ciphertext<DCRTPoly> ct;
+  PackedStore::Record rec;
+  if (packed_db && packed_db->find(ct_name.string(), rec)) {
+    MemoryBuf buf(rec.data, rec.length);
+    std::istream stream(&buf);
+    Serial::Deserialize(ct, stream, SerType::BINARY);
+    return ct;
+  }
   if (!Serial::DeserializeFromFile(ct_name, ct, SerType::BINARY)) {
     throw std::runtime_error("failed to read ciphertext from " + ct_name.string());
   }
@@ -48,10 +104,15 @@ void log_step(int num, std::string name) {
 }
 
 // Matrix-vector product: The matrix rows are stored on disk in batches
-// under iodir/<size>/encrypted/batchNNNN/. The query ciphertext contains
-// the query vector, repeatd to fill in all the slots.
-std::vector<Ciphertext<DCRTPoly>> mat_vec_mult(fs::path encdir,
-                Ciphertext<DCRTPoly> qry, const InstanceParams& prms);
+// under iodir/<size>/encrypted/batchNNNN/. Each query ciphertext contains
+// a query vector, repeatd to fill in all the slots. Every row ciphertext
+// is read once and multiplied by all the queries, the result is a vector
+// of ciphertexts for each query. The rows are read ahead of their use by a
+// Prefetcher, the time spent waiting for them is reported in times.
+std::vector<std::vector<Ciphertext<DCRTPoly>>> mat_vec_mult(fs::path encdir,
+    const DbManifest& manifest,
+    const std::vector<Ciphertext<DCRTPoly>>& qrys, const InstanceParams& prms,
+    MatVecTimes& times);
 
 // Compare each slot in the ctxts to the threshold, using a Chebyshev
 // approximation of the indicator function chi(x) = (x >= threshold).
@@ -67,10 +128,9 @@ void compare_to_threshold(std::vector<Ciphertext<DCRTPoly>>& ctxts,
 std::vector<Ciphertext<DCRTPoly>> compare_to_number(
     const std::vector<Ciphertext<DCRTPoly>>& ctxts, double number);
 
-// Read from disk the ith payload value of all the records, namely the
-// i'th row of the payload matrix.
-Ciphertext<DCRTPoly> get_encrypted_payload(fs::path datadir, size_t batch,
-                                            size_t idx);
+// Read from disk the ith payload value of all the records in a batch,
+// namely the i'th row of the payload matrix, from the batch directory
+Ciphertext<DCRTPoly> get_encrypted_payload(fs::path batch_dir, size_t idx);
 
 // A SIMD-optimized procedure for computing total sums. The slots are viewed
 // as a matrix, and total sums are computed in each column separately.
@@ -79,6 +139,31 @@ Ciphertext<DCRTPoly> get_encrypted_payload(fs::path datadir, size_t batch,
 Ciphertext<DCRTPoly> total_sums(
   const Ciphertext<DCRTPoly>& ct, const InstanceParams& prms);
 
+// Store the result ciphertext of every query in its query directory, along
+// with the server-side time (of the entire batch)
+void store_results(const std::vector<InstanceParams>& qry_prms,
+                   const std::vector<Ciphertext<DCRTPoly>>& results,
+                   std::chrono::system_clock::time_point start_computing,
+                   std::chrono::system_clock::time_point start_server,
+                   const MatVecTimes& times, const DbManifest& manifest);
+
+// Read the crypto context, public key and evaluation keys from disk
+CryptoContext<DCRTPoly> load_keys(const InstanceParams& prms);
+
+// Read all the ciphertexts of a version of the encrypted dataset into
+// memory, keeping those of the unchanged batches that are already there
+void load_resident_db(const InstanceParams& prms, const DbManifest& manifest);
+
+// The computation for a batch of queries, from reading the encrypted
+// queries to storing the encrypted results
+void compute_queries(CryptoContext<DCRTPoly> cc,
+                     const std::vector<InstanceParams>& qry_prms, bool count_only,
+                     std::chrono::system_clock::time_point start_server);
+
+// Run as a daemon that loads the keys once and serves many requests
+int run_daemon(InstanceSize size, bool count_only, fs::path spool_dir,
+               bool resident_db);
+
 #ifdef DEBUG
 static void printCts(
   const std::vector<Ciphertext<DCRTPoly>>& cts, std::string label)
@@ -100,19 +185,59 @@ static void printCts(
 /*******************************************************************/
 int main(int argc, char* argv[]) {
   if (argc < 2 || !std::isdigit(argv[1][0])) {
-    std::cout << "Usage: " << argv[0] << " instance-size [--count_only]\n";
+    std::cout << "Usage: " << argv[0] << " instance-size [--count_only]"
+              << " [--query_dir dir]* [--prefetch depth] [--payload_cache MB]"
+              << " [--daemon spool-dir [--resident_db]]\n";
     std::cout << "  Instance-size: 0-TOY, 1-SMALL, 2-MEDIUM, 3-LARGE\n";
     return 0;
   }
   auto size = static_cast<InstanceSize>(std::stoi(argv[1]));
   bool count_only = (argc > 2 && std::string(argv[2])=="--count_only");
 
-  InstanceParams prms(size);
-  constexpr double threshold = 0.8;
-  auto timing_fname = prms.iodir()/"server_reported_steps.json";
+  // With --daemon, keep running and serve the requests in the spool dir
+  // (the --prefetch depth and --payload_cache budget are parsed here too)
+  fs::path spool_dir;
+  bool resident_db = false;
+  for (int i = 2; i < argc; i++) {
+    if (std::string(argv[i]) == "--daemon" && i + 1 < argc) {
+      spool_dir = argv[++i];
+    } else if (std::string(argv[i]) == "--resident_db") {
+      resident_db = true;
+    } else if (std::string(argv[i]) == "--prefetch" && i + 1 < argc) {
+      prefetch_depth = std::stoul(argv[++i]);
+    } else if (std::string(argv[i]) == "--payload_cache" && i + 1 < argc) {
+      payload_cache.set_budget(std::stoull(argv[++i]) * MB);
+    }
+  }
+  if (!spool_dir.empty()) {
+    return run_daemon(size, count_only, spool_dir, resident_db);
+  }
+
+  // With several --query_dir arguments the server processes a batch of
+  // queries together, reading the encrypted dataset only once for all of
+  // them. Each query has its own directory for the per-query files.
+  std::vector<InstanceParams> qry_prms;
+  for (auto& dir : query_dirs_arg(argc, argv)) {
+    qry_prms.emplace_back(size, fs::current_path(), dir);
+  }
   auto start_server = std::chrono::system_clock::now();
-  std::filesystem::create_directories(prms.downdir());
+  auto cc = load_keys(qry_prms[0]);
+  if (PackedStore::exists(qry_prms[0].updir())) {
+    packed_db = std::make_unique<PackedStore>(qry_prms[0].updir());
+  }
+  log_step(0, "Loading keys");
+
+  compute_queries(cc, qry_prms, count_only, start_server);
+  return 0;
+}
+/*******************************************************************/
+/*******************************************************************/
 
+
+/*******************************************************************/
+// Read the crypto context, public key and evaluation keys from disk
+CryptoContext<DCRTPoly> load_keys(const InstanceParams& prms)
+{
   // Read the crypto context and the public key from disk
   CryptoContext<DCRTPoly> cc;
   if (!Serial::DeserializeFromFile(prms.keydir()/"cc.bin", cc, SerType::BINARY)) {
@@ -141,21 +266,51 @@ int main(int argc, char* argv[]) {
     throw std::runtime_error(
       "Failed to get rotation keys from " +prms.keydir().string());
   }
+  return cc;
+}
 
-  // Read the query vector from disk
-  auto q_fname = prms.updir()/"query.bin";
-  Ciphertext<DCRTPoly> eqry;
-  if (!Serial::DeserializeFromFile(q_fname,eqry,SerType::BINARY)){
-    throw std::runtime_error(
-      "failed to read query ciphertext from " + q_fname.string());
+/*******************************************************************/
+// The computation for a batch of queries, with the per-query files in the
+// directories of qry_prms. The results and the server-side times are stored
+// in these directories.
+void compute_queries(CryptoContext<DCRTPoly> cc,
+                     const std::vector<InstanceParams>& qry_prms, bool count_only,
+                     std::chrono::system_clock::time_point start_server)
+{
+  const InstanceParams& prms = qry_prms[0];
+  constexpr double threshold = 0.8;
+
+  // The whole computation uses the version of the encrypted dataset that
+  // is current when it starts. If an update replaced the previous version,
+  // drop the cached ciphertexts of the batches that it replaced.
+  auto manifest = DbManifest::read(prms.updir(), prms.getDbSize(), prms.getNSlots());
+  if (manifest.version != db_version) {
+    payload_cache.clear();
+    if (!resident_cts.empty()) {
+      load_resident_db(prms, manifest);
+    }
+    db_version = manifest.version;
+  }
+  payload_cache.reset_counters();  // report the payload reads of this batch
+  for (auto& qp : qry_prms) {
+    std::filesystem::create_directories(qp.qrydowndir());
   }
-  log_step(0, "Loading keys");
 
+  // Read the query vectors from disk
+  std::vector<Ciphertext<DCRTPoly>> eqrys(qry_prms.size());
+  for (size_t q = 0; q < qry_prms.size(); q++) {
+    auto q_fname = qry_prms[q].qryupdir()/"query.bin";
+    if (!Serial::DeserializeFromFile(q_fname,eqrys[q],SerType::BINARY)){
+      throw std::runtime_error(
+        "failed to read query ciphertext from " + q_fname.string());
+    }
+  }
   auto start_computing = std::chrono::system_clock::now();
 
   // Matrix-vector multiplication, reading the encrypted matrix one
-  // ciphertexe at a time from updir
-  auto result = mat_vec_mult(prms.updir(), eqry, prms);
+  // ciphertexe at a time from updir (for all the queries in the batch)
+  MatVecTimes times;
+  auto results = mat_vec_mult(prms.updir(), manifest, eqrys, prms, times);
   log_step(1, "Matrix-vector product");
 
   // Compare each slot in the results ctxts to the threshold, using a
@@ -168,43 +323,30 @@ int main(int argc, char* argv[]) {
   // them). Also, we scale it to 0/0.5 rather than 0/1, since we sum up upto
   // eight matches, then multiply by the original thing, and need to fit the
   // result to a size-2 interval that can be shifted to the interval [-1,1].
-  compare_to_threshold(result, threshold, count_only);
+  for (auto& result : results) {
+    compare_to_threshold(result, threshold, count_only);
+  }
   log_step(2, "Compare to threshold");
 #ifdef DEBUG
-    printCts(result, " match vector:");
+    printCts(results[0], " match vector:");
 #endif
 
   // If we only want to count matches, return the total sum
   // of all the slots in all the ciphertexts.
   if (count_only) {
-    for (size_t i=1; i<result.size(); i++) {
-      cc->EvalAddInPlace(result[0], result[i]);
+    std::vector<Ciphertext<DCRTPoly>> sums;
+    for (auto& result : results) {
+      for (size_t i=1; i<result.size(); i++) {
+        cc->EvalAddInPlace(result[0], result[i]);
+      }
+      sums.push_back(cc->EvalSum(result[0], prms.getNSlots()));
     }
-    result[0] = cc->EvalSum(result[0], prms.getNSlots());
     log_step(3, "Summation");
 #ifdef DEBUG
-    printCts({result[0]}, " summed match vector:");
+    printCts({sums[0]}, " summed match vector:");
 #endif
-    auto now = std::chrono::system_clock::now();
-    int64_t comp_s = std::chrono::duration_cast<std::chrono::seconds>(
-      now - start_computing).count();
-    int64_t total_s = std::chrono::duration_cast<std::chrono::seconds>(
-      now - start_server).count();
-    store_server_time(timing_fname, comp_s, total_s);
-
-    std::string out_fname = prms.downdir()/"results.bin";
-    if (!Serial::SerializeToFile(out_fname, result[0], SerType::BINARY)) {
-      throw std::runtime_error("Failed to write ciphertext to " + out_fname);
-    }
-    return 0;
-  }
-
-  // Make a deep copy of the matches, it will be multiplied back into the
-  // result after the running-sum procedure
-  std::vector<Ciphertext<DCRTPoly>> matches;
-  matches.reserve(result.size());
-  for (auto& ct : result) {
-    matches.push_back(ct->Clone());
+    store_results(qry_prms, sums, start_computing, start_server, times, manifest);
+    return;
   }
 
   // The "compaction" procedure views the matches vector (made of multiple
@@ -222,19 +364,27 @@ int main(int argc, char* argv[]) {
 
   // Running sums in each column, so the first match will have value 1,
   // the second match will have 2, etc.
-  RunningSums rs(cc,prms.getNCols(),RUNNING_SUM_LEVELS,result[0]->GetLevel());
-  rs.eval_in_place(result);  // The actual running-sums procedure
+  RunningSums rs(cc,prms.getNCols(),prms.getRunningSumLevels(),results[0][0]->GetLevel());
+  for (auto& result : results) {
+    // Make a deep copy of the matches, it will be multiplied back into the
+    // result after the running-sum procedure
+    std::vector<Ciphertext<DCRTPoly>> matches;
+    matches.reserve(result.size());
+    for (auto& ct : result) {
+      matches.push_back(ct->Clone());
+    }
 
-  // Multiply by the matches vector, to zero out all the non-matches
-  for (size_t i = 0; i < result.size(); i++) {
-    result[i] = cc->EvalMult(result[i], matches[i]);
-  }
-  matches.clear();          // not needed anymore
-  matches.shrink_to_fit();  // release the memory
+    rs.eval_in_place(result);  // The actual running-sums procedure
 
-  // Contents of slots are now in the range [0,2], shift them to [-1,1]
-  for (auto& ct : result) {
-    cc->EvalSubInPlace(ct, 1.0);
+    // Multiply by the matches vector, to zero out all the non-matches
+    for (size_t i = 0; i < result.size(); i++) {
+      result[i] = cc->EvalMult(result[i], matches[i]);
+    }
+
+    // Contents of slots are now in the range [0,2], shift them to [-1,1]
+    for (auto& ct : result) {
+      cc->EvalSubInPlace(ct, 1.0);
+    }
   }
   log_step(3, "Running sums");
 
@@ -269,37 +419,47 @@ int main(int argc, char* argv[]) {
   //   {i*PAYLOAD_DIM,...,(i+1)*PAYLOAD_DIM-1} in each column and zero
   //   elsewhere.
 
-  Ciphertext<DCRTPoly> accumulator;
+  // With a batch of queries, all the queries go through each iteration
+  // together, so every payload ciphertext is read from disk once per
+  // iteration and multiplied by the indicators of all the queries.
+
+  size_t n_qrys = results.size();
+  std::vector<Ciphertext<DCRTPoly>> accumulators(n_qrys);
   for (int i = 1; i <= prms.getMaxNMatch(); i++) {  // extract i'th match
     double x_i = i / 4.0 - 1.0;  // map from {0,8} to the interval [-1,1]
-    auto indicator = compare_to_number(result, x_i);
+    std::vector<std::vector<Ciphertext<DCRTPoly>>> indicators;
+    for (auto& result : results) {
+      indicators.push_back(compare_to_number(result, x_i));
+    }
 
-    // Indicator has as many ciphertexe as it takes to store a row of the keys
-    // matrix (i.e., one slot for each dataset recrod). It's a "one hot" vector
+    // Each indicator has as many ciphertexe as it takes to store a row of the
+    // keys matrix (i.e., one slot for each dataset recrod). It's a "one hot"
     // vector per column, containing 1 in slots where partial_sums contained i
 
-    // A place holder for the extracted payload, before moving them to
-    // their place in the output columns.
-    Ciphertext<DCRTPoly> to_replicate;
+    // Place holders for the extracted payloads (one per query), before
+    // moving them to their place in the output columns.
+    std::vector<Ciphertext<DCRTPoly>> to_replicate(n_qrys);
     for (size_t j = 0; j < PAYLOAD_DIM; j++) {
       // Steps 1 & 2: Multiply by the indicator to get a single payload value
       // per column, then rotate by j*N_COLS to put that value in the next
       // available slot in its column.
-      for (size_t k = 0; k < indicator.size(); k++) {
-        auto payload_part = get_encrypted_payload(prms.updir(), k, j);
+      for (size_t k = 0; k < indicators[0].size(); k++) {
+        auto payload = get_encrypted_payload(manifest.batch_dir(prms.updir(), k), j);
         // jth row in the k'th matrix
 
-        payload_part = cc->EvalMult(payload_part, indicator[k]);
-
-        // Shift the j'th payload value by j positions in its column, so we
-        // pack all PAYLOAD_DIM=8 values consecutively in their column.
-        if (j == 0 && k == 0) {   // initialize the inner-loop accumulator
-          to_replicate = payload_part->Clone();
-        } else {
-          if (j != 0) {  // shift by j in its column
-            payload_part = cc->EvalRotate(payload_part, -j * prms.getNCols());
+        for (size_t q = 0; q < n_qrys; q++) {
+          auto payload_part = cc->EvalMult(payload, indicators[q][k]);
+
+          // Shift the j'th payload value by j positions in its column, so we
+          // pack all PAYLOAD_DIM=8 values consecutively in their column.
+          if (j == 0 && k == 0) {   // initialize the inner-loop accumulator
+            to_replicate[q] = payload_part->Clone();
+          } else {
+            if (j != 0) {  // shift by j in its column
+              payload_part = cc->EvalRotate(payload_part, -j * prms.getNCols());
+            }
+            to_replicate[q] = cc->EvalAdd(to_replicate[q],payload_part);  // accumulate
           }
-          to_replicate = cc->EvalAdd(to_replicate,payload_part);  // accumulate
         }
         // We assume that indicator has a single 1 in each output column and
         // all else are zero. So for each slot index s<N_SLOTS, at most one
@@ -310,15 +470,7 @@ int main(int argc, char* argv[]) {
       }
     }
 
-    // Step 3: replicate the values across the column
-    // We need to move the (potential) PAYLOAD_DIM non-zero slots in each
-    // output column to positions {i*PAYLOAD_DIM,...,(i+1)*PAYLOAD_DIM-1}
-    // in that column. This is done by first replicating them so that they
-    // fill the entire column, then multiplying by a mask that zero out
-    // everything else, leaving only those positions.
-    auto replicated = total_sums(to_replicate, prms);
-
-    // Step 4: multiply by a mask
+    // The mask for step 4 below, it is the same for all the queries
     std::vector<double> slots(prms.getNSlots(), 0.0);
     for (size_t ell = 0; ell < slots.size(); ell++) {
       int row = ell / prms.getNCols();  // index within column
@@ -326,80 +478,239 @@ int main(int argc, char* argv[]) {
         slots[ell] = 1.0;
       }
     }
-    auto mask = cc->MakeCKKSPackedPlaintext(slots, 1, replicated->GetLevel());
-    auto masked = cc->EvalMult(replicated, mask);
-
-    // Finally, add the payload values to all the other matches in that column
-    if (i == 1) {  // initialize the outter accumulator
-      accumulator = masked;
-    } else {
-      accumulator = cc->EvalAdd(accumulator, masked);
+
+    for (size_t q = 0; q < n_qrys; q++) {
+      // Step 3: replicate the values across the column
+      // We need to move the (potential) PAYLOAD_DIM non-zero slots in each
+      // output column to positions {i*PAYLOAD_DIM,...,(i+1)*PAYLOAD_DIM-1}
+      // in that column. This is done by first replicating them so that they
+      // fill the entire column, then multiplying by a mask that zero out
+      // everything else, leaving only those positions.
+      auto replicated = total_sums(to_replicate[q], prms);
+
+      // Step 4: multiply by a mask
+      auto mask = cc->MakeCKKSPackedPlaintext(slots, 1, replicated->GetLevel());
+      auto masked = cc->EvalMult(replicated, mask);
+
+      // Finally, add the payload values to all the other matches in that column
+      if (i == 1) {  // initialize the outter accumulator
+        accumulators[q] = masked;
+      } else {
+        accumulators[q] = cc->EvalAdd(accumulators[q], masked);
+      }
     }
   }
   log_step(4, "Output compression");
 
+  // Store the accumulated results back to disk, with the server-side times
+  store_results(qry_prms, accumulators, start_computing, start_server, times,
+                manifest);
+}
+
+/*******************************************************************/
+// Write a file atomically: write to a temporary file and then rename it,
+// so that whoever polls for it never sees a partial file
+void write_atomically(const fs::path& fname, const std::string& content) {
+  auto tmp = fname;
+  tmp += ".tmp";
+  {
+    std::ofstream file(tmp);
+    file << content;
+  }
+  fs::rename(tmp, fname);
+}
+
+// The daemon mode: load the keys (and optionally the encrypted database)
+// once, then serve requests from the spool directory until asked to stop.
+// The protocol, all through files in spool_dir, is:
+//  - After loading, the daemon writes ready.json with the load times.
+//  - A client writes <name>.req (atomically, e.g. by renaming a temporary
+//    file) listing the query directories of a batch, one per line.
+//  - The daemon computes on these queries, exactly as when the directories
+//    are given as --query_dir arguments, then deletes <name>.req and writes
+//    <name>.done, or <name>.err with the error message if it failed.
+//  - An empty file named stop tells the daemon to exit.
+int run_daemon(InstanceSize size, bool count_only, fs::path spool_dir,
+               bool resident_db)
+{
+  InstanceParams prms(size);
+  fs::create_directories(spool_dir);
+
+  auto start = std::chrono::steady_clock::now();
+  auto cc = load_keys(prms);
+  if (PackedStore::exists(prms.updir())) {
+    packed_db = std::make_unique<PackedStore>(prms.updir());
+  }
+  std::chrono::duration<double> keys_s = std::chrono::steady_clock::now() - start;
+  log_step(0, "Loading keys");
+
+  start = std::chrono::steady_clock::now();
+  if (resident_db) {
+    auto manifest = DbManifest::read(prms.updir(), prms.getDbSize(), prms.getNSlots());
+    load_resident_db(prms, manifest);
+    db_version = manifest.version;
+    log_step(0, "Loading encrypted database");
+  }
+  std::chrono::duration<double> db_s = std::chrono::steady_clock::now() - start;
+
+  std::stringstream ready;
+  ready << "{\n  \"Load keys\": " << keys_s.count() << ",\n"
+        << "  \"Load database\": " << db_s.count() << ",\n"
+        << "  \"Resident database\": " << (resident_db? "true" : "false")
+        << "\n}\n";
+  write_atomically(spool_dir/"ready.json", ready.str());
+
+  while (!fs::exists(spool_dir/"stop")) {
+    // Serve the pending requests in the order of their names
+    std::vector<fs::path> requests;
+    for (auto& entry : fs::directory_iterator(spool_dir)) {
+      if (entry.path().extension() == ".req") {
+        requests.push_back(entry.path());
+      }
+    }
+    std::sort(requests.begin(), requests.end());
+
+    for (auto& req : requests) {
+      auto start_server = std::chrono::system_clock::now();
+      std::vector<InstanceParams> qry_prms;
+      std::ifstream req_file(req);
+      for (std::string line; std::getline(req_file, line); ) {
+        if (!line.empty()) {
+          qry_prms.emplace_back(size, fs::current_path(), line);
+        }
+      }
+      req_file.close();
+      fs::remove(req);
+
+      auto reply = req;
+      try {
+        if (qry_prms.empty()) {
+          throw std::runtime_error("no query directories in " + req.string());
+        }
+        compute_queries(cc, qry_prms, count_only, start_server);
+        write_atomically(reply.replace_extension(".done"), "");
+      } catch (const std::exception& e) {
+        write_atomically(reply.replace_extension(".err"), e.what());
+      }
+    }
+    if (requests.empty()) {
+      std::this_thread::sleep_for(std::chrono::milliseconds(10));
+    }
+  }
+  fs::remove(spool_dir/"stop");
+  return 0;
+}
+
+/*******************************************************************/
+// Store the result ciphertext of every query in its query directory, along
+// with the server-side time (of the entire batch)
+void store_results(const std::vector<InstanceParams>& qry_prms,
+                   const std::vector<Ciphertext<DCRTPoly>>& results,
+                   std::chrono::system_clock::time_point start_computing,
+                   std::chrono::system_clock::time_point start_server,
+                   const MatVecTimes& times, const DbManifest& manifest)
+{
   // Report the server-side overall computation time
   auto now = std::chrono::system_clock::now();
   int64_t comp_s = std::chrono::duration_cast<std::chrono::seconds>(
     now - start_computing).count();
   int64_t total_s = std::chrono::duration_cast<std::chrono::seconds>(
     now - start_server).count();
-  store_server_time(timing_fname, comp_s, total_s);
 
-  // Store the accumulated result back to disk
-  std::string out_fname = prms.downdir()/"results.bin";
-  if (!Serial::SerializeToFile(out_fname, accumulator, SerType::BINARY)) {
-    throw std::runtime_error("Failed to write ciphertext to " + out_fname);
+  for (size_t q = 0; q < qry_prms.size(); q++) {
+    store_server_time(qry_prms[q].qryiodir()/"server_reported_steps.json",
+                      comp_s, total_s,
+                      {{"Matrix-vector I/O wait", times.io_wait},
+                       {"Matrix-vector compute", times.compute}},
+                      {{"Payload cache", {
+                        {"Bytes requested", payload_cache.bytes_requested},
+                        {"Bytes read", payload_cache.bytes_read},
+                        {"Bytes cached", payload_cache.bytes_cached},
+                        {"Hits", payload_cache.hits},
+                        {"Misses", payload_cache.misses}}},
+                       {"Database", {
+                        {"Version", manifest.version},
+                        {"Records", manifest.n_records},
+                        {"Batches", manifest.n_batches()}}}});
+    std::string out_fname = qry_prms[q].qrydowndir()/"results.bin";
+    if (!Serial::SerializeToFile(out_fname, results[q], SerType::BINARY)) {
+      throw std::runtime_error("Failed to write ciphertext to " + out_fname);
+    }
   }
-  return 0;
 }
-/*******************************************************************/
-/*******************************************************************/
-
 
 /*******************************************************************/
 // Matrix-vector product: The matrix rows are stored on disk in batches
-// under iodir/<size>/encrypted/batchNNNN/. The query ciphertext contains
-// the query vector, repeatd to fill in all the slots.
-std::vector<Ciphertext<DCRTPoly>> mat_vec_mult(fs::path encdir,
-                Ciphertext<DCRTPoly> qry, const InstanceParams& prms)
+// under iodir/<size>/encrypted/batchNNNN/. Each query ciphertext contains
+// a query vector, repeatd to fill in all the slots.
+std::vector<std::vector<Ciphertext<DCRTPoly>>> mat_vec_mult(fs::path encdir,
+    const DbManifest& manifest,
+    const std::vector<Ciphertext<DCRTPoly>>& qrys, const InstanceParams& prms,
+    MatVecTimes& times)
 {
-  CryptoContext<DCRTPoly> cc = qry->GetCryptoContext();
-
-  // The input ciphertext includes a pattern of length RECORD_DIM,
-  // repeated N_SLOTS/RECORD_DIM many times to fill all the slot
+  auto start = std::chrono::steady_clock::now();
+  CryptoContext<DCRTPoly> cc = qrys[0]->GetCryptoContext();
+  size_t n_qrys = qrys.size();
+
+  // The input ciphertexts include a pattern of length RECORD_DIM,
+  // repeated N_SLOTS/RECORD_DIM many times to fill all the slot. There is
+  // a replicator for each query, they all produce the replicas in the same
+  // order so we can advance them together.
   auto n_reps = prms.getNSlots() / prms.getRecordDim();
-  DFSSlotReplicator replicator(cc, prms.getDegrees(), n_reps);
-
-  auto n_batches = prms.getNCtxts();
-  std::vector<Ciphertext<DCRTPoly>> acc(n_batches);  // an accumulator
-  size_t i = 0;  // i is the ciphertext index within a batch
-  for (auto ct_i = replicator.init(qry); ct_i != nullptr;
-       ct_i = replicator.next_replica(), i++) {
-       // ct_i has the i'th entry of the query vector in all its slots
-
-    // read a row from each batch, multiply by ct_i and accumulate
-    std::stringstream ssi;
-    ssi << std::setw(4) << std::setfill('0') << i;
+  std::vector<DFSSlotReplicator> replicators;
+  std::vector<Ciphertext<DCRTPoly>> cts_i(n_qrys);
+  for (size_t q = 0; q < n_qrys; q++) {
+    auto qry = qrys[q];
+    replicators.emplace_back(cc, prms.getDegrees(), n_reps);
+    cts_i[q] = replicators[q].init(qry);
+  }
+
+  // The number of batches, and the directory of each one, are in the
+  // manifest (the dataset may have grown since it was first encrypted)
+  int n_batches = manifest.n_batches();
+
+  // The rows are used in the order row_0000 of all the batches, then
+  // row_0001 of all the batches, etc. (one row per entry of the query)
+  std::vector<fs::path> row_fnames;
+  for (int i = 0; i < prms.getRecordDim(); i++) {
+    for (int j = 0; j < n_batches; j++) {
+      row_fnames.push_back(manifest.batch_dir(encdir, j) / ct_file_name("row_", i));
+    }
+  }
+  Prefetcher<Ciphertext<DCRTPoly>> rows(row_fnames, get_ctxt,
+                                        prefetch_depth, PREFETCH_READERS);
+
+  std::vector<std::vector<Ciphertext<DCRTPoly>>> acc( // an accumulator
+      n_qrys, std::vector<Ciphertext<DCRTPoly>>(n_batches)); // per query
+  for (size_t i = 0; cts_i[0] != nullptr; i++) { // i is the index in a batch
+    // cts_i[q] has the i'th entry of the q'th query in all its slots
+
+    // get a row from each batch, multiply by all the cts_i and accumulate
     for (int j = 0; j < n_batches; j++) {  // j is the batch index
-      std::stringstream ssj;
-      ssj << std::setw(4) << std::setfill('0') << j;
-
-      auto ct_fname = encdir /
-          ("batch" + ssj.str()) / ("row_" + ssi.str() + ".bin");
-      Ciphertext<DCRTPoly> ct = get_ctxt(ct_fname);
-      ct = cc->EvalMultNoRelin(ct, ct_i);
-      if (i == 0) {  // initialize the accumulator
-        acc[j] = ct;
-      } else {       // add to the accumulator
-        cc->EvalAddInPlace(acc[j], ct);
+      Ciphertext<DCRTPoly> ct = rows.next();
+      for (size_t q = 0; q < n_qrys; q++) {
+        auto prod = cc->EvalMultNoRelin(ct, cts_i[q]);
+        if (i == 0) {  // initialize the accumulator
+          acc[q][j] = prod;
+        } else {       // add to the accumulator
+          cc->EvalAddInPlace(acc[q][j], prod);
+        }
       }
     }
+    for (size_t q = 0; q < n_qrys; q++) {
+      cts_i[q] = replicators[q].next_replica();
+    }
   }
   // relinearize the accumulators
-  for (int j = 0; j < n_batches; j++) {
-    cc->RelinearizeInPlace(acc[j]);
+  for (auto& qry_acc : acc) {
+    for (auto& ct : qry_acc) {
+      cc->RelinearizeInPlace(ct);
+    }
   }
+
+  std::chrono::duration<double> elapsed = std::chrono::steady_clock::now() - start;
+  times.io_wait = rows.wait_seconds();
+  times.compute = elapsed.count() - times.io_wait;
   return acc;
 }
 
@@ -492,18 +803,41 @@ Ciphertext<DCRTPoly> total_sums(
 }
 
 // Read the ith payload value in a batch of records from disk
-Ciphertext<DCRTPoly> get_encrypted_payload(fs::path datadir, size_t batch,
-                                            size_t idx) {
-  std::stringstream ssi, ssj;
-  ssj << std::setw(4) << std::setfill('0') << batch;
-  ssi << std::setw(4) << std::setfill('0') << idx;
-  auto dir = datadir / ("batch" + ssj.str());
-  auto ct_fname = dir / ("payload_" + ssi.str() + ".bin");
-
-  // read the i'th payload ciphertext from this batch
-  Ciphertext<DCRTPoly> result;
-  if (!Serial::DeserializeFromFile(ct_fname, result, SerType::BINARY)) {
-    throw std::runtime_error("failed to read ciphertext from " + ct_fname.string());
-  }
-  return result;
+Ciphertext<DCRTPoly> get_encrypted_payload(fs::path batch_dir, size_t idx) {
+  auto ct_fname = batch_dir / ct_file_name("payload_", idx);
+
+  // read the i'th payload ciphertext from this batch, or get it from the
+  // cache (unless the entire dataset is resident in memory anyway)
+  if (!resident_cts.empty()) {
+    return get_ctxt(ct_fname);
+  }
+  PackedStore::Record rec;
+  if (packed_db && packed_db->find(ct_fname.string(), rec)) {
+    return payload_cache.get(ct_fname.string(), rec.length, packed_db->version(),
+                             [&ct_fname] { return get_ctxt(ct_fname); });
+  }
+  return payload_cache.get(ct_fname, get_ctxt);
+}
+
+// Read all the ciphertexts of a version of the encrypted dataset into
+// resident_cts. The ciphertexts of the batches that did not change since
+// the previous version are already there, and those of the batches that
+// this version replaced are dropped.
+void load_resident_db(const InstanceParams& prms, const DbManifest& manifest) {
+  std::unordered_map<std::string, Ciphertext<DCRTPoly>> cts;
+  for (size_t b = 0; b < manifest.n_batches(); b++) {
+    auto dir = manifest.batch_dir(prms.updir(), b);
+    std::vector<fs::path> fnames;
+    for (int i = 0; i < prms.getRecordDim(); i++) {
+      fnames.push_back(dir / ct_file_name("row_", i));
+    }
+    for (size_t j = 0; j < PAYLOAD_DIM; j++) {
+      fnames.push_back(dir / ct_file_name("payload_", j));
+    }
+    for (auto& fname : fnames) {
+      auto it = resident_cts.find(fname.string());
+      cts[fname.string()] = (it != resident_cts.end())? it->second : get_ctxt(fname);
+    }
+  }
+  resident_cts = std::move(cts);
 }
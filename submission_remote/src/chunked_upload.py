@@ -0,0 +1,150 @@
+"""
+chunked_upload.py - Upload a file to the server in chunks, with several
+chunks in flight, a checksum per chunk, and resume from the chunks that
+the server already acknowledged.
+
+The protocol (over HTTP, JSON bodies):
+    POST /uploads                   {"name", "size", "chunk_size", "sha256"}
+        -> {"id", "received": [indices of the chunks already stored]}
+        The id is derived from the name and the checksum of the file, so
+        starting the same upload again resumes it.
+    PUT  /uploads/<id>/chunks/<i>   the bytes of chunk i, with the header
+        X-Chunk-SHA256. The server replies 204 once the chunk is stored, or
+        400 if the checksum or length do not match (the chunk is resent).
+    POST /uploads/<id>/complete
+        -> {"name", "size", "sha256"} once all the chunks are stored and the
+        checksum of the whole file matches.
+    GET  /files/<name>
+        -> {"name", "size"} if the server has a completed upload of that
+        name, 404 otherwise. Content-addressed names (e.g. the evaluation key
+        by its fingerprint) let the client skip uploading it again.
+
+The harness has a stand-in server implementing this protocol, see
+harness/upload_server.py. Usage for benchmarking an upload on its own:
+    python3 submission_remote/src/chunked_upload.py <file> <url>
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import threading
+import http.client
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+
+CHUNK_SIZE = 8 << 20   # bytes per chunk
+IN_FLIGHT = 4          # chunks sent concurrently
+MAX_RETRIES = 5        # attempts per request before giving up
+
+class UploadError(Exception):
+    pass
+
+class _Connections:
+    """One keep-alive HTTP connection per thread."""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.cls = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        self.netloc = parts.netloc
+        self.prefix = parts.path.rstrip("/")
+        self.local = threading.local()
+
+    def request(self, method, path, body=None, headers=None):
+        """Send a request, reconnecting and retrying on connection errors."""
+        for attempt in range(MAX_RETRIES):
+            conn = getattr(self.local, "conn", None)
+            if conn is None:
+                conn = self.local.conn = self.cls(self.netloc, timeout=60)
+            try:
+                conn.request(method, self.prefix + path, body=body, headers=headers or {})
+                resp = conn.getresponse()
+                return resp.status, resp.read()
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                self.local.conn = None
+                time.sleep(0.5 * 2 ** attempt)
+        raise UploadError(f"{method} {path}: no response after {MAX_RETRIES} attempts")
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def upload(path, url, name=None, chunk_size=CHUNK_SIZE, in_flight=IN_FLIGHT):
+    """
+    Upload a file, return a dict with the bytes sent, the elapsed time,
+    and the number of chunks sent and skipped (already on the server).
+    """
+    start = time.perf_counter()
+    name = name or os.path.basename(path)
+    size = os.path.getsize(path)
+    n_chunks = max(1, (size + chunk_size - 1) // chunk_size)
+    conns = _Connections(url)
+
+    status, body = conns.request("POST", "/uploads", json.dumps(
+        {"name": name, "size": size, "chunk_size": chunk_size,
+         "sha256": file_sha256(path)}), {"Content-Type": "application/json"})
+    if status != 200:
+        raise UploadError(f"cannot start upload of {name}: {status} {body!r}")
+    session = json.loads(body)
+    received = set(session["received"])
+    todo = [i for i in range(n_chunks) if i not in received]
+
+    fd = os.open(path, os.O_RDONLY)
+
+    def send(i):
+        data = os.pread(fd, chunk_size, i * chunk_size)
+        headers = {"X-Chunk-SHA256": hashlib.sha256(data).hexdigest(),
+                   "Content-Type": "application/octet-stream"}
+        for _ in range(MAX_RETRIES):
+            status, body = conns.request("PUT", f"/uploads/{session['id']}/chunks/{i}",
+                                         data, headers)
+            if status == 204:
+                return len(data)
+            if status != 400:  # 400 = corrupted in transit, send again
+                break
+        raise UploadError(f"chunk {i} of {name} rejected: {status} {body!r}")
+
+    try:
+        with ThreadPoolExecutor(in_flight) as pool:
+            sent = sum(pool.map(send, todo))
+    finally:
+        os.close(fd)
+
+    status, body = conns.request("POST", f"/uploads/{session['id']}/complete")
+    if status != 200:
+        raise UploadError(f"cannot complete upload of {name}: {status} {body!r}")
+    return {"name": name, "bytes": size, "sent": sent,
+            "chunks": n_chunks, "resumed": n_chunks - len(todo),
+            "seconds": time.perf_counter() - start}
+
+def has_file(url, name) -> bool:
+    """Does the server already have a completed upload of this name?"""
+    status, _ = _Connections(url).request("GET", f"/files/{name}")
+    return status == 200
+
+def upload_and_report(path, url, report_path, name=None, skip_existing=False):
+    """
+    Upload a file, and write its statistics to report_path for the harness.
+    With skip_existing, nothing is sent if the server already has the file.
+    """
+    start = time.perf_counter()
+    if skip_existing and has_file(url, name or os.path.basename(path)):
+        stats = {"name": name or os.path.basename(path), "bytes": os.path.getsize(path),
+                 "sent": 0, "chunks": 0, "resumed": 0, "skipped": True,
+                 "seconds": time.perf_counter() - start}
+    else:
+        stats = upload(path, url, name)
+    with open(report_path, "w") as f:
+        json.dump(stats, f)
+    return stats
+
+
+if __name__ == "__main__":
+    stats = upload(sys.argv[1], sys.argv[2])
+    print(f"{stats['bytes']} bytes in {stats['seconds']:.4f}s",
+          f"({stats['bytes'] / stats['seconds'] / 1e6:.1f} MB/s,",
+          f"{stats['chunks']} chunks, {stats['resumed']} already on the server)")
@@ -8,12 +8,12 @@ import submission_utils
 
 local_file_paths, _ = submission_utils.init(sys.argv)
 
-ct_res     = pickle.load(open(local_file_paths.get_ct_download_path("results"), "rb"))
-context    = pickle.load(open(local_file_paths.PATH_CONTEXT, "rb"))
-secret_key = pickle.load(open(local_file_paths.PATH_SK, "rb"))
+ct_res     = pickle.load(open(local_file_paths.get_qry_download_path("results"), "rb"))
+context    = submission_utils.load_pickle(local_file_paths.PATH_CONTEXT)
+secret_key = submission_utils.load_pickle(local_file_paths.PATH_SK)
 
 serialized_res = toolkit_interface.dec(context, secret_key, ct_res,)
 raw_result = load_proto_tensor(serialized_res)
 
-pickle.dump(raw_result, open(local_file_paths.PATH_RAW_RESULT, "wb"))
+submission_utils.save_array(local_file_paths.PATH_RAW_RESULT, raw_result)
 
@@ -15,8 +15,8 @@ local_file_paths, instance_params = submission_utils.init(sys.argv)
 record_dim = InstanceParams(instance_params.size).get_record_dim()
 
 # Load context and secret key from step 3
-context =    pickle.load(open(local_file_paths.PATH_CONTEXT, "rb"))
-secret_key = pickle.load(open(local_file_paths.PATH_SK,      "rb"))
+context =    submission_utils.load_pickle(local_file_paths.PATH_CONTEXT)
+secret_key = submission_utils.load_pickle(local_file_paths.PATH_SK)
 
 # Read the query vector
 query_tensor = torch.from_numpy(np.fromfile(local_file_paths.QUERY_PATH, dtype=np.float32))
@@ -30,4 +30,4 @@ ct = toolkit_interface.enc(
     pack_for_transmission=True,
     n_axis_external=0
 )
-pickle.dump(ct, open(local_file_paths.get_ct_upload_path("query"), "wb"))
+pickle.dump(ct, open(local_file_paths.get_qry_upload_path("query"), "wb"))
@@ -1,17 +1,42 @@
 """
 client_key_generation.py - Generate and save FHE keys
+
+Keys generated for the same context and homomorphic sequence by an earlier
+run are taken from the key store instead (see key_store.py).
 """
+import json
 import pickle
 import sys
 import lattica_query.query_toolkit as toolkit_interface
 import submission_utils
+from key_store import KeyStore, key_fingerprint
+from harness.artifact_cache import file_digest
+
+local_file_paths, instance_params = submission_utils.init(sys.argv)
+
+store = KeyStore(instance_params.rootdir)
+fingerprint = key_fingerprint(local_file_paths.PATH_CONTEXT, local_file_paths.PATH_HOM_SEQ)
+key_files = {"sk.pkl": local_file_paths.PATH_SK, "ek.pkl": local_file_paths.PATH_EK}
+entry = store.lookup_keys(fingerprint)
 
-local_file_paths, _ = submission_utils.init(sys.argv)
+if entry is not None:
+    KeyStore.restore(entry, key_files)
+    ek_sha256 = json.loads((entry / "meta.json").read_text())["ek_sha256"]
+else:
+    context = submission_utils.load_pickle(local_file_paths.PATH_CONTEXT)
+    hom_seq = submission_utils.load_pickle(local_file_paths.PATH_HOM_SEQ)
 
-context = pickle.load(open(local_file_paths.PATH_CONTEXT, "rb"))
-hom_seq = pickle.load(open(local_file_paths.PATH_HOM_SEQ, "rb"))
+    sk, ek = toolkit_interface.generate_key(hom_seq, context)
 
-sk, ek = toolkit_interface.generate_key(hom_seq, context)
+    # Write new files, never through a link into the key store
+    for path in key_files.values():
+        path.unlink(missing_ok=True)
+    pickle.dump(ek, open(local_file_paths.PATH_EK, "wb"))
+    pickle.dump(sk, open(local_file_paths.PATH_SK, "wb"))
+    ek_sha256 = file_digest(local_file_paths.PATH_EK).hexdigest()
+    store.store_keys(fingerprint, key_files, ek_sha256)
 
-pickle.dump(ek, open(local_file_paths.PATH_EK, "wb"))
-pickle.dump(sk, open(local_file_paths.PATH_SK, "wb"))
+# Tell the harness (and the evaluation-key upload) which keys are used
+with open(local_file_paths.KEY_STORE_REPORT_PATH, "w") as f:
+    json.dump({"fingerprint": fingerprint, "ek_sha256": ek_sha256,
+               "hit": entry is not None}, f)
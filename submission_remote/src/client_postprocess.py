@@ -1,4 +1,3 @@
-import pickle
 import sys
 from submission_utils import PAYLOAD_MAX, PAYLOAD_PRECISION
 
@@ -21,7 +20,7 @@ def _extract_final_results(a):
     return a[:, 1:]
 
 
-raw_result = pickle.load(open(local_file_paths.PATH_RAW_RESULT, "rb"))
+raw_result = submission_utils.load_tensor(local_file_paths.PATH_RAW_RESULT)
 results_np = _extract_final_results(raw_result)
 
 results_np = results_np[np.lexsort(results_np.T[::-1])]
@@ -1,12 +1,10 @@
 """
 client_preprocess_dataset.py - Adjust db.bin and payloads.bin as numpy files
 """
-import pickle
 import sys
 import numpy as np
-import torch
 
-from submission_utils import PAYLOAD_MAX, PAYLOAD_PRECISION
+from submission_utils import PAYLOAD_MAX, PAYLOAD_PRECISION, PREPROCESS_CHUNK_ROWS
 import submission_utils
 
 local_file_paths, instance_params = submission_utils.init(sys.argv)
@@ -16,21 +14,25 @@ db_size     = instance_params.get_db_size()
 record_dim  = instance_params.get_record_dim()
 payload_dim = instance_params.payload_dim
 
-# Read database vectors (float32)
-db = np.fromfile(local_file_paths.DB_PATH, dtype=np.float32)
-db = db.reshape((db_size, record_dim))
-db = torch.from_numpy(db)
+# Map the database vectors (float32) and payload vectors (int16)
+db = np.memmap(local_file_paths.DB_PATH, dtype=np.float32, mode="r",
+               shape=(db_size, record_dim))
+payloads = np.memmap(local_file_paths.PAYLOAD_PATH, dtype=np.int16, mode="r",
+                     shape=(db_size, payload_dim))
 
-# Read payload vectors (int16)
-payloads = np.fromfile(local_file_paths.PAYLOAD_PATH, dtype=np.int16)
-payloads = payloads.reshape((db_size, payload_dim))
+# The outputs are written one chunk of rows at a time, so only a chunk of
+# the dataset is in memory at once
+db_out = submission_utils.create_array(local_file_paths.PROCESSED_DB_PATH,
+                                       np.float32, (db_size, record_dim))
+# Add marker value (2*PAYLOAD_MAX=1024) to each payload to make it 8 values,
+# scaled down by PAYLOAD_PRECISION
+payload_out = submission_utils.create_array(local_file_paths.PROCESSED_PAYLOAD_PATH,
+                                            np.float64, (db_size, payload_dim + 1))
+for start in range(0, db_size, PREPROCESS_CHUNK_ROWS):
+    end = min(start + PREPROCESS_CHUNK_ROWS, db_size)
+    db_out[start:end] = db[start:end]
+    payload_out[start:end, 0] = 2 * PAYLOAD_MAX / PAYLOAD_PRECISION
+    payload_out[start:end, 1:] = payloads[start:end] / PAYLOAD_PRECISION
 
-# Add marker value (2*PAYLOAD_MAX=1024) to each payload to make it 8 int16 values
-marker = np.full((db_size, 1), 2 * PAYLOAD_MAX, dtype=np.int16)
-extended_payloads = np.concatenate([marker, payloads], axis=1)
-extended_payloads = extended_payloads / PAYLOAD_PRECISION
-payload = torch.from_numpy(extended_payloads)
-
-# Save
-pickle.dump(db,      open(local_file_paths.PROCESSED_DB_PATH,      "wb"))
-pickle.dump(payload, open(local_file_paths.PROCESSED_PAYLOAD_PATH, "wb"))
+db_out.flush()
+payload_out.flush()
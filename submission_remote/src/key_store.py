@@ -0,0 +1,111 @@
+"""
+key_store.py - A client-side store of the keys and the server parameters,
+so that re-runs against the same backend skip key generation and the
+evaluation-key upload.
+
+The store is kept under <root>/cache/remote_keys (outside the io directory,
+which the harness removes at the start of each run):
+    params/<instance>/     context.pkl, hom_seq.pkl from server_get_params
+    keys/<fingerprint>/    sk.pkl, ek.pkl generated for that context
+Keys are looked up by a fingerprint of the context and the homomorphic
+sequence. Each entry has a meta.json with its creation and last-use times
+and its size. Entries older than their maximal age are dropped when they
+are looked up, and the least recently used keys are evicted when the store
+grows beyond KEYS_MAX_BYTES.
+
+NOTE: the store holds secret keys, so its directories are private to the
+user (mode 0700), as the io directory should be.
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+from pathlib import Path
+from harness.artifact_cache import file_digest, link_or_copy
+
+PARAMS_MAX_AGE = 24 * 3600       # refetch the server parameters daily
+KEYS_MAX_AGE = 7 * 24 * 3600     # regenerate the keys weekly
+KEYS_MAX_BYTES = 16 << 30        # evict keys beyond this total size
+
+def key_fingerprint(context_path, hom_seq_path) -> str:
+    """The fingerprint of the keys for a context and homomorphic sequence."""
+    h = hashlib.sha256()
+    for path in [context_path, hom_seq_path]:
+        file_digest(Path(path), h)
+    return h.hexdigest()[:32]
+
+class KeyStore:
+    """The store of server parameters and keys, in a directory."""
+
+    def __init__(self, rootdir):
+        self.root = Path(rootdir) / "cache" / "remote_keys"
+
+    def _fresh_entry(self, entry: Path, max_age: float) -> Path | None:
+        """Return the entry if it exists and has not expired (else remove it)."""
+        meta_path = entry / "meta.json"
+        if not meta_path.exists():
+            return None
+        meta = json.loads(meta_path.read_text())
+        if time.time() - meta["created"] > max_age:
+            shutil.rmtree(entry, ignore_errors=True)
+            return None
+        meta["last_used"] = time.time()
+        meta_path.write_text(json.dumps(meta, indent=2))
+        return entry
+
+    def _store(self, entry: Path, files: dict[str, Path], extra: dict = None) -> Path:
+        """Store files (names to source paths) as a new entry, atomically."""
+        tmp = entry.with_name(entry.name + ".tmp")
+        if tmp.exists():
+            shutil.rmtree(tmp)
+        tmp.mkdir(parents=True, mode=0o700)
+        os.chmod(self.root, 0o700)
+        for name, src in files.items():
+            link_or_copy(Path(src), tmp / name)
+        now = time.time()
+        size = sum(os.path.getsize(tmp / name) for name in files)
+        meta = {"created": now, "last_used": now, "bytes": size, **(extra or {})}
+        (tmp / "meta.json").write_text(json.dumps(meta, indent=2))
+        if entry.exists():
+            shutil.rmtree(entry)
+        tmp.rename(entry)
+        return entry
+
+    @staticmethod
+    def restore(entry: Path, files: dict[str, Path]):
+        """Restore the files of an entry to their destinations."""
+        for name, dst in files.items():
+            Path(dst).unlink(missing_ok=True)
+            link_or_copy(entry / name, Path(dst))
+
+    def lookup_params(self, instance: str) -> Path | None:
+        return self._fresh_entry(self.root / "params" / instance, PARAMS_MAX_AGE)
+
+    def store_params(self, instance: str, files: dict[str, Path]) -> Path:
+        return self._store(self.root / "params" / instance, files)
+
+    def lookup_keys(self, fingerprint: str) -> Path | None:
+        return self._fresh_entry(self.root / "keys" / fingerprint, KEYS_MAX_AGE)
+
+    def store_keys(self, fingerprint: str, files: dict[str, Path], ek_sha256: str) -> Path:
+        """Store the keys for a fingerprint, then evict old keys if needed."""
+        entry = self._store(self.root / "keys" / fingerprint, files, {"ek_sha256": ek_sha256})
+        self.evict(keep=entry)
+        return entry
+
+    def evict(self, keep: Path = None):
+        """Remove the least recently used keys beyond KEYS_MAX_BYTES."""
+        entries = []
+        for entry in (self.root / "keys").iterdir():
+            meta_path = entry / "meta.json"
+            if entry != keep and meta_path.exists():
+                entries.append((json.loads(meta_path.read_text()), entry))
+        total = sum(meta["bytes"] for meta, _ in entries)
+        if keep is not None:
+            total += json.loads((keep / "meta.json").read_text())["bytes"]
+        for meta, entry in sorted(entries, key=lambda e: e[0]["last_used"]):
+            if total <= KEYS_MAX_BYTES:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= meta["bytes"]
@@ -2,6 +2,8 @@ import sys
 import pickle
 
 import submission_utils
+from key_store import KeyStore
+from harness.params import instance_name
 from lattica_query.auth import get_demo_token
 
 local_file_paths, instance_params = submission_utils.init(sys.argv)
@@ -13,11 +15,20 @@ if instance_params.size == 0:
 else:
     raise ValueError("Submission is publicly available only for SIZE=0, for other sizes please contact hello@lattica.ai.")
 
+# Reuse the encryption params and model metadata fetched by an earlier run
+store = KeyStore(instance_params.rootdir)
+params_files = {"context.pkl": local_file_paths.PATH_CONTEXT,
+                "hom_seq.pkl": local_file_paths.PATH_HOM_SEQ}
+instance = instance_name(instance_params.size, False)
+entry = store.lookup_params(instance)
+if entry is not None:
+    KeyStore.restore(entry, params_files)
+else:
+    # Get encryption params and model metadata from BE
+    client = submission_utils.get_lattica_client(local_file_paths)
+    context, hom_seq = client.get_init_data()
 
-# Get encryption params and model metadata from BE
-client = submission_utils.get_lattica_client(local_file_paths)
-context, hom_seq = client.get_init_data()
-
-# Save data to local file system
-pickle.dump(context, open(local_file_paths.PATH_CONTEXT, "wb"))
-pickle.dump(hom_seq, open(local_file_paths.PATH_HOM_SEQ, "wb"))
+    # Save data to local file system
+    pickle.dump(context, open(local_file_paths.PATH_CONTEXT, "wb"))
+    pickle.dump(hom_seq, open(local_file_paths.PATH_HOM_SEQ, "wb"))
+    store.store_params(instance, params_files)
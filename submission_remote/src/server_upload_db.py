@@ -3,8 +3,15 @@ server_preprocess_dataset.py - Upload database to server
 """
 import sys
 import submission_utils
+from chunked_upload import upload_and_report
 
-local_file_paths, _ = submission_utils.init(sys.argv)
-client = submission_utils.get_lattica_client(local_file_paths)
+local_file_paths, instance_params = submission_utils.init(sys.argv)
 archive_path = local_file_paths.get_ct_upload_path("db_and_payloads_zip")
-client.upload_custom_encrypted_data(archive_path)
+# With --upload_url the backend never gets the upload, it only benchmarks
+# the upload protocol (the harness then stops before the queries)
+if instance_params.upload_url:
+    upload_and_report(archive_path, instance_params.upload_url,
+                      local_file_paths.get_upload_report_path("db"))
+else:
+    client = submission_utils.get_lattica_client(local_file_paths)
+    client.upload_custom_encrypted_data(archive_path)
@@ -1,14 +1,25 @@
 import sys
+import json
 import pickle
 import submission_utils
+from chunked_upload import upload_and_report
 
-local_file_paths, _ = submission_utils.init(sys.argv)
-
-client = submission_utils.get_lattica_client(local_file_paths)
+local_file_paths, instance_params = submission_utils.init(sys.argv)
 
 ek = pickle.load(open(local_file_paths.PATH_EK, "rb"))
 temp_filename = 'ek.lpk'
 with open(temp_filename, 'wb') as handle:
     handle.write(ek)
 
-client.upload_evaluation_key_file(temp_filename)
+# With --upload_url the backend never gets the upload, it only benchmarks
+# the upload protocol (the harness then stops before the queries)
+if instance_params.upload_url:
+    # The key is uploaded under its fingerprint, and skipped if the server
+    # already has it from an earlier run
+    key_report = json.loads(local_file_paths.KEY_STORE_REPORT_PATH.read_text())
+    upload_and_report(temp_filename, instance_params.upload_url,
+                      local_file_paths.get_upload_report_path("ek"),
+                      name=f"ek-{key_report['ek_sha256'][:32]}.lpk", skip_existing=True)
+else:
+    client = submission_utils.get_lattica_client(local_file_paths)
+    client.upload_evaluation_key_file(temp_filename)
@@ -1,4 +1,6 @@
 import pickle
+import numpy as np
+import torch
 
 from lattica_query.lattica_query_client import QueryClient
 from harness.params import InstanceParams as HarnessInstanceParams, instance_name, PAYLOAD_DIM
@@ -8,6 +10,10 @@ import os
 PAYLOAD_PRECISION = 16
 PAYLOAD_MAX = 512
 
+# Rows of the dataset handled at a time when preprocessing, this bounds
+# the memory used regardless of the instance size
+PREPROCESS_CHUNK_ROWS = 1 << 16
+
 
 def init(argv, mute_logs=True):
     if mute_logs:
@@ -23,7 +29,10 @@ def init(argv, mute_logs=True):
 class InstanceParams(HarnessInstanceParams):
     def __init__(self, argv):
         self.size = int(argv[1])
-        super().__init__(self.size)
+        querydir = argv[argv.index("--query_dir") + 1] if "--query_dir" in argv[:-1] else None
+        # Upload to this server with the chunked protocol (see chunked_upload.py)
+        self.upload_url = argv[argv.index("--upload_url") + 1] if "--upload_url" in argv[:-1] else None
+        super().__init__(self.size, querydir=querydir)
         self.n_slots = 2**9 if self.size == 0 else 2**15
         self.n_cols  = self.n_slots // 64
         self.count_only = len(argv) > 2 and argv[2] == "--count_only"
@@ -37,34 +46,94 @@ class LocalFilePaths:
 
         self.DB_PATH      = DATA_DIR / "db.bin"
         self.PAYLOAD_PATH = DATA_DIR / "payloads.bin"
-        self.QUERY_PATH   = DATA_DIR / "query.bin"
+        self.QUERY_PATH   = instance_params.qrydatadir() / "query.bin"
 
 
-        self.PROCESSED_DB_PATH      = IO_DIR / "db.pkl"
-        self.PROCESSED_PAYLOAD_PATH = IO_DIR / "payloads.pkl"
+        self.PROCESSED_DB_PATH      = IO_DIR / "db.npy"
+        self.PROCESSED_PAYLOAD_PATH = IO_DIR / "payloads.npy"
         self.PATH_CONTEXT           = IO_DIR / "context.pkl"
         self.PATH_HOM_SEQ           = IO_DIR / "hom_seq.pkl"
         self.PATH_ACCESS_TOKEN      = IO_DIR / "access_token.pkl"
         self.PATH_SK                = IO_DIR / "sk.pkl"
+        self.KEY_STORE_REPORT_PATH  = IO_DIR / "key_store.json"
         self.PK_DIR                 = IO_DIR / "keys"
         self.CT_UPLOAD_DIR          = IO_DIR / "ciphertexts_upload"
         self.CT_DOWNLOAD_DIR        = IO_DIR / "ciphertexts_download"
-        self.PATH_RAW_RESULT        = IO_DIR / "raw_result.pkl"
-        self.PREDICTIONS_PATH       = IO_DIR / "results.bin"
-        self.SERVER_TIMES_PATH      = IO_DIR / "server_reported_steps.json"
+        self.IO_DIR                 = IO_DIR
+
+        # Per-query files, in a separate directory if the harness set one
+        QRY_IO_DIR = instance_params.qryiodir()
+        self.QRY_CT_UPLOAD_DIR      = instance_params.qryupdir()
+        self.QRY_CT_DOWNLOAD_DIR    = instance_params.qrydowndir()
+        self.PATH_RAW_RESULT        = QRY_IO_DIR / "raw_result.npy"
+        self.PREDICTIONS_PATH       = QRY_IO_DIR / "results.bin"
+        self.SERVER_TIMES_PATH      = QRY_IO_DIR / "server_reported_steps.json"
 
         self.PK_DIR.mkdir(parents=True, exist_ok=True)
         self.CT_UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
         self.CT_DOWNLOAD_DIR.mkdir(parents=True, exist_ok=True)
+        self.QRY_CT_UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+        self.QRY_CT_DOWNLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
         self.PATH_EK = self.PK_DIR / "ek.pkl"
 
+    def get_upload_report_path(self, name):
+        return self.IO_DIR / f"upload_{name}.json"
+
     def get_ct_upload_path(self, name):
         return self.CT_UPLOAD_DIR / f"{name}.bin"
 
     def get_ct_download_path(self, name):
         return self.CT_DOWNLOAD_DIR / f"{name}.bin"
 
+    def get_qry_upload_path(self, name):
+        return self.QRY_CT_UPLOAD_DIR / f"{name}.bin"
+
+    def get_qry_download_path(self, name):
+        return self.QRY_CT_DOWNLOAD_DIR / f"{name}.bin"
+
+# Objects loaded by earlier steps. When the harness runs all the steps in
+# one process (run_submission.py --persistent_runner) this module stays
+# imported, so the context, keys and client are loaded only once.
+_pickle_cache = {}
+_client_cache = {}
+
+def _file_key(path):
+    st = os.stat(path)
+    return (str(path), st.st_size, st.st_mtime_ns)
+
+def load_pickle(path):
+    """Unpickle a file, reusing the object if the file did not change."""
+    key = _file_key(path)
+    if key not in _pickle_cache:
+        with open(path, "rb") as f:
+            _pickle_cache[key] = pickle.load(f)
+    return _pickle_cache[key]
+
 def get_lattica_client(local_file_paths):
-    access_token = pickle.load(open(local_file_paths.PATH_ACCESS_TOKEN, "rb"))
-    return QueryClient(access_token)
+    key = _file_key(local_file_paths.PATH_ACCESS_TOKEN)
+    if key not in _client_cache:
+        _client_cache[key] = QueryClient(load_pickle(local_file_paths.PATH_ACCESS_TOKEN))
+    return _client_cache[key]
+
+# The intermediate arrays between the client steps are stored as .npy
+# files (a small header, padded so the data is 64-byte aligned, followed
+# by the raw array). They are read back as tensors over a memory mapping
+# of the file, without copying or unpickling them.
+def create_array(path, dtype, shape):
+    """Create a .npy file and return it as a writable memory-mapped array."""
+    return np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+
+def save_array(path, array):
+    """Write an array (or a CPU tensor) to a .npy file."""
+    if isinstance(array, torch.Tensor):
+        array = array.numpy()
+    np.save(path, array, allow_pickle=False)
+
+def load_tensor(path):
+    """
+    A tensor view of a .npy file. The mapping is copy-on-write, so the
+    tensor can be modified in memory without changing the file.
+    """
+    return torch.from_numpy(np.load(path, mmap_mode="c", allow_pickle=False))
+